@@ -6,14 +6,14 @@ __license__ = "GPL"
 __version__ = "0.0"
 __status__ = "Development"
 
+# matplotlib and sklearn are slow to import, so they are imported by the
+# functions that use them and nothing is loaded until a function asks for it.
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from sklearn.cluster import DBSCAN
-from sklearn.preprocessing import StandardScaler
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF, ConstantKernel as C
-from sklearn.gaussian_process.kernels import DotProduct, WhiteKernel
+import features # derived columns for the analysis
+import clustering # DBSCAN for large tables
+import rendering # headless plots of large tables
+import analysis_store # memory-mapped columns of the listings
 
 # Fixing random state for reproducibility
 np.random.seed(19680801)
@@ -23,6 +23,9 @@ np.random.seed(19680801)
 # costs money. We want to avoid paying for more API calls when we already
 # have plenty of travel time data.
 def GP_Winter_2018_Travel_Time_data():
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import RBF, ConstantKernel as C
+    from sklearn.gaussian_process.kernels import DotProduct, WhiteKernel
     Winter_2018 = pd.read_hdf('Winter_2018_Travel_Time.hdf5')
     # Reduce the dimensionality to fit so it isn't so slow!
     N = 2 ** 10
@@ -32,36 +35,21 @@ def GP_Winter_2018_Travel_Time_data():
 
 
 
-t = pd.read_hdf('./dumped_data/saved_data.hdf5',key='all_zips')
-
 # Principal is the initial loan amount.
 # interest is the MONTHLY interest.  i.e. is the yearly interest is 4% then
 # interest = 0.04/12
 # months is the length of the loans in months.
-def calculate_monthly_payment(principal, interest, months):
-    monthly_payment = principal * \
-                      (interest * (1 + interest)**months) / \
-                      ((1+interest)**months - 1)
-    return(monthly_payment)
+# Works on numpy arrays too, see features.calculate_monthly_payment.
+calculate_monthly_payment = features.calculate_monthly_payment
 
 def process_data(t):
     """
-    adds useful features to t
+    adds useful features to t, see features.add_features, and keeps the
+    listings worth plotting
     """
-
-    # price in mega-bucks
-    t['price (M$)'] = t['zillow_price'] / 1000000.0
-    # averge times in minutes
-    t['average_drive_duration'] = \
-        t['morning_drive_duration'].add(t['evening_drive_duration']).div(120.0)
-    t['average_drive_duration_with_traffic'] = \
-            t['morning_drive_duration_with_traffic'] \
-                .add(t['evening_drive_duration_with_traffic']).div(120.0)
-    t['average_transit_duration'] = \
-            t['morning_transit_duration'] \
-                .add(t['evening_transit_duration']).div(120.0)
-    # identify east bay locations
-    t['east_bay'] = t['location'].apply(find_east_bay)
+    # the cached feature table already has the derived columns
+    if not set(features.feature_column_names).issubset(t.columns):
+        t = features.add_features(t)
 
     # filter for < 180 minute drives in traffic, < $5M and SINGLE_FAMILY homes
     mask = (t['average_drive_duration_with_traffic'] < 180) & \
@@ -73,6 +61,7 @@ def process_data(t):
 def find_east_bay(lat=0.0,lng=0.0):
     """
     accepts lat and lng and tells you if the property is in the east bay
+    for whole columns use features.east_bay_mask instead
 
     Parameters
     ----------
@@ -89,33 +78,101 @@ def find_east_bay(lat=0.0,lng=0.0):
         True if the location is in the east bay
     """
     # check for the string
-    if isinstance(lat,(str,unicode)):
+    if isinstance(lat,str):
         tl = lat.split(',')
         lat = float(tl[0])
         lng = float(tl[1])
-    # a GPS point near Treasure Island
-    x1 = -122.389807
-    y1 = 37.813489
-    # a GPS point just north of San Jose
-    x2 = -121.986697
-    y2 = 37.418685
-    if lat < y2: # anything south of San Jose is not in the east bay
-        return False
-    val = (lng - x1) * (y2 - y1) - (lat - y1) * (x2 - x1)
-    # positive values are east bay, negative values are peninsula
-    return val > 0
-
-
-t = process_data(t)
+    return bool(features.east_bay_mask(lat, lng))
+
+
+# the processed listings, loaded by get_data the first time they are needed
+t = None
+
+def get_data(path='./dumped_data/saved_data.hdf5',key='all_zips'):
+    """
+    loads and processes the listings the first time it is called and returns
+    the same table after that
+
+    Parameters
+    ----------
+    path: string
+        hdf5 file holding the listings
+    key: string
+        key of the listings in the hdf5 file
+
+    Returns
+    -------
+    pandas.DataFrame
+        the processed listings, also kept in the module level t
+    """
+    global t
+    if t is None:
+        t = process_data(features.load_features(path, key=key))
+    return t
+
+
+# the memory-mapped listings, opened by get_arrays the first time they are
+# needed
+arrays = None
+
+def get_arrays(path='./dumped_data/saved_data.hdf5',key='all_zips'):
+    """
+    opens the memory-mapped export of the listings the first time it is
+    called, see analysis_store.open_dataset, and returns the same export
+    after that
+
+    Parameters
+    ----------
+    path: string
+        hdf5 file holding the listings
+    key: string
+        key of the listings in the hdf5 file
+
+    Returns
+    -------
+    analysis_store.AnalysisData
+        the listings, also kept in the module level arrays
+    """
+    global arrays
+    if arrays is None:
+        arrays = analysis_store.open_dataset(path, key=key)
+    return arrays
+
+
+def select_rows(data):
+    """
+    indices of the listings process_data keeps, without copying the table
+    """
+    return data.select(max_commute=180, max_price=5e6,
+                       home_type='SINGLE_FAMILY')
+
+
 ################################################################################
 # you can make pretty plots now
 ################################################################################
 
-def price_dist_plot():
+def price_dist_plot(path=None,mmap=False):
     """
     plot of price versus distance
-
+    if path is given, a density image is written there instead, see
+    rendering.render_price_commute
+    with mmap the image is made from the memory-mapped columns, see
+    get_arrays, without loading the table
     """
+    if path and mmap:
+        data = get_arrays()
+        rows = select_rows(data)
+        rendering.render_price_commute_arrays(
+            data['price'][rows] / 1000000.0,
+            data['average_drive_duration_with_traffic'][rows],
+            data['region'][rows] == analysis_store.REGIONS.index('east bay'),
+            path)
+        return
+    t = get_data()
+    if path:
+        rendering.render_price_commute(t, path)
+        return
+    import matplotlib.pyplot as plt
     plt.figure(22)
     # plot the east bay points
     eb_mask = t['east_bay']
@@ -137,10 +194,17 @@ def price_dist_plot():
     plt.show()
 
 
-def plot_by_zipcode():
+def plot_by_zipcode(path=None):
     """
     plots the results for single family homes by zipcode
+    if path is given, per zipcode quartiles are written there instead, see
+    rendering.render_by_zipcode
     """
+    t = get_data()
+    if path:
+        rendering.render_by_zipcode(t, path)
+        return
+    import matplotlib.pyplot as plt
     # find all the unique zipcodes
     zipcodes = t['zillow_zipcode'].unique()
     colors = np.random.rand(len(zipcodes),3)
@@ -157,43 +221,56 @@ def plot_by_zipcode():
     plt.show()
 
 
-def dbscan_price_drive(epsilon=0.1,min_samples=50):
+def dbscan_price_drive(epsilon=0.1,min_samples=50,sample_size=None,n_jobs=1,
+                       chunk_size=100000,mmap=False):
     """
     DBSCAN cluster analysis of the data in terms of price and
     average_drive_duration_with_traffic
+
+    With sample_size set, DBSCAN runs on a sample of that many points and the
+    rest are assigned to the nearest core sample in chunks of chunk_size, see
+    clustering.sampled_dbscan.  Use it when t has millions of rows.
+
+    With mmap the two columns are read from the memory-mapped export, see
+    get_arrays, instead of the loaded table.
     """
-    tt = t[['price (M$)','average_drive_duration_with_traffic']]
-    scaler = StandardScaler()
-    ts = scaler.fit_transform(tt)
-    db = DBSCAN(eps=epsilon, min_samples=min_samples).fit(ts)
-    core_samples_mask = np.zeros_like(db.labels_, dtype=bool)
-    core_samples_mask[db.core_sample_indices_] = True
-    labels = db.labels_
+    import matplotlib.pyplot as plt
+    if mmap:
+        data = get_arrays()
+        tt = data.stack(['price','average_drive_duration_with_traffic'],
+                        select_rows(data))
+        tt[:, 0] /= 1000000.0 # price in M$
+    else:
+        t = get_data()
+        tt = t[['price (M$)','average_drive_duration_with_traffic']].values
+    if sample_size is None:
+        from sklearn.cluster import DBSCAN
+        from sklearn.preprocessing import StandardScaler
+        scaler = StandardScaler()
+        ts = scaler.fit_transform(tt)
+        db = DBSCAN(eps=epsilon, min_samples=min_samples,
+                    n_jobs=n_jobs).fit(ts)
+        labels = db.labels_
+        core_samples_mask = np.zeros_like(db.labels_, dtype=bool)
+        core_samples_mask[db.core_sample_indices_] = True
+    else:
+        labels, core_samples_mask = clustering.sampled_dbscan(
+            clustering.standardize(tt), eps=epsilon, min_samples=min_samples,
+            sample_size=sample_size, chunk_size=chunk_size, n_jobs=n_jobs)
     # Number of clusters in labels, ignoring noise if present.
-    n_clusters_ = len(set(labels)) - (1 if -1 in labels else 0)
-    n_noise_ = list(labels).count(-1)
+    n_clusters_, n_noise_, _ = clustering.cluster_summary(labels)
     print('Estimated number of clusters: %d' % n_clusters_)
     print('Estimated number of noise points: %d' % n_noise_)
     # Black removed and is used for noise instead.
-    unique_labels = set(labels)
-    colors = [plt.cm.Spectral(each)
-              for each in np.linspace(0, 1, len(unique_labels))]
-    for k, col in zip(unique_labels, colors):
-        if k == -1:
-            # Black used for noise.
-            col = [0, 0, 0, 1]
-
-        class_member_mask = (labels == k)
-
-        x = tt.loc[:,'price (M$)'][class_member_mask & core_samples_mask]
-        y = tt.loc[:,'average_drive_duration_with_traffic'][class_member_mask & core_samples_mask]
-        plt.plot(x[:],y[:], 'o', markerfacecolor=tuple(col),
-                 markeredgecolor='k', markersize=10)
-
-        x = tt.loc[:,'price (M$)'][class_member_mask & ~core_samples_mask]
-        y = tt.loc[:,'average_drive_duration_with_traffic'][class_member_mask & ~core_samples_mask]
-        plt.plot(x[:],y[:], 'o', markerfacecolor=tuple(col),
-                 markeredgecolor='k', markersize=2)
+    colors = plt.cm.Spectral(np.linspace(0, 1, max(labels.max() + 1, 1)))
+    point_colors = colors[np.clip(labels, 0, None)]
+    # Black used for noise.
+    point_colors[labels == -1] = [0, 0, 0, 1]
+    # one call each for the core and the edge points, not one per cluster
+    plt.scatter(tt[core_samples_mask, 0], tt[core_samples_mask, 1],
+                c=point_colors[core_samples_mask], edgecolors='k', s=100)
+    plt.scatter(tt[~core_samples_mask, 0], tt[~core_samples_mask, 1],
+                c=point_colors[~core_samples_mask], edgecolors='k', s=4)
 
     plt.title('Estimated number of clusters: %d' % n_clusters_)
     plt.show()
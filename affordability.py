@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+"""Affordability of every listing across loan scenarios.
+
+Monthly payments (loan, property tax and insurance) are evaluated for every
+listing over a grid of down payments, interest rates and loan terms as one
+broadcast numpy array.  AffordabilityIndex answers queries like "all listings
+with payment < X and commute < Y" without scanning the whole table.
+
+Typical use:
+
+```
+import affordability
+p = affordability.payment_grid(t['zillow_price'].values,
+                               yearly_interest=[0.035, 0.04, 0.045],
+                               months=[180, 360])
+idx = affordability.AffordabilityIndex.from_frame(t)
+rows = idx.query(max_payment=6000, max_commute=45)
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import numpy as np
+import features  # for the loan formula and the default loan
+
+# California property tax is roughly 1.1% of the purchase price per year
+DEFAULT_TAX_RATE = 0.011
+# homeowner's insurance as a fraction of the price per year
+DEFAULT_INSURANCE_RATE = 0.0035
+
+
+def payment_grid(prices, yearly_interest=features.DEFAULT_YEARLY_INTEREST,
+                 months=features.DEFAULT_MONTHS,
+                 down_payment=features.DEFAULT_DOWN_PAYMENT,
+                 tax_rate=DEFAULT_TAX_RATE,
+                 insurance_rate=DEFAULT_INSURANCE_RATE,
+                 dtype=np.float64):
+    """
+    monthly cost of every listing for every combination of loan parameters
+
+    The result has one axis per scenario parameter followed by the listings:
+    (down_payment, yearly_interest, months, listing).  The size grows as the
+    product of all the axes, pass dtype=np.float32 to halve it for large
+    grids.
+
+    Parameters
+    ----------
+    prices: array
+        listing prices in dollars
+    yearly_interest: float or array
+        yearly interest rates to evaluate, e.g. 0.04 for 4%
+    months: int or array
+        loan terms in months to evaluate
+    down_payment: float or array
+        fractions of the price paid up front
+    tax_rate: float
+        yearly property tax as a fraction of the price
+    insurance_rate: float
+        yearly insurance as a fraction of the price
+    dtype: numpy dtype
+        dtype of the returned array
+
+    Returns
+    -------
+    numpy array
+        shape (n_down_payment, n_interest, n_months, n_listings) of monthly
+        payments in dollars
+    """
+    prices = np.asarray(prices, dtype=dtype)[None, None, None, :]
+    down = np.atleast_1d(np.asarray(down_payment, dtype=dtype))
+    rates = np.atleast_1d(np.asarray(yearly_interest, dtype=dtype))
+    terms = np.atleast_1d(np.asarray(months, dtype=dtype))
+
+    # the loan factor only depends on rate and term, compute it once
+    monthly = rates[:, None] / 12
+    growth = (1 + monthly) ** terms[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        factor = monthly * growth / (growth - 1)
+    factor = np.where(monthly == 0, 1 / terms[None, :], factor)
+
+    principal = prices * (1 - down)[:, None, None, None]
+    payment = principal * factor.astype(dtype)[None, :, :, None]
+    # tax and insurance are paid on the full price whatever the loan is
+    upkeep = np.dtype(dtype).type((tax_rate + insurance_rate) / 12.0)
+    payment += prices * upkeep
+    return payment
+
+
+def listing_payments(df, yearly_interest=features.DEFAULT_YEARLY_INTEREST,
+                     months=features.DEFAULT_MONTHS,
+                     down_payment=features.DEFAULT_DOWN_PAYMENT,
+                     tax_rate=DEFAULT_TAX_RATE,
+                     insurance_rate=DEFAULT_INSURANCE_RATE):
+    """
+    monthly cost of each listing in df for a single loan scenario
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        listing table with a zillow_price column
+    yearly_interest, months, down_payment, tax_rate, insurance_rate:
+        see payment_grid, scalars only
+
+    Returns
+    -------
+    numpy array
+        monthly payment in dollars, one per row of df
+    """
+    prices = features.column_values(df, 'zillow_price')
+    return payment_grid(prices, yearly_interest, months, down_payment,
+                        tax_rate, insurance_rate)[0, 0, 0]
+
+
+class AffordabilityIndex:
+    """
+    Range index over (payment, commute) for fast threshold queries.
+
+    Listings are sorted by payment so the payment bound is a binary search.
+    The sorted listings are cut into fixed-size blocks and the smallest
+    commute of each block is kept, so whole blocks with no commute short
+    enough are skipped without looking at their rows.
+
+    Parameters
+    ----------
+    payment: array
+        monthly payment of each listing
+    commute: array
+        commute of each listing, np.nan and np.inf never match a query
+    block_size: integer
+        number of listings per block
+
+    Attributes
+    ----------
+    order: numpy array
+        row positions sorted by payment
+    payment: numpy array
+        payments in sorted order
+    commute: numpy array
+        commutes in sorted order
+    block_min: numpy array
+        smallest commute in each block
+    """
+    def __init__(self, payment, commute, block_size=256):
+        payment = np.asarray(payment, dtype=float)
+        commute = np.asarray(commute, dtype=float)
+        # nan payments sort last and can never satisfy a query
+        self.order = np.argsort(payment, kind='stable')
+        self.payment = payment[self.order]
+        self.commute = np.where(np.isfinite(commute), commute,
+                                np.inf)[self.order]
+        self.block_size = block_size
+        n_blocks = -(-len(self.commute) // block_size)
+        padded = np.full(n_blocks * block_size, np.inf)
+        padded[:len(self.commute)] = self.commute
+        self.block_min = padded.reshape(n_blocks, block_size).min(axis=1)
+
+    @classmethod
+    def from_frame(cls, df, payment_column=None,
+                   commute_column='average_drive_duration_with_traffic',
+                   block_size=256):
+        """
+        builds the index from a table with features.add_features columns
+
+        Parameters
+        ----------
+        df: pandas.DataFrame
+            listing table
+        payment_column: string
+            column holding the monthly payment; if None the payment is
+            listing_payments(df), loan plus tax and insurance like
+            payment_grid, not the loan only monthly_payment column
+        commute_column: string
+            column holding the commute, in minutes for the default
+        block_size: integer
+            number of listings per block
+
+        Returns
+        -------
+        AffordabilityIndex
+        """
+        if payment_column is None:
+            payment = listing_payments(df)
+        else:
+            payment = features.column_values(df, payment_column)
+        return cls(payment,
+                   features.column_values(df, commute_column),
+                   block_size=block_size)
+
+    def query(self, max_payment, max_commute):
+        """
+        rows with payment < max_payment and commute < max_commute
+
+        Parameters
+        ----------
+        max_payment: float
+            upper bound on the monthly payment
+        max_commute: float
+            upper bound on the commute
+
+        Returns
+        -------
+        numpy array
+            row positions of the matching listings, sorted by payment
+        """
+        end = np.searchsorted(self.payment, max_payment, side='left')
+        # blocks that lie entirely below the payment bound
+        full = end // self.block_size
+        hit = np.flatnonzero(self.block_min[:full] < max_commute)
+        rows = (hit[:, None] * self.block_size +
+                np.arange(self.block_size)[None, :]).ravel()
+        # plus the partial block at the payment bound
+        rows = np.concatenate([rows,
+                               np.arange(full * self.block_size, end)])
+        rows = rows[self.commute[rows] < max_commute]
+        return self.order[rows]
+
+    def count(self, max_payment, max_commute):
+        """number of rows with payment < max_payment and commute < max_commute"""
+        return len(self.query(max_payment, max_commute))
@@ -0,0 +1,350 @@
+#!/usr/bin/env python
+"""
+Precomputed counts of the listings by zipcode, home type, price and commute.
+
+The plotting and summary functions group the whole listing table again on
+every call.  AggregateCube keeps one array of counts over zipcode x
+zillow_homeType x price bucket x commute bucket for each mode instead, so a
+question like "how many single family homes under $1.5M in 94025 have a
+drive under 45 minutes, and what is their median commute" adds up a few
+hundred numbers instead of scanning the listings:
+
+```
+import aggregate_cube, features
+cube = aggregate_cube.AggregateCube()
+cube.upsert(features.load_features('./dumped_data/saved_data.hdf5'))
+cube.count(zipcodes=[94025], home_types=['SINGLE_FAMILY'],
+           max_price=1.5e6, max_commute=45)
+cube.percentiles([25, 50, 75], zipcodes=[94025])
+cube.save('./dumped_data/cube.npz')
+```
+
+Commute buckets are COMMUTE_STEP minutes wide up to MAX_COMMUTE minutes,
+with one bucket for longer commutes and one for listings without a travel
+time yet; prices are bucketed at PRICE_EDGES.  Limits and percentiles are
+answered at that resolution, percentiles interpolated inside a bucket.
+
+The cube remembers the cell of every listing by zillow_id, so upsert of
+listings that are already in it, e.g. after get_times filled in their travel
+times, moves them to their new cells rather than counting them twice.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os  # for the atomic save
+import numpy as np
+import pandas as pd
+import features  # the average duration columns
+import interning  # tables of the zipcodes and home types
+import metrics  # listings added and query times
+
+# commute modes and the features column each is read from, in minutes
+MODES = [('drive', 'average_drive_duration'),
+         ('drive_with_traffic', 'average_drive_duration_with_traffic'),
+         ('transit', 'average_transit_duration')]
+DEFAULT_MODE = 'drive_with_traffic'
+# left edges of the price buckets in dollars, the last one is open ended
+PRICE_EDGES = np.array([0, 0.25, 0.5, 0.75, 1.0, 1.25, 1.5, 1.75, 2.0, 2.5,
+                        3.0, 3.5, 4.0, 5.0, 6.0, 8.0, 10.0]) * 1e6
+COMMUTE_STEP = 5  # minutes per commute bucket
+MAX_COMMUTE = 180  # minutes, longer commutes share one bucket
+# regular buckets, then one for longer commutes and one for no travel time
+COMMUTE_BUCKETS = MAX_COMMUTE // COMMUTE_STEP
+LONGER = COMMUTE_BUCKETS
+MISSING = COMMUTE_BUCKETS + 1
+UNKNOWN = 'unknown'  # zipcode or home type of listings without one
+
+
+def _commute_edges():
+    return np.arange(COMMUTE_BUCKETS + 1) * float(COMMUTE_STEP)
+
+
+def _commute_buckets(max_commute):
+    """number of commute buckets, from the first, within max_commute
+    minutes; the LONGER bucket only counts for an infinite max_commute"""
+    if np.isinf(max_commute):
+        return LONGER + 1
+    return min(int(np.ceil(max_commute / COMMUTE_STEP)), LONGER)
+
+
+def histogram_percentiles(counts, edges, q):
+    """
+    percentiles q (0 to 100) of the values counted in counts, a histogram
+    whose bucket i covers edges[i] to edges[i + 1], interpolated linearly
+    inside a bucket; a percentile in the open ended last bucket,
+    counts[len(edges) - 1], is its left edge.  np.nan if counts is empty.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+    total = counts.sum()
+    if total == 0:
+        return np.full(len(q), np.nan)
+    cumulative = np.cumsum(counts)
+    target = q / 100.0 * total
+    bucket = np.minimum(np.searchsorted(cumulative, target, side='left'),
+                        len(counts) - 1)
+    # the first bucket with anything in it for the 0th percentile
+    bucket = np.where(target == 0, np.argmax(counts > 0), bucket)
+    below = cumulative[bucket] - counts[bucket]
+    inside = np.where(counts[bucket] > 0,
+                      (target - below) / np.maximum(counts[bucket], 1), 0.0)
+    # the open ended bucket has no width
+    width = np.diff(edges, append=edges[-1])[bucket]
+    return edges[bucket] + np.clip(inside, 0.0, 1.0) * width
+
+
+class AggregateCube:
+    """
+    Listing counts over mode x zipcode x home type x price bucket x commute
+    bucket, updated incrementally.
+
+    Attributes
+    ----------
+    counts: numpy array of uint32
+        (len(MODES), zipcodes, home types, len(PRICE_EDGES),
+        COMMUTE_BUCKETS + 2) counts, every listing is counted once per mode;
+        mode comes first so the counts of one mode are contiguous
+    zipcodes: interning.StringTable
+        the zipcode of each index on the second axis
+    home_types: interning.StringTable
+        the zillow_homeType of each index on the third axis
+    ids: numpy array of int64
+        zillow_id of every listing in the cube, sorted
+    cells: numpy array of int16
+        (len(ids), 3 + len(MODES)) zipcode, home type, price bucket and
+        commute bucket of each mode of every listing
+    """
+    def __init__(self):
+        self.zipcodes = interning.StringTable()
+        self.home_types = interning.StringTable()
+        self.counts = np.zeros((len(MODES), 0, 0, len(PRICE_EDGES),
+                                COMMUTE_BUCKETS + 2), dtype=np.uint32)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.cells = np.zeros((0, 3 + len(MODES)), dtype=np.int16)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _grow(self):
+        """makes room in counts for zipcodes and home types new to the
+        tables"""
+        shape = (len(self.zipcodes), len(self.home_types))
+        if shape == self.counts.shape[1:3]:
+            return
+        grown = np.zeros(self.counts.shape[:1] + shape +
+                         self.counts.shape[3:], dtype=np.uint32)
+        grown[:, :self.counts.shape[1], :self.counts.shape[2]] = self.counts
+        self.counts = grown
+
+    def _cells(self, df):
+        """the cells of the listings in df, see the cells attribute"""
+        zipcodes = pd.to_numeric(df['zillow_zipcode'], errors='coerce')
+        zipcodes = zipcodes.map(lambda z: '{:d}'.format(int(z)),
+                                na_action='ignore').fillna(UNKNOWN)
+        home_types = df['zillow_homeType'].astype(object).fillna(UNKNOWN)
+        price = features.column_values(df, 'zillow_price')
+        cells = np.empty((len(df), 3 + len(MODES)), dtype=np.int16)
+        cells[:, 0] = self.zipcodes.encode(zipcodes)
+        cells[:, 1] = self.home_types.encode(home_types)
+        cells[:, 2] = np.searchsorted(PRICE_EDGES, price, side='right') - 1
+        for m, (_, column) in enumerate(MODES):
+            minutes = features.column_values(df, column)
+            bucket = np.minimum(np.floor(minutes / COMMUTE_STEP), LONGER)
+            cells[:, 3 + m] = np.where(np.isfinite(minutes) & (minutes >= 0),
+                                       bucket, MISSING)
+        return cells
+
+    def _count(self, cells, add):
+        """adds (add True) or takes away one count per mode of each
+        listing in cells"""
+        flat = self.counts.reshape(-1)
+        for m in range(len(MODES)):
+            index = np.ravel_multi_index(
+                (np.full(len(cells), m), cells[:, 0], cells[:, 1],
+                 cells[:, 2], cells[:, 3 + m]), self.counts.shape)
+            if add:
+                np.add.at(flat, index, 1)
+            else:
+                np.subtract.at(flat, index, 1)
+
+    def upsert(self, df):
+        """
+        adds the listings in df, listings already in the cube (by zillow_id)
+        are moved to their new cells; features are added to df if it
+        doesn't have them; listings without a price are left out
+
+        Returns
+        -------
+        integer
+            number of listings that were new to the cube
+        """
+        if not set(features.feature_column_names).issubset(df.columns):
+            df = features.add_features(df.copy())
+        ids = pd.to_numeric(df['zillow_id'], errors='coerce').values
+        price = features.column_values(df, 'zillow_price')
+        keep = np.isfinite(ids) & np.isfinite(price) & (price >= 0)
+        df = df[keep]
+        ids = ids[keep].astype(np.int64)
+        # the last row of a listing listed twice wins
+        last = len(ids) - 1 - np.unique(ids[::-1], return_index=True)[1]
+        df, ids = df.iloc[last], ids[last]
+        cells = self._cells(df)
+        self._grow()
+
+        position = np.searchsorted(self.ids, ids)
+        known = position < len(self.ids)
+        known[known] = self.ids[position[known]] == ids[known]
+        self._count(self.cells[position[known]], add=False)
+        self.cells[position[known]] = cells[known]
+        self._count(cells, add=True)
+        new = ~known
+        if new.any():
+            ids = np.concatenate([self.ids, ids[new]])
+            order = np.argsort(ids, kind='stable')
+            self.ids = ids[order]
+            self.cells = np.concatenate([self.cells, cells[new]])[order]
+        metrics.counter('cube_listings_total', result='new').inc(
+            int(new.sum()))
+        metrics.counter('cube_listings_total', result='updated').inc(
+            int(known.sum()))
+        return int(new.sum())
+
+    def remove(self, ids):
+        """takes the listings with zillow_id in ids out of the cube, returns
+        how many there were"""
+        ids = np.asarray(ids, dtype=np.int64)
+        drop = np.isin(self.ids, ids)
+        self._count(self.cells[drop], add=False)
+        self.ids = self.ids[~drop]
+        self.cells = self.cells[~drop]
+        return int(drop.sum())
+
+    def _slice(self, zipcodes=None, home_types=None, max_price=None,
+               mode=DEFAULT_MODE):
+        """the (price bucket, commute bucket) counts of mode summed over
+        the zipcodes and home types asked for"""
+        def indices(table, values):
+            if values is None:
+                return slice(None)
+            codes = [table.codes.get(str(value)) for value in values]
+            return [code for code in codes if code is not None]
+        counts = self.counts[[name for name, _ in MODES].index(mode)]
+        counts = counts[indices(self.zipcodes, zipcodes)]
+        counts = counts[:, indices(self.home_types, home_types)]
+        counts = counts.sum(axis=(0, 1), dtype=np.int64)
+        if max_price is not None:
+            counts = counts[:np.searchsorted(PRICE_EDGES, max_price)]
+        return counts
+
+    def count(self, zipcodes=None, home_types=None, max_price=None,
+              max_commute=None, mode=DEFAULT_MODE):
+        """
+        number of listings in the zipcodes and home types given (all if
+        None), in price buckets below max_price and commute buckets below
+        max_commute minutes of mode
+
+        Parameters
+        ----------
+        zipcodes: list of integers or strings
+            e.g. [94025, 94301]
+        home_types: list of strings
+            e.g. ['SINGLE_FAMILY']
+        max_price: float
+            dollars, rounded to a bucket edge in PRICE_EDGES
+        max_commute: float
+            minutes, rounded to a multiple of COMMUTE_STEP; commutes longer
+            than MAX_COMMUTE only count if this is np.inf, and listings
+            without a travel time only if it is None
+        mode: string
+            one of MODES, 'drive', 'drive_with_traffic' or 'transit'
+
+        Returns
+        -------
+        integer
+        """
+        counts = self._slice(zipcodes, home_types, max_price, mode)
+        if max_commute is not None:
+            counts = counts[:, :_commute_buckets(max_commute)]
+        return int(counts.sum())
+
+    def percentiles(self, q=(25, 50, 75), zipcodes=None, home_types=None,
+                    max_price=None, mode=DEFAULT_MODE):
+        """commute percentiles in minutes of mode, of the listings with a
+        travel time, see count for the filters"""
+        counts = self._slice(zipcodes, home_types, max_price, mode)
+        return histogram_percentiles(counts[:, :MISSING].sum(axis=0),
+                                     _commute_edges(), q)
+
+    def price_percentiles(self, q=(25, 50, 75), zipcodes=None,
+                          home_types=None, max_commute=None,
+                          mode=DEFAULT_MODE):
+        """price percentiles in dollars, see count for the filters"""
+        counts = self._slice(zipcodes, home_types, None, mode)
+        if max_commute is not None:
+            counts = counts[:, :_commute_buckets(max_commute)]
+        return histogram_percentiles(counts.sum(axis=1), PRICE_EDGES, q)
+
+    def zipcode_summary(self, home_types=None, mode=DEFAULT_MODE):
+        """
+        count and quartiles of price (M$) and the commute of mode for every
+        zipcode, in the layout of rendering.zipcode_summary
+
+        Returns
+        -------
+        pandas.DataFrame
+            indexed by zipcode with columns count, 'price (M$)' and the
+            features column of mode each suffixed with _25, _50 and _75
+        """
+        column = dict(MODES)[mode]
+        rows = []
+        for zipcode in self.zipcodes.strings:
+            if zipcode == UNKNOWN:
+                continue
+            counts = self._slice([zipcode], home_types, None, mode)
+            if counts.sum() == 0:
+                continue
+            price = histogram_percentiles(counts.sum(axis=1), PRICE_EDGES,
+                                          [25, 50, 75]) / 1e6
+            commute = histogram_percentiles(counts[:, :MISSING].sum(axis=0),
+                                            _commute_edges(), [25, 50, 75])
+            rows.append([int(zipcode), int(counts.sum())] + list(price) +
+                        list(commute))
+        names = ['zillow_zipcode', 'count'] + \
+            ['{:s}_{:d}'.format(name, q) for name in ('price (M$)', column)
+             for q in (25, 50, 75)]
+        return pd.DataFrame(rows, columns=names).set_index('zillow_zipcode')
+
+    def save(self, path):
+        """writes the cube to a compressed .npz file, replaced whole"""
+        partial = path + '.part'
+        with open(partial, 'wb') as out:
+            np.savez_compressed(
+                out, counts=self.counts, ids=self.ids, cells=self.cells,
+                zipcodes=np.array(self.zipcodes.strings, dtype=str),
+                home_types=np.array(self.home_types.strings, dtype=str),
+                price_edges=PRICE_EDGES,
+                commute=np.array([COMMUTE_STEP, MAX_COMMUTE]),
+                modes=np.array([name for name, _ in MODES], dtype=str))
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        reads a cube written by save; raises ValueError if it was built
+        with other buckets or modes than this module has
+        """
+        cube = cls()
+        with np.load(path) as saved:
+            if not (np.array_equal(saved['price_edges'], PRICE_EDGES) and
+                    list(saved['commute']) == [COMMUTE_STEP, MAX_COMMUTE] and
+                    list(saved['modes']) == [name for name, _ in MODES]):
+                raise ValueError('{:s} was built with other buckets, build '
+                                 'it again'.format(path))
+            cube.zipcodes = interning.StringTable(list(saved['zipcodes']))
+            cube.home_types = interning.StringTable(list(saved['home_types']))
+            cube.counts = saved['counts']
+            cube.ids = saved['ids']
+            cube.cells = saved['cells']
+        return cube
@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+"""Memory-mapped analysis dataset.
+
+The listing table is exported once into a directory of fixed width numeric
+columns, one .npy file each.  Opening it maps the files instead of reading
+them, so nothing is loaded until a column is used, only the pages touched
+are read, and every analysis process on the machine shares the same pages
+through the OS cache.  Filters return row indices rather than filtered
+copies of the table:
+
+```
+import analysis_store
+data = analysis_store.open_dataset('./dumped_data/saved_data.hdf5')
+rows = data.select(max_commute=180, max_price=5e6,
+                   home_type='SINGLE_FAMILY')
+X = data.stack(['price', 'average_drive_duration_with_traffic'], rows)
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os  # for the export directory
+import re  # to recognize old exports
+import json  # for the description of the export
+import shutil  # to replace an old export
+import numpy as np
+import pandas as pd
+import features  # derived columns and dataset versions
+import metrics  # cache hit and miss counts
+import interning  # codes of the home types
+
+# name in the export, dtype, and the listing table column it comes from
+COLUMNS = [('price', np.float64, 'zillow_price'),
+           ('monthly_payment', np.float32, 'monthly_payment'),
+           ('latitude', np.float64, 'zillow_latitude'),
+           ('longitude', np.float64, 'zillow_longitude'),
+           ('morning_drive_duration', np.float32, 'morning_drive_duration'),
+           ('morning_drive_duration_with_traffic', np.float32,
+            'morning_drive_duration_with_traffic'),
+           ('evening_drive_duration', np.float32, 'evening_drive_duration'),
+           ('evening_drive_duration_with_traffic', np.float32,
+            'evening_drive_duration_with_traffic'),
+           ('morning_transit_duration', np.float32,
+            'morning_transit_duration'),
+           ('evening_transit_duration', np.float32,
+            'evening_transit_duration'),
+           ('average_drive_duration', np.float32, 'average_drive_duration'),
+           ('average_drive_duration_with_traffic', np.float32,
+            'average_drive_duration_with_traffic'),
+           ('average_transit_duration', np.float32,
+            'average_transit_duration'),
+           ('zipcode', np.int32, 'zillow_zipcode'),
+           ('region', np.int8, 'east_bay'),
+           ('home_type', np.int8, 'zillow_homeType')]
+
+# region ids in the region column
+REGIONS = ('peninsula', 'east bay')
+
+# zipcodes that can't be read are stored as this
+MISSING_ZIPCODE = -1
+
+
+def export(df, directory):
+    """
+    writes the listing table as one .npy file per column in COLUMNS
+
+    The export is written next to directory and moved into place when it is
+    complete, so readers never see half of one.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        listing table, features are added if it doesn't have them
+    directory: string
+        where to write the columns, replaced if it exists
+
+    Returns
+    -------
+    nothing
+    """
+    writer = ExportWriter(directory)
+    writer.append(df)
+    writer.close()
+
+
+class ExportWriter:
+    """
+    Writes an export one batch of listings at a time, for tables that don't
+    fit in memory (see chunked.py).  Only the batch being appended is held in
+    memory.
+
+    Parameters
+    ----------
+    directory: string
+        where to write the columns, replaced when close is called
+    """
+    # bytes reserved for each .npy header, so the final shape can be written
+    # over it when the number of rows is known
+    HEADER_BYTES = 128
+
+    def __init__(self, directory):
+        self.directory = directory.rstrip(os.sep)
+        self.tmp_dir = self.directory + '.tmp'
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+        os.makedirs(self.tmp_dir)
+        self.n_rows = 0
+        self.home_type_table = interning.StringTable()
+        self.home_types = self.home_type_table.strings
+        self.files = {}
+        for name, dtype, _ in COLUMNS:
+            self.files[name] = open(os.path.join(self.tmp_dir, name + '.npy'),
+                                    'wb')
+            self._write_header(name, dtype)
+
+    def _write_header(self, name, dtype):
+        """the .npy header of a column with self.n_rows rows"""
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({:d},), }}" \
+            .format(np.dtype(dtype).str, self.n_rows)
+        # magic, version 1.0, header length, then the padded header
+        length = self.HEADER_BYTES - 10
+        out = self.files[name]
+        out.seek(0)
+        out.write(b'\x93NUMPY\x01\x00')
+        out.write(np.array(length, dtype='<u2').tobytes())
+        out.write((header.ljust(length - 1) + '\n').encode('latin1'))
+
+    def _home_type_codes(self, home_types):
+        """codes of the home types, new ones are added to self.home_types"""
+        return self.home_type_table.encode(home_types)
+
+    def append(self, df):
+        """adds the listings in df, features are added if it doesn't have
+        them"""
+        if not set(features.feature_column_names).issubset(df.columns):
+            df = features.add_features(df.copy())
+        for name, dtype, column in COLUMNS:
+            if name == 'zipcode':
+                values = _numeric(df, column)
+                values = np.where(np.isfinite(values), values,
+                                  MISSING_ZIPCODE)
+            elif name == 'region':
+                values = df[column].values.astype(bool)
+            elif name == 'home_type':
+                values = self._home_type_codes(df[column])
+            else:
+                values = _numeric(df, column)
+            self.files[name].write(
+                np.ascontiguousarray(values, dtype=dtype).tobytes())
+        self.n_rows += len(df)
+
+    def close(self):
+        """writes the final shapes and moves the export into place"""
+        for name, dtype, _ in COLUMNS:
+            self._write_header(name, dtype)
+            self.files[name].close()
+        with open(os.path.join(self.tmp_dir, 'meta.json'), 'w') as meta_file:
+            json.dump({'rows': self.n_rows,
+                       'columns': [name for name, _, _ in COLUMNS],
+                       'home_types': self.home_types,
+                       'regions': list(REGIONS)}, meta_file, indent=1)
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.rename(self.tmp_dir, self.directory)
+
+    def abort(self):
+        """closes the files and removes the unfinished export, an export
+        already in place is kept"""
+        for out in self.files.values():
+            out.close()
+        if os.path.exists(self.tmp_dir):
+            shutil.rmtree(self.tmp_dir)
+
+
+def open_dataset(path='./dumped_data/saved_data.hdf5', key='all_zips',
+                 cache_dir=None):
+    """
+    the AnalysisData export of a listing table, exported first if the
+    table changed since the last export
+
+    Parameters
+    ----------
+    path: string
+        hdf5 file holding the listings
+    key: string
+        key of the listings in the hdf5 file
+    cache_dir: string
+        where to keep the export, defaults to the directory of path
+
+    Returns
+    -------
+    AnalysisData
+    """
+    if not cache_dir:
+        cache_dir = os.path.dirname(os.path.abspath(path))
+    source = features.dataset_source(path, key)
+    directory = os.path.join(cache_dir, 'analysis_{:s}_{:s}'.format(
+        source, features.dataset_version(path, key)))
+    if os.path.exists(os.path.join(directory, 'meta.json')):
+        metrics.counter('cache_requests_total', cache='analysis',
+                        result='hit').inc()
+        return AnalysisData(directory)
+    metrics.counter('cache_requests_total', cache='analysis',
+                    result='miss').inc()
+    export(features.load_features(path, key=key, cache_dir=cache_dir),
+           directory)
+    # only one version of the export of this dataset is worth keeping
+    # around; other exports, e.g. att.py process's, and exports in progress
+    # are left alone
+    old_export = re.compile('^analysis_' + source + '_[0-9a-f]{16}$')
+    for dir_str in os.listdir(cache_dir):
+        old = os.path.join(cache_dir, dir_str)
+        if old_export.match(dir_str) and old != directory and \
+                os.path.isdir(old):
+            shutil.rmtree(old)
+    return AnalysisData(directory)
+
+
+def _numeric(df, column):
+    """column as a float array, bad entries become nan"""
+    return pd.to_numeric(df[column], errors='coerce').values.astype(float)
+
+
+def complement(rows, n_rows):
+    """
+    the sorted indices in range(n_rows) that are not in rows, in one pass
+    over a boolean mask instead of np.isin's sort
+    """
+    keep = np.ones(n_rows, dtype=bool)
+    keep[rows] = False
+    return np.flatnonzero(keep)
+
+
+class AnalysisData:
+    """
+    Read-only, memory-mapped columns of an export.
+
+    Columns are mapped the first time they are used and indexed like a
+    dictionary, data['price'] is a numpy memmap of every listing's price.
+
+    Parameters
+    ----------
+    directory: string
+        a directory written by export
+
+    Attributes
+    ----------
+    home_types: list of strings
+        the zillow_homeType of each code in the home_type column
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json'), 'r') as meta_file:
+            meta = json.load(meta_file)
+        self.n_rows = meta['rows']
+        self.columns = meta['columns']
+        self.home_types = meta['home_types']
+        self.maps = {}
+
+    def __len__(self):
+        return self.n_rows
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def __getitem__(self, name):
+        if name not in self.maps:
+            if name not in self.columns:
+                raise KeyError(name)
+            self.maps[name] = np.load(os.path.join(self.directory,
+                                                   name + '.npy'),
+                                      mmap_mode='r')
+        return self.maps[name]
+
+    def home_type_code(self, home_type):
+        """the code of a zillow_homeType in the home_type column, -1 if no
+        listing has it"""
+        try:
+            return self.home_types.index(home_type)
+        except ValueError:
+            return -1
+
+    def select(self, max_commute=None, max_price=None, home_type=None,
+               region=None, zipcodes=None, rows=None):
+        """
+        indices of the listings that pass every filter given
+
+        Parameters
+        ----------
+        max_commute: float
+            most minutes of average_drive_duration_with_traffic
+        max_price: float
+            most dollars
+        home_type: string
+            a zillow_homeType, e.g. 'SINGLE_FAMILY'
+        region: string
+            one of REGIONS
+        zipcodes: list of integers
+            zipcodes to keep
+        rows: array of integers
+            only consider these rows, e.g. the result of another select
+
+        Returns
+        -------
+        numpy array of integers
+            sorted row indices
+        """
+        def column(name):
+            values = self[name]
+            return values if rows is None else values[rows]
+
+        n = self.n_rows if rows is None else len(rows)
+        keep = np.ones(n, dtype=bool)
+        if max_commute is not None:
+            keep &= column('average_drive_duration_with_traffic') < max_commute
+        if max_price is not None:
+            keep &= column('price') < max_price
+        if home_type is not None:
+            code = self.home_type_code(home_type)
+            # -1 is also the code of listings without a home type
+            keep &= (column('home_type') == code) if code >= 0 else False
+        if region is not None:
+            keep &= column('region') == REGIONS.index(region)
+        if zipcodes is not None:
+            keep &= np.isin(column('zipcode'), zipcodes)
+        selected = np.flatnonzero(keep)
+        return selected if rows is None else np.asarray(rows)[selected]
+
+    def stack(self, names, rows=None, dtype=np.float64):
+        """
+        the named columns side by side as one (rows, columns) array, the only
+        copy made is of the rows asked for
+        """
+        out = np.empty((self.n_rows if rows is None else len(rows),
+                        len(names)), dtype=dtype)
+        for i, name in enumerate(names):
+            out[:, i] = self[name] if rows is None else self[name][rows]
+        return out
@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+"""
+Asynchronous client for the parts of the Google Maps web services we use.
+
+googlemaps.Client makes one blocking request at a time and can't be shared
+between asyncio tasks.  AsyncClient makes the same directions,
+distance_matrix and geocode requests over one pooled keep-alive httpx
+session, with HTTP/2 when the h2 package is installed, and returns the same
+results googlemaps does.  SyncClient wraps it for code that expects
+googlemaps.Client, such as ATTGoogleAPI:
+
+```
+import asyncio, async_gmaps
+async def morning(addresses):
+    async with async_gmaps.AsyncClient(key) as client:
+        return await asyncio.gather(*[
+            client.directions(a, SLAC, departure_time=1551196800)
+            for a in addresses])
+
+t = google_api.ATTGoogleAPI(client=async_gmaps.SyncClient(key=key))
+```
+
+base_url points the client somewhere other than Google, e.g. at
+fake_gmaps.serve for tests and benchmarks.
+
+Unlike googlemaps.Client nothing is retried here, errors are raised with
+the same exception types so resilience.ResilientCaller can decide.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import time  # departure times may be given as datetimes
+import asyncio
+import threading  # SyncClient runs its event loop in a thread
+# httpx is imported where it is used so importing this file is cheap
+
+DEFAULT_BASE_URL = 'https://maps.googleapis.com'
+
+# statuses in the response body that are not errors
+_OK_STATUSES = ('OK', 'ZERO_RESULTS')
+
+
+class _exceptions:
+    """stand-ins for googlemaps.exceptions when it isn't installed"""
+    class ApiError(Exception):
+        def __init__(self, status, message=None):
+            Exception.__init__(self, status, message)
+            self.status = status
+            self.message = message
+
+    class HTTPError(Exception):
+        def __init__(self, status_code):
+            Exception.__init__(self, 'HTTP Error: {:d}'.format(status_code))
+            self.status_code = status_code
+
+    class TransportError(Exception):
+        pass
+
+
+def _errors():
+    """googlemaps.exceptions if it is installed, else the lookalikes, so
+    resilience.classify treats both clients the same"""
+    try:
+        from googlemaps import exceptions
+    except ImportError:
+        exceptions = _exceptions
+    return exceptions
+
+
+def _location(value):
+    """a location parameter as a string: addresses and 'lat,lng' strings are
+    kept, {'lat': , 'lng': } dictionaries and (lat, lng) pairs converted"""
+    if isinstance(value, dict):
+        return '{!r},{!r}'.format(float(value['lat']), float(value['lng']))
+    if isinstance(value, (tuple, list)) and len(value) == 2 and \
+            not isinstance(value[0], (str, dict)):
+        return '{!r},{!r}'.format(float(value[0]), float(value[1]))
+    return str(value)
+
+
+def _locations(values):
+    """one or many locations joined with '|' as the API expects"""
+    if isinstance(values, (str, dict)) or (
+            isinstance(values, tuple) and len(values) == 2 and
+            not isinstance(values[0], (str, dict, tuple, list))):
+        return _location(values)
+    return '|'.join(_location(value) for value in values)
+
+
+def _time(value):
+    """departure or arrival time as seconds since the epoch, or 'now'"""
+    if value == 'now':
+        return value
+    if hasattr(value, 'timetuple'):  # a datetime
+        return str(int(time.mktime(value.timetuple())))
+    return str(int(value))
+
+
+def _params(**params):
+    """the non-None parameters as strings"""
+    return dict((name, value if isinstance(value, str) else
+                 ('true' if value is True else str(value)))
+                for name, value in params.items()
+                if value is not None and value is not False)
+
+
+class AsyncClient:
+    """
+    Implements googlemaps.Client.directions, distance_matrix and geocode as
+    coroutines on one pooled HTTP session.
+
+    Parameters
+    ----------
+    key: string
+        Google Maps API key
+    base_url: string
+        scheme and host requests go to
+    timeout: float
+        seconds before a request counts as failed
+    max_connections: integer
+        most connections kept open at once
+    http2: boolean
+        use HTTP/2 if the h2 package is installed
+    """
+    def __init__(self, key=None, base_url=DEFAULT_BASE_URL, timeout=10.0,
+                 max_connections=32, http2=True):
+        self.key = key
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.http2 = http2
+        self.session = None
+
+    def _session(self):
+        """the httpx.AsyncClient, created on first use"""
+        if self.session is None:
+            import httpx
+            limits = httpx.Limits(max_connections=self.max_connections,
+                                  max_keepalive_connections=self.max_connections)
+            try:
+                self.session = httpx.AsyncClient(http2=self.http2,
+                                                 limits=limits,
+                                                 timeout=self.timeout)
+            except ImportError:  # HTTP/2 needs the h2 package
+                self.session = httpx.AsyncClient(limits=limits,
+                                                 timeout=self.timeout)
+        return self.session
+
+    async def aclose(self):
+        """closes the pooled connections"""
+        if self.session is not None:
+            await self.session.aclose()
+            self.session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
+        return False
+
+    async def _get(self, path, params):
+        """the JSON body of a request to path, errors raised like
+        googlemaps does"""
+        import httpx
+        errors = _errors()
+        if self.key is not None:
+            params['key'] = self.key
+        try:
+            response = await self._session().get(self.base_url + path,
+                                                 params=params)
+        except (httpx.TransportError, httpx.TimeoutException) as error:
+            # a network time out is worth a retry, unlike googlemaps'
+            # Timeout which means its own retries ran out
+            raise errors.TransportError(error)
+        if response.status_code != 200:
+            raise errors.HTTPError(response.status_code)
+        body = response.json()
+        status = body.get('status', 'OK')
+        if status not in _OK_STATUSES:
+            raise errors.ApiError(status, body.get('error_message'))
+        return body
+
+    async def directions(self, origin, destination, mode=None,
+                         waypoints=None, alternatives=False, avoid=None,
+                         language=None, units=None, region=None,
+                         departure_time=None, arrival_time=None,
+                         transit_mode=None, traffic_model=None):
+        """see googlemaps.Client.directions, returns the list of routes"""
+        body = await self._get('/maps/api/directions/json', _params(
+            origin=_location(origin), destination=_location(destination),
+            mode=mode,
+            waypoints=waypoints and _locations(waypoints),
+            alternatives=alternatives, avoid=avoid, language=language,
+            units=units, region=region,
+            departure_time=departure_time and _time(departure_time),
+            arrival_time=arrival_time and _time(arrival_time),
+            transit_mode=transit_mode, traffic_model=traffic_model))
+        return body.get('routes', [])
+
+    async def distance_matrix(self, origins, destinations, mode=None,
+                              language=None, avoid=None, units=None,
+                              departure_time=None, arrival_time=None,
+                              transit_mode=None, traffic_model=None,
+                              region=None):
+        """see googlemaps.Client.distance_matrix, returns the whole
+        response"""
+        return await self._get('/maps/api/distancematrix/json', _params(
+            origins=_locations(origins),
+            destinations=_locations(destinations),
+            mode=mode, language=language, avoid=avoid, units=units,
+            departure_time=departure_time and _time(departure_time),
+            arrival_time=arrival_time and _time(arrival_time),
+            transit_mode=transit_mode, traffic_model=traffic_model,
+            region=region))
+
+    async def geocode(self, address=None, components=None, bounds=None,
+                      region=None, language=None):
+        """see googlemaps.Client.geocode, returns the list of results"""
+        if isinstance(components, dict):
+            components = '|'.join('{:s}:{:s}'.format(k, str(v))
+                                  for k, v in sorted(components.items()))
+        body = await self._get('/maps/api/geocode/json', _params(
+            address=address, components=components, bounds=bounds,
+            region=region, language=language))
+        return body.get('results', [])
+
+
+class SyncClient:
+    """
+    Blocking wrapper around AsyncClient with googlemaps.Client's methods.
+
+    The coroutines run on an event loop in a background thread, so one
+    SyncClient can be used from several threads at once (get_times with
+    workers > 1) and they all share its connection pool.
+
+    Parameters
+    ----------
+    client: AsyncClient
+        the client to wrap, made from the keyword arguments if None
+    **kwargs:
+        passed on to AsyncClient
+    """
+    def __init__(self, client=None, **kwargs):
+        self.client = client or AsyncClient(**kwargs)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever,
+                                       name='async_gmaps')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def close(self):
+        """closes the connections and stops the event loop"""
+        if self.loop.is_running():
+            self._run(self.client.aclose())
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.loop.close()
+
+    def directions(self, origin, destination, **kwargs):
+        """see googlemaps.Client.directions"""
+        return self._run(self.client.directions(origin, destination,
+                                                **kwargs))
+
+    def distance_matrix(self, origins, destinations, **kwargs):
+        """see googlemaps.Client.distance_matrix"""
+        return self._run(self.client.distance_matrix(origins, destinations,
+                                                     **kwargs))
+
+    def geocode(self, address=None, **kwargs):
+        """see googlemaps.Client.geocode"""
+        return self._run(self.client.geocode(address, **kwargs))
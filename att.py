@@ -0,0 +1,522 @@
+#!/usr/bin/env python
+"""Command line entry point for the project.
+
+Each command imports only what it needs when it runs, so quick look ups
+don't pay for pandas, matplotlib, sklearn, selenium, httpx or googlemaps.
+
+python att.py summarize                  # build the per-zipcode commute file
+python att.py commute 94025              # look up a zipcode in that file
+python att.py scrape san_mateo           # scrape a county from shared_res
+python att.py scrape san_mateo --http    # without a browser where possible
+python att.py scrape marin napa --tasks  # resumable, in a task table
+python att.py scrape marin --tasks --shard 0/2  # half the zipcodes
+python att.py reparse ./reparsed/        # parse the archived pages again
+python att.py times --number 100         # fill in travel times from Google
+python att.py times --routes ./dumped_data/routes.sqlite  # reuse old routes
+python att.py geocode                    # fill the local geocode store
+python att.py process --max-rss-mb 512   # stream the CSV dump into an export
+python att.py process --sketches         # and keep quantile sketches of it
+python att.py quantiles a.npz b.npz      # merged per zipcode quantiles
+python att.py plot price price.png       # headless plots
+python att.py cube --zipcodes 94025 --max-price 1.5e6  # precomputed counts
+python att.py gp --plot gp_check.png     # GP travel time extrapolation
+python att.py gp --processes 8 --float32  # cached fit, chunked prediction
+python att.py cv --processes 4           # spatial CV of travel time models
+python att.py traffic --samples 50       # fit time of day traffic profiles
+python att.py traffic --best 07:00 09:30 # best departure for every listing
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import sys
+import json
+import argparse
+
+# where the processed listings, the commute summary and the geocodes live
+DEFAULT_DATA = './dumped_data/saved_data.hdf5'
+DEFAULT_SUMMARY = './dumped_data/commute_by_zip.json'
+DEFAULT_GEOCODES = './dumped_data/geocodes.sqlite'
+DEFAULT_EXPORT = './dumped_data/analysis_all'
+DEFAULT_PROFILES = './dumped_data/traffic_profiles.npz'
+DEFAULT_ROUTES = './dumped_data/routes.sqlite'
+DEFAULT_PAGES = './dumped_data/pages'
+DEFAULT_TASKS = './dumped_data/tasks.sqlite'
+DEFAULT_CUBE = './dumped_data/cube.npz'
+DEFAULT_SKETCHES = './dumped_data/sketches.npz'
+
+
+def summarize(args):
+    """writes features.commute_by_zipcode of the listings to a JSON file"""
+    import features
+    summary = features.commute_by_zipcode(
+        features.load_features(args.data, key='all_zips'))
+    with open(args.summary, 'w') as summary_file:
+        json.dump(summary, summary_file, indent=1, sort_keys=True)
+    print('Wrote {:d} zipcodes to {:s}'.format(len(summary), args.summary))
+
+
+def commute(args):
+    """prints the cached commute for a zipcode"""
+    try:
+        with open(args.summary, 'r') as summary_file:
+            summary = json.load(summary_file)
+    except IOError:
+        print('No commute summary at {:s}, run summarize first.'
+              .format(args.summary))
+        return 1
+    entry = summary.get(args.zipcode)
+    if entry is None:
+        print('No listings with travel times in {:s}.'.format(args.zipcode))
+        return 1
+    print('{:s}: {:d} listings'.format(args.zipcode, entry['count']))
+    for column in sorted(entry):
+        if column != 'count':
+            print('  {:s}: {:.1f} min'.format(column, entry[column]))
+    return 0
+
+
+def scrape(args):
+    """scrapes every zipcode of counties listed in shared_res"""
+    import shared_res
+    import gather_data
+    archive = None
+    if args.archive:
+        import page_archive
+        archive = page_archive.PageArchive(args.archive)
+    fetcher = None
+    if args.http:
+        import page_fetcher
+        fetcher = page_fetcher.FallbackFetcher()
+    if args.tasks:
+        import scrape_scheduler
+        tasks = scrape_scheduler.ScrapeScheduler(
+            args.tasks, refresh_days=args.refresh_days)
+        tasks.add_counties(args.county)
+        shard = None
+        if args.shard:
+            shard = tuple(int(part) for part in args.shard.split('/'))
+        done = gather_data.scrape_scheduled(
+            tasks, worker=args.worker, shard=shard, archive=archive,
+            fetcher=fetcher, concurrency=args.concurrency)
+        print('Scraped {:d} zipcodes, {:s}.'.format(done, ', '.join(
+            '{:d} {:s}'.format(n, status)
+            for status, n in sorted(tasks.counts().items()))))
+        return
+    for county in args.county:
+        gather_data.scrape_county(
+            getattr(shared_res, county + '_county_zip'), archive=archive,
+            fetcher=fetcher, concurrency=args.concurrency)
+
+
+def reparse(args):
+    """parses the archived result pages again, offline, into CSV files"""
+    import gather_data
+    counts = gather_data.reparse_archive(args.archive, args.output,
+                                         zipcodes=args.zipcodes,
+                                         processes=args.processes)
+    print('Parsed {:d} listings in {:d} zipcodes.'.format(
+        sum(counts.values()), len(counts)))
+
+
+def times(args):
+    """fills in travel times with calls to the Google API"""
+    import google_api
+    store = None
+    if args.geocodes:
+        import geocode_store
+        store = geocode_store.GeocodeStore(args.geocodes)
+    routes = None
+    if args.routes:
+        import route_cache
+        routes = route_cache.RouteCache(args.routes)
+    import departure_schedule
+    schedule = departure_schedule.DepartureSchedule(args.morning,
+                                                    args.evening)
+    api = google_api.ATTGoogleAPI(geocode_store=store, pooled=args.pooled,
+                                  schedule=schedule, route_cache=routes)
+    if not args.dry_run:
+        api.find_some_times(dump_location=args.dump_location,
+                            save_file=args.save_file, number=args.number,
+                            workers=args.workers)
+        return
+    api.load_files(dump_location=args.dump_location, save_file=args.save_file)
+    api.process_data()
+    plan = api.plan_calls(number=args.number)
+    print('{:d} calls would be made:'.format(len(plan)))
+    for leg, name in enumerate(google_api.CALL_LEGS):
+        for mode, mode_name in enumerate(google_api.CALL_MODES):
+            print('  {:s} {:s}: {:d}'.format(name, mode_name, int(
+                ((plan['leg'] == leg) & (plan['mode'] == mode)).sum())))
+
+
+def geocode(args):
+    """stores coordinates for every scraped address, calling Google only for
+    addresses Zillow had none for"""
+    import google_api
+    import geocode_store
+    store = geocode_store.GeocodeStore(args.geocodes)
+    api = google_api.ATTGoogleAPI(geocode_store=store)
+    api.load_files(dump_location=args.dump_location, save_file=args.save_file)
+    api.process_data()
+    print('{:d} addresses have Zillow coordinates.'.format(
+        store.add_from_frame(api.df)))
+    counts = store.bulk_geocode(api.gmaps, api.full_addresses(),
+                                calls_per_second=args.rate,
+                                retry_failed=args.retry_failed,
+                                caller=api.caller)
+    print('Geocoded {:d}, {:d} not found.'.format(counts['found'],
+                                                  counts['failed']))
+
+
+def process(args):
+    """processes the scraped CSV files in batches under a memory ceiling
+    into an analysis_store export"""
+    import chunked
+    sketch_set = None
+    if args.sketches:
+        import sketches
+        sketch_set = sketches.SketchSet()
+    stats = chunked.process_dump(args.dump_location, args.output,
+                                 max_rss_mb=args.max_rss_mb,
+                                 csv_output=args.csv, sketches=sketch_set)
+    if sketch_set is not None:
+        sketch_set.save(args.sketches)
+    print('Kept {:d} of {:d} listings in {:d} batches, peak RSS {:.0f} MB.'
+          .format(stats['rows_kept'], stats['rows_read'], stats['batches'],
+                  stats['peak_rss_mb']))
+
+
+def quantiles(args):
+    """prints quantiles of a column from merged quantile sketch files"""
+    import sketches
+    merged = sketches.SketchSet.load(args.files[0])
+    for path in args.files[1:]:
+        merged.merge(sketches.SketchSet.load(path))
+    summary = merged.summary(args.group, args.column, args.q)
+    print(summary.to_string(float_format='{:.1f}'.format))
+
+
+def plot(args):
+    """writes one of the analysis plots to a file"""
+    import BACK_data_analysis
+    if args.kind == 'price' and args.mmap:
+        BACK_data_analysis.get_arrays(args.data)
+        BACK_data_analysis.price_dist_plot(path=args.output, mmap=True)
+        return
+    if args.kind == 'zipcode' and args.cube:
+        import rendering
+        import aggregate_cube
+        summary = aggregate_cube.AggregateCube.load(args.cube) \
+            .zipcode_summary(home_types=['SINGLE_FAMILY'])
+        rendering.render_by_zipcode(None, args.output, summary=summary)
+        return
+    BACK_data_analysis.get_data(args.data)
+    if args.kind == 'price':
+        BACK_data_analysis.price_dist_plot(path=args.output)
+    else:
+        BACK_data_analysis.plot_by_zipcode(path=args.output)
+
+
+def cube(args):
+    """updates the aggregate cube from the listings and queries it"""
+    import os
+    import aggregate_cube
+    table = None
+    if os.path.exists(args.cube):
+        try:
+            table = aggregate_cube.AggregateCube.load(args.cube)
+        except ValueError as err:  # built with other buckets, start over
+            print(err)
+    if table is None or args.update:
+        import features
+        table = table or aggregate_cube.AggregateCube()
+        new = table.upsert(features.load_features(args.data,
+                                                  key='all_zips'))
+        table.save(args.cube)
+        print('{:d} new listings, {:d} in {:s}'.format(new, len(table),
+                                                      args.cube))
+    query = dict(zipcodes=args.zipcodes, home_types=args.home_types,
+                 mode=args.mode)
+    print('{:d} listings'.format(table.count(
+        max_price=args.max_price, max_commute=args.max_commute, **query)))
+    print('commute quartiles (min): {:s}'.format(', '.join(
+        '{:.1f}'.format(m) for m in table.percentiles(
+            max_price=args.max_price, **query))))
+
+
+def gp(args):
+    """runs the GP travel time extrapolation with its diagnostics"""
+    import data_analysis
+    data_analysis.GP_Winter_2018_Travel_Time_data(
+        1, plot_path=args.plot, processes=args.processes,
+        chunk_size=args.chunk_size, float32=args.float32)
+
+
+def traffic(args):
+    """samples commutes over the day to fit traffic profiles, and finds the
+    best departure time of every listing from them"""
+    import numpy as np
+    import google_api
+    import traffic_model
+    import analysis_store
+    if args.samples:
+        api = google_api.ATTGoogleAPI()
+    else:  # no calls, so no credentials needed
+        import fake_gmaps
+        api = google_api.ATTGoogleAPI(client=fake_gmaps.FakeClient())
+    api.load_files(dump_location=args.dump_location, save_file=args.save_file)
+    api.process_data()
+    if args.samples:
+        samples = traffic_model.collect_samples(
+            api, traffic_model.plan_samples(api.df, per_region=args.samples))
+        profiles = traffic_model.TrafficProfiles.fit(samples)
+        profiles.save(args.profiles)
+        print('Fitted profiles on {:d} samples.'.format(
+            int(np.isfinite(samples['duration_in_traffic']).sum())))
+    if not args.best:
+        return
+    profiles = traffic_model.TrafficProfiles.load(args.profiles)
+    regions = traffic_model.listing_regions(api.df)
+    durations = api.df[args.leg + '_drive_duration'].values.astype(float)
+    when, seconds = profiles.best_departure(durations, regions, args.leg,
+                                            args.best[0], args.best[1])
+    if not np.isfinite(seconds).any():
+        print('There are no {:s} drive durations yet, see the times '
+              'command.'.format(args.leg))
+    for region, name in enumerate(analysis_store.REGIONS):
+        mask = (regions == region) & np.isfinite(seconds)
+        if mask.any():
+            print('{:s}: leave at {:s}, median commute {:.1f} min'.format(
+                name, traffic_model.format_time_of_day(when[mask][0]),
+                np.median(seconds[mask]) / 60.0))
+
+
+def cv(args):
+    """blocked spatial cross-validation of the travel time models on an
+    analysis_store export"""
+    import numpy as np
+    import pandas as pd
+    import analysis_store
+    import model_selection
+    data = analysis_store.AnalysisData(args.data)
+    rows = np.arange(len(data['zipcode']))
+    if args.sample and args.sample < len(rows):
+        rows = np.sort(np.random.RandomState(args.seed).choice(
+            len(rows), args.sample, replace=False))
+    X = data.stack(['longitude', 'latitude'], rows)
+    if args.by == 'zipcode':
+        groups = data['zipcode'][rows]
+    else:
+        groups = model_selection.geohash_cells(X[:, 1], X[:, 0])
+    models = model_selection.MODELS
+    if args.models:
+        models = dict((name, models[name]) for name in args.models)
+    report = model_selection.evaluate(X, data[args.target][rows], groups,
+                                      models=models, k=args.folds,
+                                      processes=args.processes,
+                                      cache_dir=args.data, seed=args.seed)
+    with pd.option_context('display.width', 200,
+                           'display.max_columns', None):
+        print(report)
+    if args.max_mae is not None:
+        print('Cheapest model with MAE <= {:g}: {}'.format(
+            args.max_mae, model_selection.cheapest(report, args.max_mae)))
+
+
+def build_parser():
+    """the argument parser with one sub-command per function above"""
+    parser = argparse.ArgumentParser(
+        description='Affordability versus travel time for the peninsula.')
+    parser.add_argument('--metrics', default=None,
+                        help='record metrics and write them to this file, '
+                             'JSON lines if it ends in .jsonl, Prometheus '
+                             'text otherwise')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    sub = commands.add_parser('summarize', help=summarize.__doc__)
+    sub.add_argument('--data', default=DEFAULT_DATA)
+    sub.add_argument('--summary', default=DEFAULT_SUMMARY)
+    sub.set_defaults(func=summarize)
+
+    sub = commands.add_parser('commute', help=commute.__doc__)
+    sub.add_argument('zipcode')
+    sub.add_argument('--summary', default=DEFAULT_SUMMARY)
+    sub.set_defaults(func=commute)
+
+    sub = commands.add_parser('scrape', help=scrape.__doc__)
+    sub.add_argument('county', nargs='+',
+                     help='e.g. san_mateo or santa_clara')
+    sub.add_argument('--archive', default=None,
+                     help='keep the pages in this page_archive directory '
+                          'and skip zipcodes with unchanged result counts, '
+                          'e.g. ' + DEFAULT_PAGES)
+    sub.add_argument('--http', action='store_true',
+                     help='load pages over plain HTTP, starting Firefox '
+                          'only for pages that need it')
+    sub.add_argument('--concurrency', type=int, default=1,
+                     help='pages of a zipcode loaded at once, with --http')
+    sub.add_argument('--tasks', nargs='?', const=DEFAULT_TASKS, default=None,
+                     help='keep track of the zipcodes in a task table and '
+                          'carry on where the last run stopped, ' +
+                          DEFAULT_TASKS + ' if no file is given')
+    sub.add_argument('--worker', default=None,
+                     help='name of this worker in the task table, '
+                          'host:pid by default')
+    sub.add_argument('--shard', default=None,
+                     help='INDEX/COUNT, only scrape zipcodes whose number '
+                          'is INDEX modulo COUNT')
+    sub.add_argument('--refresh-days', type=float, default=7.0,
+                     help='scrape zipcodes again after this many days')
+    sub.set_defaults(func=scrape)
+
+    sub = commands.add_parser('reparse', help=reparse.__doc__)
+    sub.add_argument('output', help='directory for the zipcode CSV files')
+    sub.add_argument('--archive', default=DEFAULT_PAGES)
+    sub.add_argument('--zipcodes', nargs='+', default=None)
+    sub.add_argument('--processes', type=int, default=1)
+    sub.set_defaults(func=reparse)
+
+    sub = commands.add_parser('times', help=times.__doc__)
+    sub.add_argument('--number', type=int, default=10,
+                     help='maximum number of calls to the Google API')
+    sub.add_argument('--dump-location', default=None)
+    sub.add_argument('--save-file', default='saved_data.hdf5')
+    sub.add_argument('--geocodes', default=None,
+                     help='geocode store to route unlocated listings with, '
+                          'e.g. ' + DEFAULT_GEOCODES)
+    sub.add_argument('--dry-run', action='store_true',
+                     help='count the calls that would be made, make none')
+    sub.add_argument('--workers', type=int, default=1,
+                     help='threads making calls')
+    sub.add_argument('--pooled', action='store_true',
+                     help='use the pooled async_gmaps client (needs httpx)')
+    sub.add_argument('--morning', default='Tuesday 08:00 America/Los_Angeles',
+                     help='weekly slot to leave for SLAC')
+    sub.add_argument('--evening', default='Tuesday 17:30 America/Los_Angeles',
+                     help='weekly slot to leave SLAC')
+    sub.add_argument('--routes', default=None,
+                     help='route cache to reuse results from, e.g. ' +
+                          DEFAULT_ROUTES)
+    sub.set_defaults(func=times)
+
+    sub = commands.add_parser('geocode', help=geocode.__doc__)
+    sub.add_argument('--geocodes', default=DEFAULT_GEOCODES)
+    sub.add_argument('--rate', type=float, default=10.0,
+                     help='most geocode calls per second')
+    sub.add_argument('--retry-failed', action='store_true',
+                     help='try addresses Google could not find before again')
+    sub.add_argument('--dump-location', default=None)
+    sub.add_argument('--save-file', default='saved_data.hdf5')
+    sub.set_defaults(func=geocode)
+
+    sub = commands.add_parser('process', help=process.__doc__)
+    sub.add_argument('--dump-location', default='./dumped_data/')
+    sub.add_argument('--output', default=DEFAULT_EXPORT,
+                     help='export directory to write')
+    sub.add_argument('--max-rss-mb', type=float, default=1024.0)
+    sub.add_argument('--csv', default=None,
+                     help='also write the processed listings to this CSV')
+    sub.add_argument('--sketches', nargs='?', const=DEFAULT_SKETCHES,
+                     default=None,
+                     help='also write quantile sketches of the listings, '
+                          'to ' + DEFAULT_SKETCHES + ' if no file is given')
+    sub.set_defaults(func=process)
+
+    sub = commands.add_parser('quantiles', help=quantiles.__doc__)
+    sub.add_argument('files', nargs='*', default=[DEFAULT_SKETCHES],
+                     help='sketch files, e.g. one per shard or run')
+    sub.add_argument('--group', default='zipcode',
+                     choices=['all', 'zipcode', 'region'])
+    sub.add_argument('--column', default='morning_drive_duration_with_traffic')
+    sub.add_argument('--q', type=float, nargs='+', default=[0.25, 0.5, 0.75])
+    sub.set_defaults(func=quantiles)
+
+    sub = commands.add_parser('plot', help=plot.__doc__)
+    sub.add_argument('kind', choices=['price', 'zipcode'])
+    sub.add_argument('output', help='image file to write')
+    sub.add_argument('--data', default=DEFAULT_DATA)
+    sub.add_argument('--mmap', action='store_true',
+                     help='plot price from the memory-mapped export')
+    sub.add_argument('--cube', default=None,
+                     help='plot zipcode from this aggregate cube, e.g. ' +
+                          DEFAULT_CUBE)
+    sub.set_defaults(func=plot)
+
+    sub = commands.add_parser('cube', help=cube.__doc__)
+    sub.add_argument('--data', default=DEFAULT_DATA)
+    sub.add_argument('--cube', default=DEFAULT_CUBE)
+    sub.add_argument('--update', action='store_true',
+                     help='add the listings in --data to an existing cube')
+    sub.add_argument('--zipcodes', nargs='+', default=None)
+    sub.add_argument('--home-types', nargs='+', default=None)
+    sub.add_argument('--max-price', type=float, default=None)
+    sub.add_argument('--max-commute', type=float, default=None,
+                     help='minutes')
+    sub.add_argument('--mode', default='drive_with_traffic',
+                     choices=['drive', 'drive_with_traffic', 'transit'])
+    sub.set_defaults(func=cube)
+
+    sub = commands.add_parser('gp', help=gp.__doc__)
+    sub.add_argument('--plot', default=None,
+                     help='write the diagnostic plot to this file')
+    sub.add_argument('--processes', type=int, default=1,
+                     help='processes predicting')
+    sub.add_argument('--chunk-size', type=int, default=4096,
+                     help='points predicted at a time')
+    sub.add_argument('--float32', action='store_true',
+                     help='predict in single precision')
+    sub.set_defaults(func=gp)
+
+    sub = commands.add_parser('traffic', help=traffic.__doc__)
+    sub.add_argument('--samples', type=int, default=0,
+                     help='listings per region and leg to route over the '
+                          'day, one Google API call each')
+    sub.add_argument('--profiles', default=DEFAULT_PROFILES)
+    sub.add_argument('--best', nargs=2, default=None,
+                     metavar=('EARLIEST', 'LATEST'),
+                     help='departure window, e.g. 07:00 09:30')
+    sub.add_argument('--leg', choices=['morning', 'evening'],
+                     default='morning')
+    sub.add_argument('--dump-location', default=None)
+    sub.add_argument('--save-file', default='saved_data.hdf5')
+    sub.set_defaults(func=traffic)
+
+    sub = commands.add_parser('cv', help=cv.__doc__)
+    sub.add_argument('--data', default=DEFAULT_EXPORT,
+                     help='analysis_store export to read')
+    sub.add_argument('--target', default='morning_drive_duration_with_traffic')
+    sub.add_argument('--by', choices=['zipcode', 'geohash'],
+                     default='zipcode', help='spatial blocks held out')
+    sub.add_argument('--folds', type=int, default=5)
+    sub.add_argument('--models', nargs='+', default=None,
+                     help='names from model_selection.MODELS, default all')
+    sub.add_argument('--sample', type=int, default=None,
+                     help='evaluate on this many random listings')
+    sub.add_argument('--processes', type=int, default=1)
+    sub.add_argument('--seed', type=int, default=0)
+    sub.add_argument('--max-mae', type=float, default=None,
+                     help='also name the cheapest model this accurate')
+    sub.set_defaults(func=cv)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if not args.metrics:
+        return args.func(args) or 0
+    import metrics
+    metrics.enable()
+    try:
+        return args.func(args) or 0
+    finally:
+        if args.metrics.endswith('.jsonl'):
+            metrics.export_jsonl(args.metrics)
+        else:
+            metrics.export_prometheus(args.metrics)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
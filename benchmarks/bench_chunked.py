@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Benchmark of processing the scraped CSV files in memory, the way
+load_files and process_data do, against chunked.process_dump.
+
+A dump of each size is generated once, then each case runs in its own
+process so the peak RSS reported is for that case alone.  Results are
+printed as JSON.
+
+python benchmarks/bench_chunked.py --sizes 100000 1000000 --max-rss-mb 400
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures  # also puts the project on the path
+
+
+def in_memory(dump_location, args):
+    """load_files, process_data and add_features on the whole table"""
+    import features
+    import fake_gmaps
+    import google_api
+    api = google_api.ATTGoogleAPI(client=fake_gmaps.FakeClient())
+    api.load_files(dump_location=dump_location, save_file='none.hdf5')
+    api.process_data()
+    features.add_features(api.df)
+    return {'rows_kept': len(api.df)}
+
+
+def streamed(dump_location, args):
+    """chunked.process_dump under the memory ceiling"""
+    import chunked
+    return chunked.process_dump(dump_location,
+                                os.path.join(dump_location, 'analysis'),
+                                max_rss_mb=args.max_rss_mb)
+
+
+def _run_case(case, dump_location, args, queue):
+    import chunked
+    start = time.time()
+    result = case(dump_location, args)
+    result.update(function=case.__name__, seconds=time.time() - start,
+                  peak_rss_mb=chunked.peak_rss_mb())
+    queue.put(result)
+
+
+def run_case(case, dump_location, args):
+    """runs one case in a fresh process, returns its result dictionary"""
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_run_case,
+                                   args=(case, dump_location, args, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10 ** 5, 10 ** 6])
+    parser.add_argument('--max-rss-mb', type=float, default=400.0)
+    args = parser.parse_args()
+    results = []
+    for size in args.sizes:
+        dump_location = tempfile.mkdtemp() + os.sep
+        # write the dump in pieces so this process stays small too
+        for start in range(0, size, 100000):
+            fixtures.write_csv_dump(
+                fixtures.raw_listing_frame(min(100000, size - start),
+                                           seed=start),
+                dump_location, prefix='{:d}_'.format(start))
+        for case in [in_memory, streamed]:
+            result = run_case(case, dump_location, args)
+            result['size'] = size
+            results.append(result)
+            print(json.dumps(result, sort_keys=True))
+        shutil.rmtree(dump_location)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""Benchmark of the DBSCAN analysis: the exact path used by
+BACK_data_analysis.dbscan_price_drive against clustering.sampled_dbscan.
+
+Each case runs in its own process so the peak RSS reported is for that case
+alone.  Results are printed as JSON.
+
+python benchmarks/bench_clustering.py --sizes 100000 1000000 --n-jobs 4
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource  # for the peak RSS of each case
+import multiprocessing
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import clustering
+
+
+def synthetic_price_drive(n_points, seed=0):
+    """price (M$) and commute (min) columns with a few dense blobs in them"""
+    rng = np.random.RandomState(seed)
+    centers = np.array([[0.8, 35.], [1.5, 25.], [2.5, 20.], [1.0, 70.]])
+    which = rng.randint(0, len(centers), n_points)
+    X = centers[which] + rng.normal(size=(n_points, 2)) * [0.25, 6.]
+    return np.abs(X)
+
+
+def current_function(X, eps, min_samples, n_jobs):
+    """the clustering in dbscan_price_drive before the scalable mode"""
+    from sklearn.cluster import DBSCAN
+    from sklearn.preprocessing import StandardScaler
+    ts = StandardScaler().fit_transform(X)
+    db = DBSCAN(eps=eps, min_samples=min_samples, n_jobs=n_jobs).fit(ts)
+    core_samples_mask = np.zeros_like(db.labels_, dtype=bool)
+    core_samples_mask[db.core_sample_indices_] = True
+    labels = db.labels_
+    for k in set(labels):
+        class_member_mask = (labels == k)
+        x = X[class_member_mask & core_samples_mask]
+        x = X[class_member_mask & ~core_samples_mask]
+    return labels
+
+
+def sampled_function(X, eps, min_samples, n_jobs):
+    """the scalable mode of dbscan_price_drive"""
+    labels, _ = clustering.sampled_dbscan(clustering.standardize(X), eps=eps,
+                                          min_samples=min_samples,
+                                          n_jobs=n_jobs, random_state=0)
+    clustering.cluster_summary(labels)
+    return labels
+
+
+def _run_case(name, n_points, eps, min_samples, n_jobs, queue):
+    X = synthetic_price_drive(n_points)
+    start = time.time()
+    labels = {'current': current_function,
+              'sampled': sampled_function}[name](X, eps, min_samples, n_jobs)
+    elapsed = time.time() - start
+    # ru_maxrss is kilobytes on linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak = peak / 1024
+    queue.put({'function': name,
+               'n_points': n_points,
+               'seconds': elapsed,
+               'peak_rss_mb': peak / 1024.0,
+               'n_clusters': clustering.cluster_summary(labels)[0]})
+
+
+def run_case(name, n_points, eps=0.1, min_samples=50, n_jobs=1,
+             timeout=3600):
+    """runs one case in a fresh process, returns its result dictionary"""
+    queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=_run_case,
+                                   args=(name, n_points, eps, min_samples,
+                                         n_jobs, queue))
+    proc.start()
+    proc.join(timeout)
+    if proc.is_alive():
+        proc.terminate()
+        return {'function': name, 'n_points': n_points, 'error': 'timeout'}
+    if proc.exitcode != 0:  # usually the OOM killer
+        return {'function': name, 'n_points': n_points,
+                'error': 'exit code {:d}'.format(proc.exitcode)}
+    return queue.get()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10 ** 5, 10 ** 6])
+    parser.add_argument('--n-jobs', type=int, default=1)
+    parser.add_argument('--timeout', type=float, default=3600)
+    args = parser.parse_args()
+    results = []
+    for n_points in args.sizes:
+        for name in ['current', 'sampled']:
+            results.append(run_case(name, n_points, n_jobs=args.n_jobs,
+                                    timeout=args.timeout))
+            print(json.dumps(results[-1]))
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+"""Benchmark of the Google API clients against fake_gmaps.serve.
+
+Makes the same directions calls with googlemaps.Client, with
+async_gmaps.SyncClient one at a time and from threads, and with
+async_gmaps.AsyncClient from concurrent asyncio tasks.  The fake server runs
+in its own process so it doesn't share the interpreter with the client.
+Results are printed as JSON.
+
+python benchmarks/bench_http_client.py --calls 200 --latency 0.05
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fake_gmaps
+import async_gmaps
+
+SLAC = '37.4200115,-122.203196'
+
+
+def _serve(latency, queue):
+    server, base_url = fake_gmaps.serve(
+        client=fake_gmaps.FakeClient(latency=latency))
+    queue.put(base_url)
+    while True:
+        time.sleep(3600)
+
+
+def origins(n_calls):
+    """n_calls different places around the bay"""
+    return ['{:.5f},{:.5f}'.format(37.2 + 0.0007 * i, -122.3 + 0.0005 * i)
+            for i in range(n_calls)]
+
+
+def googlemaps_sequential(base_url, places, concurrency):
+    import googlemaps
+    client = googlemaps.Client(key='AIzaFakeKey', base_url=base_url,
+                               queries_per_second=10 ** 6)
+    for place in places:
+        client.directions(place, SLAC, mode='driving',
+                          departure_time=1551196800)
+
+
+def sync_sequential(base_url, places, concurrency):
+    client = async_gmaps.SyncClient(key='fake', base_url=base_url)
+    try:
+        for place in places:
+            client.directions(place, SLAC, mode='driving',
+                              departure_time=1551196800)
+    finally:
+        client.close()
+
+
+def sync_threads(base_url, places, concurrency):
+    client = async_gmaps.SyncClient(key='fake', base_url=base_url,
+                                    max_connections=concurrency)
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda place: client.directions(
+                place, SLAC, mode='driving', departure_time=1551196800),
+                places))
+    finally:
+        client.close()
+
+
+def async_tasks(base_url, places, concurrency):
+    async def run():
+        limit = asyncio.Semaphore(concurrency)
+
+        async def one(client, place):
+            async with limit:
+                return await client.directions(place, SLAC, mode='driving',
+                                               departure_time=1551196800)
+        async with async_gmaps.AsyncClient(
+                key='fake', base_url=base_url,
+                max_connections=concurrency) as client:
+            await asyncio.gather(*[one(client, place) for place in places])
+    asyncio.run(run())
+
+
+CASES = [googlemaps_sequential, sync_sequential, sync_threads, async_tasks]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--calls', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='seconds the fake server takes per call')
+    parser.add_argument('--concurrency', type=int, default=16)
+    args = parser.parse_args()
+
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve,
+                                     args=(args.latency, queue))
+    server.daemon = True
+    server.start()
+    base_url = queue.get(timeout=30)
+
+    places = origins(args.calls)
+    results = []
+    for case in CASES:
+        result = {'client': case.__name__, 'calls': args.calls,
+                  'latency': args.latency, 'concurrency': args.concurrency}
+        start = time.time()
+        try:
+            case(base_url, places, args.concurrency)
+        except ImportError as err:
+            result['skipped'] = str(err)
+        else:
+            result['seconds'] = time.time() - start
+            result['calls_per_second'] = args.calls / result['seconds']
+        results.append(result)
+        sys.stderr.write(json.dumps(result) + '\n')
+    server.terminate()
+    print(json.dumps(results, indent=1, sort_keys=True))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+"""Import time and cold start benchmark.
+
+Times a fresh interpreter running the cached commute look up
+(python att.py commute ZIP) and importing each project module, and prints
+the results as JSON.  Exits with status 1 if the cold start is over budget.
+
+python benchmarks/bench_import.py --budget-ms 200
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules that must stay cheap to import
+MODULES = ['att', 'shared_res', 'features', 'affordability', 'clustering',
+           'rendering', 'BACK_data_analysis', 'data_analysis', 'google_api',
+           'gather_data', 'async_gmaps', 'gp_model', 'model_selection',
+           'page_fetcher', 'interning', 'aggregate_cube', 'sketches']
+
+
+def time_command(command, repeat):
+    """median wall time in ms of running command in a fresh process"""
+    samples = []
+    for _ in range(repeat):
+        start = time.time()
+        proc = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        proc.communicate()
+        samples.append((time.time() - start) * 1000.0)
+        if proc.returncode != 0:
+            return None
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--budget-ms', type=float, default=200.0)
+    args = parser.parse_args()
+
+    # a tiny summary file so the look up has something to read
+    tmp_dir = tempfile.mkdtemp()
+    summary = os.path.join(tmp_dir, 'commute_by_zip.json')
+    with open(summary, 'w') as summary_file:
+        json.dump({'94025': {'count': 1,
+                             'average_drive_duration': 12.0}}, summary_file)
+
+    results = {'baseline_ms': time_command([sys.executable, '-c', 'pass'],
+                                           args.repeat),
+               'commute_ms': time_command([sys.executable, 'att.py',
+                                           'commute', '94025', '--summary',
+                                           summary], args.repeat),
+               'imports_ms': {}}
+    for module in MODULES:
+        # None means the module can't be imported in this environment
+        results['imports_ms'][module] = time_command(
+            [sys.executable, '-c', 'import ' + module], args.repeat)
+    shutil.rmtree(tmp_dir)
+    results['budget_ms'] = args.budget_ms
+    results['within_budget'] = results['commute_ms'] is not None and \
+        results['commute_ms'] < args.budget_ms
+    print(json.dumps(results, indent=1, sort_keys=True))
+    sys.exit(0 if results['within_budget'] else 1)
@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+"""Benchmark of interning.intern_listings.
+
+Measures the memory of the repeated string columns of a processed listing
+table before and after dictionary encoding, and the string work get_times
+does per batch of calls: building the full addresses of the rows it routes
+and normalizing them for the geocode store, from the zillow_* columns as
+before and from the columns intern_listings builds once.  Results are
+printed as JSON.
+
+python benchmarks/bench_interning.py --rows 1000000 --calls 200
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures  # also puts the project on the path
+import geocode_store
+import interning
+
+COLUMNS = interning.INTERNED_COLUMNS + interning.ADDRESS_COLUMNS
+
+
+def column_mb(df, columns):
+    """deep memory of columns in MB, those df has"""
+    columns = [name for name in columns if name in df]
+    return float(df[columns].memory_usage(index=False, deep=True).sum()) / 1e6
+
+
+def per_batch(function, repeat):
+    """median seconds of function()"""
+    samples = []
+    for _ in range(repeat):
+        start = time.time()
+        function()
+        samples.append(time.time() - start)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--calls', type=int, default=200,
+                        help='rows routed per get_times batch')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    df = fixtures.processed_listing_frame(args.rows)
+    rows = np.random.RandomState(0).choice(args.rows, args.calls,
+                                           replace=False)
+
+    def before():
+        part = df.iloc[rows]
+        addresses = geocode_store.full_address(
+            part['zillow_addressStreet'], part['zillow_addressCity'],
+            part['zillow_addressState'], part['zillow_zipcode'])
+        return [geocode_store.normalize_address(a) for a in addresses]
+
+    # the address columns as plain strings, what they'd cost unencoded
+    plain = df.copy()
+    plain['full_address'], plain['normalized_address'] = \
+        interning.address_columns(df)
+    plain = interning.plain_columns(plain)
+    result = {'rows': args.rows, 'calls': args.calls,
+              'mb_before': column_mb(plain, COLUMNS),
+              'batch_seconds_before': per_batch(before, args.repeat)}
+
+    start = time.time()
+    interned = interning.intern_listings(df.copy())
+    result['intern_seconds'] = time.time() - start
+
+    def after():
+        part = interned.iloc[rows]
+        return (part['full_address'].astype(object).values,
+                part['normalized_address'].astype(object).values)
+
+    result['mb_after'] = column_mb(interned, COLUMNS)
+    result['batch_seconds_after'] = per_batch(after, args.repeat)
+    print(json.dumps(result, indent=1, sort_keys=True))
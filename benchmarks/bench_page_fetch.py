@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""Benchmark of loading result pages with page_fetcher.
+
+Loads every page of a few zipcodes from fixtures.serve_pages, once with
+HTTPFetcher and once with SeleniumFetcher, each in a fresh process so the
+peak RSS of the worker (and, for selenium, of the browser it started) is
+its own.  A backend that isn't installed is reported as skipped.  Results
+are printed as JSON.
+
+python benchmarks/bench_page_fetch.py --zipcodes 6 --results 100
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os
+import sys
+import json
+import time
+import resource
+import argparse
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures
+import page_fetcher
+
+
+def _serve(args, queue):
+    server, base_url = fixtures.serve_pages(results=args.results,
+                                            n_cards=args.cards,
+                                            latency=args.latency)
+    queue.put(base_url)
+    while True:
+        time.sleep(3600)
+
+
+def urls(base_url, n_zipcodes, results, n_cards):
+    """every result page of n_zipcodes zipcodes"""
+    n_pages = max(1, -(-results // n_cards))
+    zipcodes = [zipcode for zipcode, _ in fixtures.ZIPCODES][:n_zipcodes]
+    return [base_url + '/homes/' + zipcode + '_rb/' +
+            ('' if page == 1 else str(page) + '_p/')
+            for zipcode in zipcodes for page in range(1, n_pages + 1)]
+
+
+def _run(backend, pages, queue):
+    fetcher = getattr(page_fetcher, backend)()
+    result = {'fetcher': backend, 'pages': len(pages)}
+    try:
+        start = time.time()
+        size = sum(len(fetcher.get(url)) for url in pages)
+        result['seconds'] = time.time() - start
+        result['pages_per_second'] = len(pages) / result['seconds']
+        result['mb_loaded'] = size / 1e6
+    except ImportError as err:
+        result['skipped'] = str(err)
+    finally:
+        fetcher.close()
+    # ru_maxrss is in kB on Linux
+    result['worker_rss_mb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    result['children_rss_mb'] = resource.getrusage(
+        resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0
+    queue.put(result)
+
+
+CASES = ['HTTPFetcher', 'SeleniumFetcher']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--zipcodes', type=int, default=6)
+    parser.add_argument('--results', type=int, default=100,
+                        help='results of every zipcode')
+    parser.add_argument('--cards', type=int, default=25,
+                        help='listings per page')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds the server takes per page')
+    args = parser.parse_args()
+
+    queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(args, queue))
+    server.daemon = True
+    server.start()
+    base_url = queue.get(timeout=30)
+    pages = urls(base_url, args.zipcodes, args.results, args.cards)
+
+    results = []
+    for case in CASES:
+        worker = multiprocessing.Process(target=_run,
+                                         args=(case, pages, queue))
+        worker.start()
+        result = queue.get()
+        worker.join()
+        results.append(result)
+        sys.stderr.write(json.dumps(result) + '\n')
+    server.terminate()
+    print(json.dumps(results, indent=1, sort_keys=True))
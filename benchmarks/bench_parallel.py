@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+"""Benchmark of parallel.transform against the single process transform.
+
+Times google_api.transform_listings plus features.add_features, then
+parallel.transform with each number of processes, on generated listings of
+each size, and prints rows per second and the speed up as JSON.
+
+python benchmarks/bench_parallel.py --sizes 1000000 --processes 1 2 4 8
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures  # also puts the project on the path
+import features
+import google_api
+import parallel
+
+
+def best_time(func, repeat):
+    """shortest of repeat runs of func in seconds"""
+    samples = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        samples.append(time.time() - start)
+    return min(samples)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10 ** 5, 10 ** 6])
+    parser.add_argument('--processes', type=int, nargs='+',
+                        default=[1, 2, 4, os.cpu_count() or 1])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    results = []
+    for size in args.sizes:
+        raw = fixtures.raw_listing_frame(size)
+        serial = best_time(lambda: features.add_features(
+            google_api.transform_listings(raw.copy())), args.repeat)
+        results.append({'size': size, 'processes': 0, 'seconds': serial,
+                        'rows_per_second': size / serial, 'speedup': 1.0,
+                        'cores': os.cpu_count()})
+        print(json.dumps(results[-1], sort_keys=True))
+        for processes in sorted(set(args.processes)):
+            seconds = best_time(lambda: parallel.transform(
+                raw, processes=processes), args.repeat)
+            results.append({'size': size, 'processes': processes,
+                            'seconds': seconds,
+                            'rows_per_second': size / seconds,
+                            'speedup': serial / seconds,
+                            'cores': os.cpu_count()})
+            print(json.dumps(results[-1], sort_keys=True))
@@ -0,0 +1,335 @@
+#!/usr/bin/env python
+"""Fixtures for the benchmarks: generated listing tables and Zillow pages,
+and the saved pages and directions results in benchmarks/fixtures/.
+
+The saved files are in the format Zillow served result pages in 2019 and
+the format the directions API returns.  Run this file to regenerate them:
+
+python benchmarks/fixtures.py
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os
+import sys
+import json
+import datetime
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import shared_res
+import fake_gmaps
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           'fixtures')
+
+# zipcodes and cities the generated listings are spread over
+ZIPCODES = [('94025', 'Menlo Park'), ('94301', 'Palo Alto'),
+            ('94087', 'Sunnyvale'), ('94611', 'Oakland'),
+            ('94403', 'San Mateo'), ('95014', 'Cupertino')]
+HOME_TYPES = ['SINGLE_FAMILY', 'CONDO', 'TOWNHOUSE', 'MULTI_FAMILY']
+STATUSES = ['ForSale', 'ForSale', 'ForSale', 'RecentlySold', 'ForRent']
+DURATION_COLUMNS = [name for name in shared_res.pandas_column_names
+                    if name.endswith('_duration') or
+                    name.endswith('_with_traffic')]
+
+CARD_TEMPLATE = '''<article class="zsg-photo-card photo-card zsg-aspect-ratio type-not-favorite" data-zpid="{zpid}" data-pgapt="{status}">
+<div class="zsg-photo-card-content zsg-aspect-ratio-content" itemscope="" itemtype="http://schema.org/SingleFamilyResidence">
+<span itemprop="address" itemscope="" itemtype="http://schema.org/PostalAddress">
+<span itemprop="streetAddress">{street}</span>
+<span itemprop="addressLocality">{city}</span>
+<span itemprop="addressRegion">CA</span>
+<span itemprop="postalCode">{zipcode}</span></span>
+<span itemprop="geo" itemscope="" itemtype="http://schema.org/GeoCoordinates">
+<meta itemprop="latitude" content="{lat:.6f}"/>
+<meta itemprop="longitude" content="{lng:.6f}"/></span>
+<div class="zsg-photo-card-caption">
+<h4 class="zsg-photo-card-spec"><span class="zsg-photo-card-status">House For Sale</span></h4>
+<p class="zsg-photo-card-spec"><span class="zsg-photo-card-price">${price}</span></p>
+<p class="zsg-photo-card-spec"><span class="zsg-photo-card-address">{street}, {city}, CA</span></p>
+</div>
+<div class="minibubble template hide"><!--{{"bed":{beds},"miniBubbleType":1,"homeType":"{home_type}","sqft":{sqft},"baths":2.0}}--></div>
+</div>
+</article>'''
+
+PAGE_TEMPLATE = '''<!DOCTYPE html>
+<html><head><title>{zipcode} Real Estate - {zipcode} Homes For Sale | Zillow</title></head>
+<body>
+<div id="search-results">
+<div class="zsg-content-header"><h1>{city} CA Real Estate &amp; Homes For Sale</h1>
+<span class="result-count">{total:,d} results</span></div>
+<ul class="photo-cards">
+{cards}
+</ul>
+<ol class="zsg-pagination">
+{pagination}
+</ol>
+</div>
+</body></html>'''
+
+
+def zillow_results_page(zipcode='94025', page=1, n_cards=25, total=None,
+                        seed=0):
+    """
+    a search result page with n_cards listings
+
+    Parameters
+    ----------
+    zipcode: string
+        zipcode the page is for
+    page: integer
+        page number, the last page has no link to the next one
+    n_cards: integer
+        number of listings on the page
+    total: integer
+        number of results Zillow reports for the search, defaults to
+        n_cards * page so this is the last page
+    seed: integer
+        seed for the generated listings
+
+    Returns
+    -------
+    string
+        the page html
+    """
+    rng = np.random.RandomState(seed + page)
+    city = dict(ZIPCODES).get(zipcode, 'Menlo Park')
+    if total is None:
+        total = n_cards * page
+    cards = []
+    for k in range(n_cards):
+        price = int(rng.randint(300, 5000)) * 1000
+        cards.append(CARD_TEMPLATE.format(
+            zpid=int(rng.randint(10 ** 7, 10 ** 9)),
+            status=STATUSES[rng.randint(0, 3)],
+            street='{:d} {:s} St'.format(int(rng.randint(1, 9999)),
+                                        ['Oak', 'Elm', 'Pine', 'Main'][k % 4]),
+            city=city, zipcode=zipcode,
+            lat=37.45 + rng.normal() * 0.05, lng=-122.18 + rng.normal() * 0.05,
+            price='{:,d}'.format(price), beds=int(rng.randint(1, 6)),
+            home_type=HOME_TYPES[rng.randint(0, len(HOME_TYPES))],
+            sqft=int(rng.randint(600, 4000))))
+    if n_cards * page < total:  # there is a next page
+        pagination = '<li class="zsg-pagination-next"><a href="/homes/' + \
+            zipcode + '_rb/' + str(page + 1) + '_p/">Next</a></li>'
+    else:
+        pagination = '<li class="zsg-pagination-next"></li>'
+    if n_cards == 0:
+        pagination += '<h3 class="zsg-content_collapsed">No matching ' \
+                      'results...</h3>'
+    return PAGE_TEMPLATE.format(zipcode=zipcode, city=city, total=total,
+                                cards='\n'.join(cards),
+                                pagination=pagination)
+
+
+def raw_listing_frame(n_rows, seed=0):
+    """
+    listings as they come out of the scraped CSV files, before
+    ATTGoogleAPI.process_data, with every zillow_* column a string
+
+    Parameters
+    ----------
+    n_rows: integer
+        number of listings
+    seed: integer
+        seed for the generated values
+
+    Returns
+    -------
+    pandas.DataFrame
+        with the columns in shared_res.pandas_column_names
+    """
+    rng = np.random.RandomState(seed)
+    which = rng.randint(0, len(ZIPCODES), n_rows)
+    zipcodes = np.array([z for z, _ in ZIPCODES])[which]
+    cities = np.array([c for _, c in ZIPCODES])[which]
+    prices = rng.randint(300, 5000, n_rows)
+    # the formats price_filter has to understand
+    style = rng.randint(0, 4, n_rows)
+    price_str = np.where(style == 0, np.char.add(prices.astype(str), 'K'),
+                np.where(style == 1,
+                         np.char.add((prices / 1000.0).round(2).astype(str),
+                                     'M'),
+                np.where(style == 2, np.char.add((prices * 1000).astype(str),
+                                                 '+'),
+                         (prices * 1000).astype(str))))
+    now = datetime.datetime(2019, 7, 20)
+    df = pd.DataFrame({
+        'zillow_id': (10 ** 7 + np.arange(n_rows)).astype(str),
+        'zillow_addressStreet': np.char.add(
+            rng.randint(1, 9999, n_rows).astype(str), ' Main St'),
+        'zillow_addressCity': cities,
+        'zillow_addressState': 'CA',
+        'zillow_zipcode': zipcodes,
+        'zillow_price': price_str,
+        'zillow_longitude': (-122.18 + rng.normal(size=n_rows) * 0.1)
+        .round(6).astype(str),
+        'zillow_latitude': (37.45 + rng.normal(size=n_rows) * 0.1)
+        .round(6).astype(str),
+        'zillow_status': np.array(STATUSES)[rng.randint(0, len(STATUSES),
+                                                        n_rows)],
+        'zillow_homeType': np.array(HOME_TYPES)[rng.randint(0,
+                                                            len(HOME_TYPES),
+                                                            n_rows)],
+        'date_scraped': now.isoformat()},
+        columns=shared_res.pandas_column_names)
+    for name in DURATION_COLUMNS:
+        df[name] = np.nan
+    for name in shared_res.pandas_column_names:
+        if name.startswith('google_') or name == 'location':
+            df[name] = pd.Series([np.nan] * n_rows, dtype=object)
+    return df
+
+
+def processed_listing_frame(n_rows, seed=0, fill=1.0):
+    """
+    listings after process_data and get_times, ready for the analysis code
+
+    Parameters
+    ----------
+    n_rows: integer
+        number of listings
+    seed: integer
+        seed for the generated values
+    fill: float
+        fraction of rows that already have travel times, the rest are np.nan
+        and a few are np.inf for failed look ups
+
+    Returns
+    -------
+    pandas.DataFrame
+        with the columns in shared_res.pandas_column_names
+    """
+    rng = np.random.RandomState(seed)
+    df = raw_listing_frame(n_rows, seed)
+    df['zillow_id'] = df['zillow_id'].astype(int)
+    df['zillow_zipcode'] = df['zillow_zipcode'].astype(int)
+    df['zillow_price'] = rng.randint(300, 5000, n_rows) * 1000
+    df['zillow_latitude'] = df['zillow_latitude'].astype(float)
+    df['zillow_longitude'] = df['zillow_longitude'].astype(float)
+    df['location'] = df['zillow_latitude'].astype(str) + ',' + \
+        df['zillow_longitude'].astype(str)
+    df['date_scraped'] = pd.to_datetime(df['date_scraped'])
+    done = rng.uniform(size=n_rows) < fill
+    failed = rng.uniform(size=n_rows) < 0.01
+    base = rng.uniform(900, 4500, n_rows)
+    for name in DURATION_COLUMNS:
+        values = base * (1.3 if 'traffic' in name else 1.0) * \
+            (2.0 if 'transit' in name else 1.0)
+        values = np.where(done, values, np.nan)
+        df[name] = np.where(done & failed, np.inf, values)
+    return df
+
+
+def write_csv_dump(df, directory, by='zillow_zipcode', prefix=''):
+    """writes df as one CSV per zipcode, the way gather_data dumps them,
+    file names start with prefix"""
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    for zipcode, group in df.groupby(by):
+        group.to_csv(os.path.join(directory, prefix + str(zipcode) + '.csv'),
+                     index=False)
+
+
+def serve_pages(port=0, results=60, n_cards=25, latency=0.0):
+    """
+    starts an HTTP server on localhost answering /homes/<zipcode>_rb/ and
+    /homes/<zipcode>_rb/<page>_p/ with zillow_results_page, gzip compressed
+    when the client accepts it
+
+    Parameters
+    ----------
+    port: integer
+        port to listen on, 0 picks a free one
+    results: integer
+        results every zipcode has, spread over pages of n_cards
+    n_cards: integer
+        listings per page
+    latency: float
+        seconds each page takes
+
+    Returns
+    -------
+    server: http.server.HTTPServer
+        call server.shutdown() when done
+    base_url: string
+        e.g. 'http://127.0.0.1:50000', pages are base_url + '/homes/...'
+    """
+    import re
+    import gzip
+    import time
+    import threading
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    path = re.compile(r'^/homes/(\d{5})_rb/(?:(\d+)_p/)?$')
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep connections alive
+        disable_nagle_algorithm = True  # or small replies wait on acks
+
+        def do_GET(self):
+            found = path.match(self.path)
+            if found is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            time.sleep(latency)
+            page = int(found.group(2) or 1)
+            cards = max(0, min(n_cards, results - n_cards * (page - 1)))
+            data = zillow_results_page(found.group(1), page, cards,
+                                       results).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            if 'gzip' in self.headers.get('Accept-Encoding', ''):
+                data = gzip.compress(data)
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+        request_queue_size = 128
+
+    server = Server(('127.0.0.1', port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{:d}'.format(server.server_address[1])
+
+
+def load_recorded(name):
+    """contents of a saved fixture file, parsed if it is JSON"""
+    with open(os.path.join(FIXTURE_DIR, name), 'r') as fixture:
+        if name.endswith('.json'):
+            return json.load(fixture)
+        return fixture.read()
+
+
+if __name__ == '__main__':
+    if not os.path.exists(FIXTURE_DIR):
+        os.makedirs(FIXTURE_DIR)
+    pages = {'zillow_94025_p1.html': zillow_results_page('94025', 1, 25, 60),
+             'zillow_94025_p3.html': zillow_results_page('94025', 3, 10, 60),
+             'zillow_94020_empty.html': zillow_results_page('94020', 1, 0, 0)}
+    for name, page in pages.items():
+        with open(os.path.join(FIXTURE_DIR, name), 'w') as fixture:
+            fixture.write(page)
+    responses = {
+        'directions_morning_driving.json': fake_gmaps.directions_response(
+            '1543 Oriole Ave, Sunnyvale, CA 94087',
+            '2575 Sand Hill Rd, Menlo Park, CA 94025', 'driving'),
+        'directions_evening_transit.json': fake_gmaps.directions_response(
+            '2575 Sand Hill Rd, Menlo Park, CA 94025',
+            '1543 Oriole Ave, Sunnyvale, CA 94087', 'transit')}
+    for name, response in responses.items():
+        with open(os.path.join(FIXTURE_DIR, name), 'w') as fixture:
+            json.dump(response, fixture, indent=1, sort_keys=True)
@@ -0,0 +1,348 @@
+#!/usr/bin/env python
+"""Benchmarks of the hot paths, written to JSON so runs can be compared.
+
+Times page parsing, scraping zipcodes from fixtures.serve_pages, dumping and
+loading the scraped files, process_data, planning and making the get_times
+calls against fake_gmaps.FakeClient, GP prediction and the analysis
+functions on generated tables of each requested size.  Benchmarks whose
+dependencies aren't installed are recorded as skipped; any other error
+setting one up stops the run.
+
+python benchmarks/run_benchmarks.py --sizes 1000 10000 100000 1000000 \
+    --output bench_output.json
+python benchmarks/run_benchmarks.py --compare bench_output.json
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import importlib.util
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fixtures  # also puts the project on the path
+import fake_gmaps
+
+
+def bench_get_houses(size, args):
+    """zillow_parser.get_houses on saved result pages, size is cards"""
+    import gather_data
+    page = fixtures.zillow_results_page('94025', 1, 25, size)
+    n_pages = max(1, size // 25)
+
+    def run():
+        parser = gather_data.zillow_parser()
+        for _ in range(n_pages):
+            parser.get_houses(page)
+    return run
+
+
+def bench_dump_zipcode_dataframe(size, args):
+    """zillow_zipcode_search.dump_zipcode_dataframe, size is rows"""
+    import gather_data
+    df = fixtures.raw_listing_frame(size)
+    # skip __init__ so no browser is started
+    search = gather_data.zillow_zipcode_search.__new__(
+        gather_data.zillow_zipcode_search)
+    search.current_zip = '94025'
+    tmp_dir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(tmp_dir, 'July_20th_2019'))
+
+    def run():
+        cwd = os.getcwd()
+        os.chdir(tmp_dir)  # dump_zipcode_dataframe writes under the cwd
+        try:
+            search.dump_zipcode_dataframe(df)
+        finally:
+            os.chdir(cwd)
+    run.cleanup = lambda: shutil.rmtree(tmp_dir)
+    return run
+
+
+def bench_scrape_scheduled(size, args):
+    """gather_data.scrape_scheduled over HTTPFetcher against
+    fixtures.serve_pages, size is results over zipcodes of up to 500"""
+    import gather_data
+    import page_archive
+    import page_fetcher
+    import scrape_scheduler
+    if importlib.util.find_spec('httpx') is None:  # HTTPFetcher needs it
+        raise ImportError("No module named 'httpx'")
+    results = min(size, 25 * gather_data.MAX_PAGES)
+    zipcodes = ['{:05d}'.format(94000 + i)
+                for i in range(max(1, size // results))]
+    server, base_url = fixtures.serve_pages(results=results, n_cards=25,
+                                            latency=args.page_latency)
+    tmp_dir = tempfile.mkdtemp()
+
+    def run():
+        # a new table and archive every run, or every zipcode is fresh
+        run_dir = tempfile.mkdtemp(dir=tmp_dir)
+        os.mkdir(os.path.join(run_dir, 'July_20th_2019'))
+        tasks = scrape_scheduler.ScrapeScheduler(
+            os.path.join(run_dir, 'tasks.sqlite'))
+        tasks.add(zipcodes)
+        archive = page_archive.PageArchive(os.path.join(run_dir, 'pages'))
+        cwd = os.getcwd()
+        os.chdir(run_dir)  # dump_zipcode_dataframe writes under the cwd
+        try:
+            gather_data.scrape_scheduled(
+                tasks, worker='bench', archive=archive,
+                fetcher=page_fetcher.HTTPFetcher(), concurrency=4,
+                pause=(0, 0), base_url=base_url)
+        finally:
+            os.chdir(cwd)
+            tasks.close()
+            archive.close()
+
+    def cleanup():
+        server.shutdown()
+        shutil.rmtree(tmp_dir)
+    run.cleanup = cleanup
+    return run
+
+
+def _api(df=None, latency=0.0):
+    """ATTGoogleAPI on a fake client, optionally with df loaded"""
+    import google_api
+    api = google_api.ATTGoogleAPI(client=fake_gmaps.FakeClient(latency))
+    if df is not None:
+        api.df = df
+    return api
+
+
+def bench_load_files(size, args):
+    """ATTGoogleAPI.load_files from per-zipcode CSV files, size is rows"""
+    tmp_dir = tempfile.mkdtemp() + os.sep
+    fixtures.write_csv_dump(fixtures.raw_listing_frame(size), tmp_dir)
+    api = _api()
+
+    def run():
+        api.load_files(dump_location=tmp_dir, save_file='none.hdf5')
+    run.cleanup = lambda: shutil.rmtree(tmp_dir)
+    return run
+
+
+def bench_process_data(size, args):
+    """ATTGoogleAPI.process_data on freshly loaded listings, size is rows"""
+    raw = fixtures.raw_listing_frame(size)
+    api = _api()
+
+    def run():
+        api.df = raw.copy()
+        api.process_data()
+    return run
+
+
+def bench_get_times(size, args):
+    """ATTGoogleAPI.get_times on a fake client, size is rows with at most
+    args.calls calls made"""
+    df = fixtures.processed_listing_frame(size, fill=0.5)
+
+    def run():
+        api = _api(df.copy(), latency=args.latency)
+        api.get_times(number=args.calls)
+    return run
+
+
+def bench_plan_calls(size, args):
+    """ATTGoogleAPI.plan_calls, the get_times dry run, size is rows"""
+    api = _api(fixtures.processed_listing_frame(size, fill=0.9))
+    return api.plan_calls
+
+
+def bench_add_features(size, args):
+    """features.add_features, size is rows"""
+    import features
+    df = fixtures.processed_listing_frame(size)
+    return lambda: features.add_features(df.copy())
+
+
+def bench_affordability(size, args):
+    """affordability.payment_grid and an index query, size is rows"""
+    import features
+    import affordability
+    df = features.add_features(fixtures.processed_listing_frame(size))
+
+    def run():
+        affordability.payment_grid(df['zillow_price'].values,
+                                   [0.035, 0.04, 0.045, 0.05], [180, 360])
+        affordability.AffordabilityIndex.from_frame(df).query(6000, 45)
+    return run
+
+
+def bench_sampled_dbscan(size, args):
+    """clustering.sampled_dbscan on price and commute, size is rows"""
+    import features
+    import clustering
+    df = features.add_features(fixtures.processed_listing_frame(size))
+    X = clustering.standardize(
+        df[['price (M$)', 'average_drive_duration_with_traffic']]
+        .replace([np.inf], np.nan).fillna(0).values)
+    return lambda: clustering.sampled_dbscan(X, sample_size=20000,
+                                             random_state=0)
+
+
+def bench_density_grid(size, args):
+    """rendering.density_grid of price against commute, size is rows"""
+    import features
+    import rendering
+    df = features.add_features(fixtures.processed_listing_frame(size))
+    x = df['price (M$)'].values
+    y = df['average_drive_duration_with_traffic'].values
+
+    def run():
+        rendering.density_grid(rendering.iter_chunks(x, y),
+                               rendering._finite_extent(x, y))
+    return run
+
+
+def bench_gp_predict(size, args):
+    """gp_model.GPModel.predict of commutes from coordinates, size is rows"""
+    import gp_model
+    df = fixtures.processed_listing_frame(size)
+    X = df[['zillow_longitude', 'zillow_latitude']].values.astype(float)
+    y = df['morning_drive_duration_with_traffic'].values.astype(float)
+    train = np.isfinite(y).nonzero()[0][:512]
+    model = gp_model.fit(X[train], y[train], n_restarts_optimizer=0,
+                         random_state=0)
+    return lambda: model.predict(X)
+
+
+def bench_cube_query(size, args):
+    """aggregate_cube.AggregateCube count and percentiles of one zipcode and
+    home type, size is rows in the cube"""
+    import aggregate_cube
+    cube = aggregate_cube.AggregateCube()
+    cube.upsert(fixtures.processed_listing_frame(size))
+
+    def run():
+        cube.count(zipcodes=[94025], home_types=['SINGLE_FAMILY'],
+                   max_price=1.5e6, max_commute=45)
+        cube.percentiles(zipcodes=[94025], home_types=['SINGLE_FAMILY'])
+    return run
+
+
+def bench_sketch_ingest(size, args):
+    """sketches.SketchSet.ingest of every listing, size is rows"""
+    import sketches
+    df = fixtures.processed_listing_frame(size, fill=0.9)
+
+    def run():
+        sketches.SketchSet().ingest(df)
+    return run
+
+
+BENCHMARKS = [bench_get_houses, bench_dump_zipcode_dataframe,
+              bench_scrape_scheduled, bench_load_files,
+              bench_process_data, bench_plan_calls, bench_get_times,
+              bench_add_features,
+              bench_affordability, bench_sampled_dbscan, bench_density_grid,
+              bench_gp_predict, bench_cube_query, bench_sketch_ingest]
+
+
+def run_benchmark(bench, size, args):
+    """times one benchmark at one size, returns its result dictionary"""
+    result = {'name': bench.__name__[len('bench_'):], 'size': size}
+    try:
+        run = bench(size, args)
+    except ImportError as err:  # a missing optional dependency
+        result['skipped'] = '{:s}: {:s}'.format(type(err).__name__, str(err))
+        return result
+    samples = []
+    try:
+        for _ in range(args.repeat):
+            start = time.time()
+            run()
+            samples.append(time.time() - start)
+    except Exception as err:
+        result['error'] = '{:s}: {:s}'.format(type(err).__name__, str(err))
+        return result
+    finally:
+        if hasattr(run, 'cleanup'):
+            run.cleanup()
+    samples.sort()
+    result['seconds_median'] = samples[len(samples) // 2]
+    result['seconds_min'] = samples[0]
+    result['repeat'] = len(samples)
+    result['per_second'] = size / result['seconds_median'] \
+        if result['seconds_median'] > 0 else None
+    return result
+
+
+def compare(old_path, new_results, threshold):
+    """prints the change of every benchmark in both runs, returns True if
+    none got slower by more than threshold"""
+    with open(old_path, 'r') as old_file:
+        old = dict(((r['name'], r['size']), r)
+                   for r in json.load(old_file)['results'])
+    ok = True
+    for result in new_results:
+        before = old.get((result['name'], result['size']), {})
+        if 'seconds_median' not in before or 'seconds_median' not in result:
+            continue
+        ratio = result['seconds_median'] / before['seconds_median']
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            ok = False
+        print('{:s} [{:d}]: {:.4f}s -> {:.4f}s ({:.2f}x){:s}'.format(
+            result['name'], result['size'], before['seconds_median'],
+            result['seconds_median'], ratio, flag))
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[10 ** 3, 10 ** 4, 10 ** 5])
+    parser.add_argument('--only', nargs='+', default=None,
+                        help='names of the benchmarks to run')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds per call of the fake Google client')
+    parser.add_argument('--page-latency', type=float, default=0.0,
+                        help='seconds per page of the fixture Zillow server')
+    parser.add_argument('--calls', type=int, default=200,
+                        help='maximum API calls per get_times run')
+    parser.add_argument('--output', default=None,
+                        help='JSON file to write, default is stdout')
+    parser.add_argument('--compare', default=None,
+                        help='JSON file of a previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='slow down counted as a regression')
+    args = parser.parse_args()
+
+    results = []
+    for bench in BENCHMARKS:
+        name = bench.__name__[len('bench_'):]
+        if args.only and name not in args.only:
+            continue
+        for size in args.sizes:
+            results.append(run_benchmark(bench, size, args))
+            sys.stderr.write(json.dumps(results[-1]) + '\n')
+    report = {'meta': {'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                       'python': platform.python_version(),
+                       'numpy': np.__version__,
+                       'pandas': pd.__version__,
+                       'machine': platform.machine(),
+                       'latency': args.latency,
+                       'calls': args.calls},
+              'results': results}
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=1, sort_keys=True)
+    else:
+        print(json.dumps(report, indent=1, sort_keys=True))
+    if args.compare and not compare(args.compare, results, args.threshold):
+        sys.exit(1)
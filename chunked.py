@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""Out-of-core processing of the scraped listings.
+
+ATTGoogleAPI.load_files and process_data hold every listing in memory at
+once, as strings.  Here the scraped CSV files are streamed in batches
+through google_api.transform_listings and features.add_features, and each
+batch is appended to an analysis_store export (and optionally a CSV of the
+processed listings) before the next one is read.  The batch size is worked
+out from the memory a batch really takes and the max_rss_mb ceiling, so the
+peak memory stays the same however many listings there are:
+
+```
+import chunked, analysis_store
+chunked.process_dump('./dumped_data/', './dumped_data/analysis_all',
+                     max_rss_mb=512)
+data = analysis_store.AnalysisData('./dumped_data/analysis_all')
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os  # to find the CSV files
+import sys
+import time  # for the rate metrics
+import resource  # for the peak RSS
+import pandas as pd
+import shared_res  # column types of the CSV files
+import features  # derived columns
+import metrics  # batch and row counts
+import analysis_store  # where the batches go
+import google_api  # transform_listings
+
+DEFAULT_MAX_RSS_MB = 1024
+# copies of a batch alive at once while it is parsed and transformed
+WORKING_COPIES = 6
+
+
+def rss_mb():
+    """resident memory of this process in MB"""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / 1048576.0
+    except (IOError, OSError, ValueError):  # not linux, use the peak
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    """peak resident memory of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on linux and bytes on macOS
+    if sys.platform == 'darwin':
+        peak = peak / 1024.0
+    return peak / 1024.0
+
+
+class BatchSizer:
+    """
+    Picks the number of rows per batch so a batch in flight fits under
+    max_rss_mb.
+
+    The first batch is small.  After each batch the memory per row is
+    measured and the next batch is sized to fill the room between what the
+    process already uses and the ceiling, WORKING_COPIES times over.
+
+    Parameters
+    ----------
+    max_rss_mb: float
+        ceiling on the resident memory of the process
+    first_rows: integer
+        rows in the first batch
+    min_rows: integer
+        fewest rows in a batch, even if the process is near the ceiling
+    max_rows: integer
+        most rows in a batch
+    """
+    def __init__(self, max_rss_mb=DEFAULT_MAX_RSS_MB, first_rows=10000,
+                 min_rows=1000, max_rows=2000000):
+        self.max_rss_mb = max_rss_mb
+        self.rows = first_rows
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.bytes_per_row = None
+
+    def observe(self, batch):
+        """measures a batch as it was read and sizes the next one"""
+        if len(batch) == 0:
+            return
+        self.bytes_per_row = batch.memory_usage(deep=True).sum() / \
+            float(len(batch))
+        room = (self.max_rss_mb - rss_mb()) * 1048576.0
+        rows = int(room / (self.bytes_per_row * WORKING_COPIES))
+        self.rows = max(self.min_rows, min(self.max_rows, rows))
+        metrics.gauge('chunked_batch_rows').set(self.rows)
+
+
+def iter_csv_batches(dump_location, sizer):
+    """
+    yields the listings of every CSV file in dump_location in batches of
+    sizer.rows rows, as strings like load_files reads them
+    """
+    for file_str in sorted(os.listdir(dump_location)):
+        if file_str.split('.')[-1] != 'csv':  # only open CSV files
+            continue
+        reader = pd.read_csv(os.path.join(dump_location, file_str),
+                             dtype=shared_res.pandas_dtypes, iterator=True)
+        try:
+            while True:
+                try:
+                    batch = reader.get_chunk(sizer.rows)
+                except StopIteration:
+                    break
+                sizer.observe(batch)
+                yield batch
+        finally:
+            reader.close()
+
+
+def process_batch(batch):
+    """
+    one batch of scraped listings after google_api.transform_listings and
+    features.add_features
+    """
+    start = time.time()
+    processed = google_api.transform_listings(batch)
+    if len(processed):
+        processed = features.add_features(processed)
+    metrics.counter('chunked_rows_total', stage='read').inc(len(batch))
+    metrics.counter('chunked_rows_total', stage='kept').inc(len(processed))
+    metrics.histogram('chunked_batch_seconds').observe(time.time() - start)
+    return processed
+
+
+def process_batches(batches):
+    """yields process_batch of each batch"""
+    for batch in batches:
+        yield process_batch(batch)
+
+
+def process_dump(dump_location, export_dir, max_rss_mb=DEFAULT_MAX_RSS_MB,
+                 csv_output=None, sketches=None):
+    """
+    processes every scraped CSV file in dump_location in batches into an
+    analysis_store export, never holding more than one batch
+
+    Parameters
+    ----------
+    dump_location: string
+        directory of the scraped CSV files
+    export_dir: string
+        directory of the analysis_store export to write
+    max_rss_mb: float
+        ceiling on the resident memory while processing, see BatchSizer
+    csv_output: string
+        also write the processed listings, with their address columns, to
+        this CSV file
+    sketches: sketches.SketchSet
+        also ingest every processed batch into these quantile sketches
+
+    Returns
+    -------
+    dictionary
+        rows read and kept, number of batches, seconds taken and the peak
+        RSS in MB
+    """
+    start = time.time()
+    sizer = BatchSizer(max_rss_mb)
+    writer = analysis_store.ExportWriter(export_dir)
+    stats = {'rows_read': 0, 'rows_kept': 0, 'batches': 0}
+    header = True
+    # the CSV is written beside its final name and moved there with the
+    # export, so a failed run leaves the last good one
+    partial = csv_output + '.part' if csv_output else None
+    try:
+        for batch in iter_csv_batches(dump_location, sizer):
+            processed = process_batch(batch)
+            stats['rows_read'] += len(batch)
+            stats['rows_kept'] += len(processed)
+            stats['batches'] += 1
+            writer.append(processed)
+            if sketches is not None:
+                sketches.ingest(processed)
+            if csv_output:
+                processed.to_csv(partial, mode='w' if header else 'a',
+                                 header=header, index=False)
+                header = False
+        writer.close()
+        if csv_output and not header:
+            os.replace(partial, csv_output)
+    except BaseException:
+        # no half written export left behind, the last good one stays
+        writer.abort()
+        if partial and os.path.exists(partial):
+            os.remove(partial)
+        raise
+    stats['seconds'] = time.time() - start
+    stats['peak_rss_mb'] = peak_rss_mb()
+    return stats
+
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+"""Cluster analysis that scales to millions of listings.
+
+sklearn's DBSCAN keeps the neighborhood of every point in memory, which is
+fine for one county but not for all of them.  sampled_dbscan runs DBSCAN on a
+random sample and then assigns every point to the cluster of its nearest core
+sample, streaming the points through a nearest neighbor index in fixed-size
+chunks so memory is bounded by the sample and the chunk, not the data.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import numpy as np
+
+
+def standardize(X):
+    """
+    scales each column of X to zero mean and unit variance, like
+    sklearn.preprocessing.StandardScaler but as float32 to save memory
+
+    Parameters
+    ----------
+    X: array
+        (n_points, n_features) data
+
+    Returns
+    -------
+    numpy array
+        the scaled data
+    """
+    X = np.asarray(X, dtype=np.float32)
+    scale = X.std(axis=0)
+    scale[scale == 0] = 1.0
+    return (X - X.mean(axis=0)) / scale
+
+
+def sampled_dbscan(X, eps=0.1, min_samples=50, sample_size=50000,
+                   chunk_size=100000, n_jobs=1, random_state=None):
+    """
+    DBSCAN on a sample of X followed by assigning every point to the cluster
+    of its nearest core sample
+
+    A point that is farther than eps from every core sample is noise.  The
+    sample is thinner than the full data, so min_samples is scaled down by
+    the sampling fraction to find the same dense regions.
+
+    Parameters
+    ----------
+    X: array
+        (n_points, n_features) data, already scaled (see standardize)
+    eps: float
+        DBSCAN neighborhood radius
+    min_samples: integer
+        DBSCAN core point threshold for the full data
+    sample_size: integer
+        number of points to run DBSCAN on, if X is smaller than this plain
+        DBSCAN is used
+    chunk_size: integer
+        number of points assigned per nearest neighbor query
+    n_jobs: integer
+        number of parallel jobs for DBSCAN and the neighbor queries,
+        -1 means all processors
+    random_state: integer
+        seed for picking the sample
+
+    Returns
+    -------
+    labels: numpy array
+        cluster label of every point, -1 for noise
+    core_mask: numpy array
+        True for the points that are core samples
+    """
+    from sklearn.cluster import DBSCAN
+    from sklearn.neighbors import NearestNeighbors
+    X = np.asarray(X)
+    n_points = len(X)
+    labels = np.full(n_points, -1, dtype=np.int32)
+    core_mask = np.zeros(n_points, dtype=bool)
+
+    if n_points <= sample_size:
+        db = DBSCAN(eps=eps, min_samples=min_samples, n_jobs=n_jobs).fit(X)
+        labels[:] = db.labels_
+        core_mask[db.core_sample_indices_] = True
+        return labels, core_mask
+
+    rng = np.random.RandomState(random_state)
+    sample = np.sort(rng.choice(n_points, sample_size, replace=False))
+    scaled_min = max(2, int(round(min_samples * sample_size
+                                  / float(n_points))))
+    db = DBSCAN(eps=eps, min_samples=scaled_min, n_jobs=n_jobs).fit(X[sample])
+    core = sample[db.core_sample_indices_]
+    core_mask[core] = True
+    if len(core) == 0:  # everything is noise
+        return labels, core_mask
+
+    core_labels = db.labels_[db.core_sample_indices_].astype(np.int32)
+    index = NearestNeighbors(n_neighbors=1, n_jobs=n_jobs).fit(X[core])
+    for start in range(0, n_points, chunk_size):
+        stop = min(start + chunk_size, n_points)
+        dist, nearest = index.kneighbors(X[start:stop])
+        dist = dist[:, 0]
+        chunk_labels = core_labels[nearest[:, 0]]
+        labels[start:stop] = np.where(dist <= eps, chunk_labels, -1)
+    return labels, core_mask
+
+
+def cluster_summary(labels):
+    """
+    number of clusters and noise points without building per-cluster masks
+
+    Parameters
+    ----------
+    labels: array
+        cluster labels, -1 for noise
+
+    Returns
+    -------
+    n_clusters: integer
+        number of clusters, ignoring noise
+    n_noise: integer
+        number of noise points
+    sizes: numpy array
+        number of points in each cluster, indexed by label
+    """
+    labels = np.asarray(labels, dtype=np.int64)
+    sizes = np.bincount(labels[labels >= 0])
+    n_noise = int(np.count_nonzero(labels == -1))
+    return int(np.count_nonzero(sizes)), n_noise, sizes
@@ -6,15 +6,14 @@ __license__ = "GPL"
 __version__ = "0.0"
 __status__ = "Development"
 
+# matplotlib and sklearn are slow to import, so they are imported by the
+# functions that use them and nothing is loaded until a function asks for it.
+import os
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from sklearn.cluster import DBSCAN
-from sklearn.preprocessing import StandardScaler
-from sklearn.gaussian_process import GaussianProcessRegressor
-from sklearn.gaussian_process.kernels import RBF, ConstantKernel as C
-from sklearn.gaussian_process.kernels import DotProduct, WhiteKernel
-plt.ion()
+import rendering # headless plots of large tables
+import analysis_store # memory-mapped columns and row index helpers
+import gp_model # cached GP fit and chunked prediction
 
 # Fixing random state for reproducibility
 np.random.seed(19680801)
@@ -23,45 +22,61 @@ np.random.seed(19680801)
 # data from one data set to others. Travel time comes from Google Maps which
 # costs money. We want to avoid paying for more API calls when we already
 # have plenty of travel time data.
-def GP_Winter_2018_Travel_Time_data(diagnostic_on):
+def GP_Winter_2018_Travel_Time_data(diagnostic_on, plot_path=None,
+                                    data_dir=None, cache_dir=None,
+                                    processes=1, chunk_size=4096,
+                                    float32=False):
     '''
     # A function to use a Gaussian Process Regressor to extrapolate travel time
     # data from one data set to others. Travel time comes from Google Maps which
     # costs money. We want to avoid paying for more API calls when we already
     # have plenty of travel time data.
     :param diagnostic_on: Turn on test/diagnostics and plots
+    :param plot_path: write the diagnostic plot of every prediction to this
+    file as a density image instead of showing a subset of the points
+    :param data_dir: read the travel times from this analysis_store export
+    instead of loading the whole hdf5 file
+    :param cache_dir: where the fitted model is kept, see gp_model.fit_cached,
+    defaults to the directory of the data
+    :param processes: number of processes predicting
+    :param chunk_size: points predicted at a time
+    :param float32: predict in single precision
     :return:
     '''
-    # This is a local path that wont be shared to preserve data.
-    Winter_2018 = pd.read_hdf(
-        "../../travel_time_data/Winter_2018_Travel_Time.hdf5")
-    # Turn the data into np.arrays that are easier to handle instead of
-    # typing the dataframe names over and over.
-    X = Winter_2018[['zillow_longitude', 'zillow_latitude']].values
-    Y = Winter_2018['morning_drive_duration_with_traffic'].values
+    data_path = "../../travel_time_data/Winter_2018_Travel_Time.hdf5"
+    if data_dir:
+        # memory-mapped, only the columns used are read
+        data = analysis_store.AnalysisData(data_dir)
+        X = data.stack(['longitude', 'latitude'])
+        Y = data['morning_drive_duration_with_traffic']
+    else:
+        # This is a local path that wont be shared to preserve data.
+        Winter_2018 = pd.read_hdf(data_path)
+        # Turn the data into np.arrays that are easier to handle instead of
+        # typing the dataframe names over and over.
+        X = Winter_2018[['zillow_longitude', 'zillow_latitude']].values
+        Y = Winter_2018['morning_drive_duration_with_traffic'].values
     # Reduce the dimensionality to fit so it isn't so slow!
     N = 2 ** 10
     points = np.sort(np.random.randint(0, len(X) - 1, N))
     x = X[points]
     y = Y[points]
     print('Fitting the 2D GP model...')
-    # Specify the kernel
-    kernel = C(np.mean(y)) + RBF((0.02, 0.02), (1e-5, 1e+2)) \
-             + WhiteKernel(1.0, noise_level_bounds=(1e-10, 1e+0))
-    gpr = GaussianProcessRegressor(kernel=kernel,
-                                   alpha=1e-3,
-                                   n_restarts_optimizer=1)
-    # Fit the known data
-    gpr.fit(x, y)
+    # Fit the known data, or load the fit of the same points from before
+    if not cache_dir:
+        cache_dir = data_dir or os.path.dirname(os.path.abspath(data_path))
+    gpr = gp_model.fit_cached(x, y, cache_dir=cache_dir)
 
     # Diagnostic checks
     if diagnostic_on == 1:
         # Predict on the data that wasn't used to fit.
-        T = np.linspace(0, len(X) - 1, len(X), dtype='int')
-        xx = X[~np.isin(T, points)]
-        yy = Y[~np.isin(T, points)]
+        rest = analysis_store.complement(points, len(X))
+        xx = X[rest]
+        yy = Y[rest]
         print('Predicting using 2D GP model...')
-        y_pred = gpr.predict(xx)
+        # in chunks, so the kernel matrix of every point is never built
+        y_pred = gpr.predict(xx, chunk_size=chunk_size, processes=processes,
+                             dtype=np.float32 if float32 else np.float64)
 
         # Calculate the absolute prediction error
         pred_error = np.divide((yy - y_pred), yy)
@@ -70,6 +85,12 @@ def GP_Winter_2018_Travel_Time_data(diagnostic_on):
         pred_error = np.divide((yy - y_pred), yy)
         print('The mean error is %.3f' % np.mean(pred_error))
 
+        if plot_path:
+            rendering.render_prediction_check(yy, y_pred, plot_path)
+            return
+
+        import matplotlib.pyplot as plt
+        plt.ion()
         # Use a subset of points so the plot doesn't murder your computer.
         N = 2 ** 9
         subset = np.sort(np.random.randint(0, len(yy) - 1, N))
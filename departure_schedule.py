@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+"""Departure times as logical weekly slots.
+
+Google only routes with traffic for departure times in the future, so the
+fixed 2019 epoch seconds ATTGoogleAPI used to default to had to be edited
+before every run, and anything keyed on them was never reused.  A slot is a
+weekday, a time of day and a timezone, e.g. 'Tuesday 08:00
+America/Los_Angeles'.  It is resolved to the next epoch second it falls on
+when a call is made, daylight saving time included, while caches key on
+the slot itself so a route found last week is still found this week:
+
+```
+import departure_schedule
+schedule = departure_schedule.DepartureSchedule()
+schedule.epoch('morning')  # the next Tuesday 8:00 in California
+schedule.key('morning')    # 'Tuesday 08:00 America/Los_Angeles'
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import time  # for the current time
+import datetime
+import collections
+
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+            'Saturday', 'Sunday')
+DEFAULT_TIMEZONE = 'America/Los_Angeles'
+# leave for work at 8:00 and for home at 5:30 PM on a Tuesday, like the
+# fixed times used before (Feb 26, 2019)
+DEFAULT_MORNING = 'Tuesday 08:00 ' + DEFAULT_TIMEZONE
+DEFAULT_EVENING = 'Tuesday 17:30 ' + DEFAULT_TIMEZONE
+# how far in the future a resolved departure must be, so it is still in the
+# future when Google gets the request
+DEFAULT_LEAD = 300
+
+
+class Slot(collections.namedtuple('Slot', ['weekday', 'seconds',
+                                           'timezone'])):
+    """
+    A weekly departure time.
+
+    Attributes
+    ----------
+    weekday: integer
+        0 for Monday to 6 for Sunday
+    seconds: integer
+        seconds since local midnight
+    timezone: string
+        IANA timezone name, e.g. 'America/Los_Angeles'
+    """
+    __slots__ = ()
+
+    @property
+    def key(self):
+        """the slot as text, 'Tuesday 08:00 America/Los_Angeles', for cache
+        keys"""
+        return '{:s} {:02d}:{:02d} {:s}'.format(
+            WEEKDAYS[self.weekday], self.seconds // 3600,
+            (self.seconds % 3600) // 60, self.timezone)
+
+    def at(self, seconds):
+        """the slot on the same day at another time of day"""
+        return self._replace(seconds=int(seconds) % 86400)
+
+    def next_epoch(self, now=None, lead=DEFAULT_LEAD):
+        """
+        seconds since 1970 of the first time this slot comes around at
+        least lead seconds after now
+
+        Parameters
+        ----------
+        now: float
+            seconds since 1970, the current time if None
+        lead: integer
+            seconds the departure must be in the future by
+
+        Returns
+        -------
+        integer
+            epoch seconds of the departure
+        """
+        from zoneinfo import ZoneInfo
+        if now is None:
+            now = time.time()
+        zone = ZoneInfo(self.timezone)
+        today = datetime.datetime.fromtimestamp(now, zone).date()
+        day = today + datetime.timedelta(
+            days=(self.weekday - today.weekday()) % 7)
+        clock = datetime.time(self.seconds // 3600,
+                              (self.seconds % 3600) // 60, self.seconds % 60)
+        while True:
+            epoch = datetime.datetime.combine(day, clock,
+                                              tzinfo=zone).timestamp()
+            if epoch >= now + lead:
+                return int(epoch)
+            day += datetime.timedelta(days=7)
+
+
+def parse_slot(text):
+    """
+    the Slot of 'Weekday HH:MM [Timezone]', e.g. 'Tuesday 08:00
+    America/Los_Angeles' or 'tue 17:30'; the timezone defaults to
+    DEFAULT_TIMEZONE
+    """
+    if isinstance(text, Slot):
+        return text
+    words = text.split()
+    if len(words) not in (2, 3):
+        raise ValueError('a slot looks like "Tuesday 08:00 '
+                         'America/Los_Angeles", not {!r}'.format(text))
+    names = [day[:3].lower() for day in WEEKDAYS]
+    try:
+        weekday = names.index(words[0][:3].lower())
+        hours, minutes = words[1].split(':')
+        seconds = int(hours) * 3600 + int(minutes) * 60
+    except ValueError:
+        raise ValueError('a slot looks like "Tuesday 08:00 '
+                         'America/Los_Angeles", not {!r}'.format(text))
+    if not 0 <= seconds < 86400:
+        raise ValueError('{!r} is not a time of day'.format(words[1]))
+    timezone = words[2] if len(words) == 3 else DEFAULT_TIMEZONE
+    return Slot(weekday, seconds, timezone)
+
+
+class DepartureSchedule:
+    """
+    The morning and evening departure slots of the commute.
+
+    Parameters
+    ----------
+    morning: string or Slot
+        when the route leaves the listing for SLAC
+    evening: string or Slot
+        when the route leaves SLAC for the listing
+    lead: integer
+        seconds in the future a resolved departure must be
+    """
+    def __init__(self, morning=DEFAULT_MORNING, evening=DEFAULT_EVENING,
+                 lead=DEFAULT_LEAD):
+        self.slots = {'morning': parse_slot(morning),
+                      'evening': parse_slot(evening)}
+        self.lead = lead
+
+    def slot(self, leg, seconds=None):
+        """the Slot of leg, or of the same day at seconds since midnight"""
+        slot = self.slots[leg]
+        if seconds is None:
+            return slot
+        return slot.at(seconds)
+
+    def key(self, leg, seconds=None):
+        """the cache key of slot(leg, seconds)"""
+        return self.slot(leg, seconds).key
+
+    def epoch(self, leg, seconds=None, now=None):
+        """the next departure of slot(leg, seconds) in epoch seconds"""
+        return self.slot(leg, seconds).next_epoch(now, self.lead)
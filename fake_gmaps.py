@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+"""
+Offline stand-in for googlemaps.Client.
+
+FakeClient answers directions and geocode requests with responses shaped like
+the ones Google returns, without a network connection or an API key, and can
+be told how long each call should take.  Use it for benchmarks and for trying
+out changes to google_api.py without spending money:
+
+```
+import google_api, fake_gmaps
+t = google_api.ATTGoogleAPI(client=fake_gmaps.FakeClient(latency=0.05))
+```
+
+serve answers the same requests over HTTP, for testing clients that talk to
+the web service themselves, e.g. async_gmaps.AsyncClient.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import time  # to imitate the latency of the real API
+import zlib  # for stable pseudo-random numbers from strings
+import math
+import random  # for injected faults
+import threading  # calls may come from several threads
+import json  # for the HTTP server
+
+# roughly where SLAC is, used for addresses that aren't coordinates
+SLAC_LAT = 37.4200115
+SLAC_LNG = -122.203196
+
+
+def _parse_location(location):
+    """(lat, lng) for a 'lat,lng' string, or a stable point for an address"""
+    try:
+        lat, lng = location.split(',')
+        return float(lat), float(lng)
+    except (ValueError, AttributeError):
+        # spread addresses over the bay area based on their text
+        crc = zlib.crc32(str(location).encode('utf-8')) & 0xffffffff
+        return (SLAC_LAT + ((crc % 1000) / 1000.0 - 0.5) * 0.8,
+                SLAC_LNG + (((crc // 1000) % 1000) / 1000.0 - 0.5) * 0.8)
+
+
+def _distance_m(start, end):
+    """great circle distance in meters between two (lat, lng) points"""
+    lat1, lng1 = map(math.radians, start)
+    lat2, lng2 = map(math.radians, end)
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371000 * math.asin(math.sqrt(a))
+
+
+def traffic_factor(departure_time=None):
+    """
+    duration_in_traffic over duration at a departure time, with rush hours
+    around 8:00 and 17:30 in California, the default morning and evening
+    slots of departure_schedule, which both get 1.35
+    """
+    if departure_time is None:
+        return 1.35
+    import datetime
+    from zoneinfo import ZoneInfo
+    local = datetime.datetime.fromtimestamp(int(departure_time),
+                                            ZoneInfo('America/Los_Angeles'))
+    hour = local.hour + local.minute / 60.0 + local.second / 3600.0
+    return 1.0 + 0.35 * math.exp(-((hour - 8.0) / 1.2) ** 2) + \
+        0.35 * math.exp(-((hour - 17.5) / 1.4) ** 2)
+
+
+def directions_response(origin, destination, mode='driving',
+                        departure_time=None):
+    """
+    a directions result for origin to destination shaped like the one the
+    Google API returns, with durations that depend on the straight line
+    distance
+
+    Parameters
+    ----------
+    origin: string
+        'lat,lng' or an address
+    destination: string
+        'lat,lng' or an address
+    mode: string
+        'driving' or 'transit', transit results have no duration_in_traffic
+    departure_time: integer
+        seconds since 1970, sets the traffic, see traffic_factor
+
+    Returns
+    -------
+    list
+        one route with one leg
+    """
+    start = _parse_location(origin)
+    end = _parse_location(destination)
+    meters = _distance_m(start, end)
+    # 15 m/s on the road, a third of that on transit, plus a fixed overhead
+    speed = 15.0 if mode == 'driving' else 5.0
+    duration = int(120 + meters / speed)
+    leg = {'start_address': str(origin),
+           'start_location': {'lat': start[0], 'lng': start[1]},
+           'end_address': str(destination),
+           'end_location': {'lat': end[0], 'lng': end[1]},
+           'distance': {'text': '{:.1f} km'.format(meters / 1000.0),
+                        'value': int(meters)},
+           'duration': {'text': '{:d} mins'.format(duration // 60),
+                        'value': duration}}
+    if mode == 'driving':
+        traffic = int(duration * traffic_factor(departure_time))
+        leg['duration_in_traffic'] = {'text': '{:d} mins'.format(traffic // 60),
+                                      'value': traffic}
+    return [{'legs': [leg], 'summary': 'fake route', 'warnings': []}]
+
+
+def distance_matrix_response(origins, destinations, mode='driving',
+                             departure_time=None):
+    """
+    a distance matrix result shaped like the one the Google API returns,
+    every element is the leg directions_response gives for that pair
+
+    Parameters
+    ----------
+    origins: list of strings
+        'lat,lng' or addresses
+    destinations: list of strings
+        'lat,lng' or addresses
+    mode: string
+        'driving' or 'transit'
+    departure_time: integer
+        seconds since 1970, sets the traffic, see traffic_factor
+
+    Returns
+    -------
+    dictionary
+        origin_addresses, destination_addresses and one row per origin
+    """
+    rows = []
+    for origin in origins:
+        elements = []
+        for destination in destinations:
+            leg = directions_response(origin, destination, mode,
+                                      departure_time)[0]['legs'][0]
+            element = {'status': 'OK', 'distance': leg['distance'],
+                       'duration': leg['duration']}
+            if 'duration_in_traffic' in leg:
+                element['duration_in_traffic'] = leg['duration_in_traffic']
+            elements.append(element)
+        rows.append({'elements': elements})
+    return {'status': 'OK', 'origin_addresses': list(origins),
+            'destination_addresses': list(destinations), 'rows': rows}
+
+
+def serve(port=0, client=None):
+    """
+    starts an HTTP server on localhost answering the directions, distance
+    matrix and geocode requests of the Google web service from a FakeClient
+
+    Injected faults are answered like Google does: quota errors as an
+    OVER_QUERY_LIMIT status, not_found as NOT_FOUND, transient ones as an
+    HTTP 503.
+
+    Parameters
+    ----------
+    port: integer
+        port to listen on, 0 picks a free one
+    client: FakeClient
+        latency and faults of the answers, a FakeClient() if None
+
+    Returns
+    -------
+    server: http.server.HTTPServer
+        call server.shutdown() when done
+    base_url: string
+        e.g. 'http://127.0.0.1:50000', for async_gmaps.AsyncClient
+    """
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+    client = client or FakeClient()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep connections alive
+        disable_nagle_algorithm = True  # or small replies wait on acks
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = dict((k, v[0]) for k, v in parse_qs(url.query).items())
+            mode = query.get('mode', 'driving')
+            code, body = 200, {'status': 'OK'}
+            try:
+                if url.path == '/maps/api/directions/json':
+                    body['routes'] = client.directions(
+                        query['origin'], query['destination'], mode=mode)
+                elif url.path == '/maps/api/geocode/json':
+                    body['results'] = client.geocode(query.get('address'))
+                elif url.path == '/maps/api/distancematrix/json':
+                    body = client.distance_matrix(
+                        query['origins'].split('|'),
+                        query['destinations'].split('|'), mode=mode)
+                else:
+                    code, body = 404, {}
+            except Exception as error:
+                status = getattr(error, 'status', None)
+                if status is None:
+                    code, body = 503, {}
+                else:
+                    body = {'status': status,
+                            'error_message': getattr(error, 'message', '')}
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+        request_queue_size = 128  # clients open many connections at once
+
+    server = Server(('127.0.0.1', port), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server, 'http://127.0.0.1:{:d}'.format(server.server_address[1])
+
+
+def make_error(kind):
+    """
+    an exception like the one googlemaps raises for a resilience.classify
+    kind: 'quota', 'transient', 'not_found' or 'timeout'
+    """
+    try:
+        from googlemaps import exceptions
+    except ImportError:  # lookalikes with the same names and attributes
+        exceptions = _exceptions
+    if kind == 'quota':
+        return exceptions.ApiError('OVER_QUERY_LIMIT',
+                                   'You have exceeded your rate-limit.')
+    if kind == 'transient':
+        return exceptions.TransportError('connection reset by fake peer')
+    if kind == 'not_found':
+        return exceptions.ApiError('NOT_FOUND', 'address not found')
+    if kind == 'timeout':
+        return exceptions.Timeout()
+    raise ValueError('unknown fault kind ' + kind)
+
+
+class _exceptions:
+    """stand-ins for googlemaps.exceptions when it isn't installed"""
+    class ApiError(Exception):
+        def __init__(self, status, message=None):
+            Exception.__init__(self, status, message)
+            self.status = status
+            self.message = message
+
+    class TransportError(Exception):
+        pass
+
+    class Timeout(Exception):
+        pass
+
+
+class FakeClient:
+    """
+    Implements the googlemaps.Client methods that google_api.py uses.
+
+    Faults can be injected to exercise retries and backoff: each call fails
+    with the probabilities in faults, and calls beyond quota_per_second in
+    any one second, or beyond max_concurrent at the same time, fail as over
+    the query limit like the real API.
+
+    Parameters
+    ----------
+    latency: float
+        seconds each call sleeps before answering
+    faults: dictionary
+        probability of each fault kind per call, kinds as in make_error,
+        e.g. {'transient': 0.05, 'not_found': 0.01}
+    quota_per_second: float
+        calls allowed per second, None for no limit
+    max_concurrent: integer
+        calls allowed in flight at once, None for no limit
+    seed: integer
+        seed for the injected faults
+
+    Attributes
+    ----------
+    calls: dictionary
+        number of calls made to each method
+    failures: dictionary
+        number of injected faults of each kind
+    peak_concurrent: integer
+        most calls seen in flight at once
+    """
+    def __init__(self, latency=0.0, faults=None, quota_per_second=None,
+                 max_concurrent=None, seed=None):
+        self.latency = latency
+        self.faults = faults or {}
+        self.quota_per_second = quota_per_second
+        self.max_concurrent = max_concurrent
+        self.random = random.Random(seed)
+        self.calls = {'directions': 0, 'distance_matrix': 0, 'geocode': 0}
+        self.failures = {}
+        self.in_flight = 0
+        self.peak_concurrent = 0
+        self.recent = []  # start times of calls in the last second
+        self.lock = threading.Lock()
+
+    def _fault(self):
+        """the kind of fault for this call, or None"""
+        now = time.time()
+        self.recent = [t for t in self.recent if now - t < 1.0]
+        self.recent.append(now)
+        if self.quota_per_second is not None and \
+                len(self.recent) > self.quota_per_second:
+            return 'quota'
+        if self.max_concurrent is not None and \
+                self.in_flight > self.max_concurrent:
+            return 'quota'
+        draw = self.random.random()
+        for kind in sorted(self.faults):
+            draw -= self.faults[kind]
+            if draw < 0:
+                return kind
+        return None
+
+    def _wait(self, method):
+        with self.lock:
+            self.calls[method] += 1
+            self.in_flight += 1
+            self.peak_concurrent = max(self.peak_concurrent, self.in_flight)
+            fault = self._fault()
+            if fault:
+                self.failures[fault] = self.failures.get(fault, 0) + 1
+        try:
+            if self.latency > 0:
+                time.sleep(self.latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        if fault:
+            raise make_error(fault)
+
+    def directions(self, origin, destination, mode='driving',
+                   departure_time=None, traffic_model=None, **kwargs):
+        """see googlemaps.Client.directions"""
+        self._wait('directions')
+        return directions_response(origin, destination, mode, departure_time)
+
+    def distance_matrix(self, origins, destinations, mode='driving',
+                        departure_time=None, **kwargs):
+        """see googlemaps.Client.distance_matrix"""
+        self._wait('distance_matrix')
+        if isinstance(origins, str):
+            origins = origins.split('|')
+        if isinstance(destinations, str):
+            destinations = destinations.split('|')
+        return distance_matrix_response(origins, destinations, mode,
+                                        departure_time)
+
+    def geocode(self, address=None, **kwargs):
+        """see googlemaps.Client.geocode"""
+        self._wait('geocode')
+        lat, lng = _parse_location(address)
+        return [{'formatted_address': str(address),
+                 'geometry': {'location': {'lat': lat, 'lng': lng},
+                              'location_type': 'ROOFTOP'}}]
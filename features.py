@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+"""Feature engineering for the analysis layer.
+
+Derived columns (region flags, average durations, price in M$ and
+affordability) are computed with vectorized numpy on the numeric coordinate
+and duration columns, and the resulting feature table is cached on disk keyed
+on the source dataset it came from and its version.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os  # for file stats and cache paths
+import re  # to recognize cache files
+import hashlib  # to build dataset version keys
+import numpy as np
+import pandas as pd
+import metrics  # cache hit and miss counts
+
+# a GPS point near Treasure Island
+EAST_BAY_X1 = -122.389807
+EAST_BAY_Y1 = 37.813489
+# a GPS point just north of San Jose
+EAST_BAY_X2 = -121.986697
+EAST_BAY_Y2 = 37.418685
+
+# default loan assumptions for the affordability columns
+DEFAULT_DOWN_PAYMENT = 0.2  # fraction of the price paid up front
+DEFAULT_YEARLY_INTEREST = 0.045  # yearly interest rate on the loan
+DEFAULT_MONTHS = 360  # length of the loan in months
+
+# columns this module adds to a listing table
+feature_column_names = ['price (M$)',
+                        'average_drive_duration',
+                        'average_drive_duration_with_traffic',
+                        'average_transit_duration',
+                        'east_bay',
+                        'monthly_payment']
+
+
+def calculate_monthly_payment(principal, interest, months):
+    """
+    monthly payment on a fixed rate loan, works on scalars or numpy arrays
+
+    Parameters
+    ----------
+    principal: float or array
+        the initial loan amount
+    interest: float or array
+        the MONTHLY interest, i.e. if the yearly interest is 4% then
+        interest = 0.04/12
+    months: int or array
+        the length of the loan in months
+
+    Returns
+    -------
+    float or array
+        the monthly payment, broadcast over the inputs
+    """
+    principal = np.asarray(principal, dtype=float)
+    interest = np.asarray(interest, dtype=float)
+    growth = (1 + interest) ** months
+    with np.errstate(divide='ignore', invalid='ignore'):
+        payment = principal * (interest * growth) / (growth - 1)
+    # a zero interest loan is just the principal spread over the months
+    payment = np.where(interest == 0, principal / months, payment)
+    if payment.ndim == 0:
+        return float(payment)
+    return payment
+
+
+def east_bay_mask(lat, lng):
+    """
+    vectorized check of which coordinates are in the east bay
+
+    Parameters
+    ----------
+    lat: float or array
+        latitudes to check
+    lng: float or array
+        longitudes to check
+
+    Returns
+    -------
+    boolean array
+        True where the location is in the east bay
+    """
+    lat = np.asarray(lat, dtype=float)
+    lng = np.asarray(lng, dtype=float)
+    val = (lng - EAST_BAY_X1) * (EAST_BAY_Y2 - EAST_BAY_Y1) - \
+          (lat - EAST_BAY_Y1) * (EAST_BAY_X2 - EAST_BAY_X1)
+    # positive values are east bay, negative values are peninsula, and
+    # anything south of San Jose is not in the east bay
+    return (lat >= EAST_BAY_Y2) & (val > 0)
+
+
+def column_values(df, column):
+    """numeric values of a column as a float array, bad entries become nan"""
+    return pd.to_numeric(df[column], errors='coerce').values.astype(float)
+
+
+def add_features(df, down_payment=DEFAULT_DOWN_PAYMENT,
+                 yearly_interest=DEFAULT_YEARLY_INTEREST,
+                 months=DEFAULT_MONTHS):
+    """
+    adds the derived feature columns to df
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        listing table with the zillow_* and *_duration columns
+    down_payment: float
+        fraction of the price paid up front, used for monthly_payment
+    yearly_interest: float
+        yearly interest rate, used for monthly_payment
+    months: integer
+        length of the loan in months, used for monthly_payment
+
+    Returns
+    -------
+    pandas.DataFrame
+        df with the columns in feature_column_names added
+    """
+    price = column_values(df, 'zillow_price')
+    lat = column_values(df, 'zillow_latitude')
+    lng = column_values(df, 'zillow_longitude')
+
+    # price in mega-bucks
+    df['price (M$)'] = price / 1000000.0
+    # average times in minutes
+    df['average_drive_duration'] = \
+        (column_values(df, 'morning_drive_duration') +
+         column_values(df, 'evening_drive_duration')) / 120.0
+    df['average_drive_duration_with_traffic'] = \
+        (column_values(df, 'morning_drive_duration_with_traffic') +
+         column_values(df, 'evening_drive_duration_with_traffic')) / 120.0
+    df['average_transit_duration'] = \
+        (column_values(df, 'morning_transit_duration') +
+         column_values(df, 'evening_transit_duration')) / 120.0
+    # identify east bay locations
+    df['east_bay'] = east_bay_mask(lat, lng)
+    # what the house costs per month with the default loan
+    df['monthly_payment'] = calculate_monthly_payment(
+        price * (1 - down_payment), yearly_interest / 12.0, months)
+    return df
+
+
+def dataset_source(path, key=None):
+    """
+    a short string naming the source dataset, the same for every version of
+    it, so caches of different datasets sharing a directory can be told
+    apart
+
+    Parameters
+    ----------
+    path: string
+        path to the source dataset
+    key: string
+        key within the source file, if any
+
+    Returns
+    -------
+    string
+        hex digest built from the path and key
+    """
+    ident = '{:s}:{:s}'.format(os.path.abspath(path), str(key))
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest()[:8]
+
+
+def dataset_version(path, key=None):
+    """
+    a short string that changes whenever the source dataset changes
+
+    Parameters
+    ----------
+    path: string
+        path to the source dataset
+    key: string
+        key within the source file, if any
+
+    Returns
+    -------
+    string
+        hex digest built from the path, key, size and modification time
+    """
+    stats = os.stat(path)
+    ident = '{:s}:{:s}:{:d}:{:d}'.format(os.path.abspath(path), str(key),
+                                         stats.st_size,
+                                         int(stats.st_mtime * 1e9))
+    return hashlib.sha1(ident.encode('utf-8')).hexdigest()[:16]
+
+
+def load_features(path='./dumped_data/saved_data.hdf5', key='all_zips',
+                  cache_dir=None):
+    """
+    loads the listing table with features added, using a cached copy if the
+    source dataset has not changed since it was built
+
+    Parameters
+    ----------
+    path: string
+        path to the hdf5 file holding the processed listings
+    key: string
+        key of the listings table in the hdf5 file
+    cache_dir: string
+        where to keep the cached feature table, defaults to the directory of
+        the source dataset
+
+    Returns
+    -------
+    pandas.DataFrame
+        the listing table with the columns in feature_column_names
+    """
+    if not cache_dir:  # default (None) is next to the source dataset
+        cache_dir = os.path.dirname(os.path.abspath(path))
+    source = dataset_source(path, key)
+    cache_file = os.path.join(cache_dir, 'features_{:s}_{:s}.hdf5'.format(
+        source, dataset_version(path, key)))
+    if os.path.exists(cache_file):
+        metrics.counter('cache_requests_total', cache='features',
+                        result='hit').inc()
+        return pd.read_hdf(cache_file, key='features')
+    metrics.counter('cache_requests_total', cache='features',
+                    result='miss').inc()
+
+    df = add_features(pd.read_hdf(path, key=key))
+    # only one version of the cache of this dataset is worth keeping around,
+    # the caches of other datasets in cache_dir are theirs
+    old_cache = re.compile('^features_' + source + '_[0-9a-f]{16}\\.hdf5$')
+    for file_str in os.listdir(cache_dir):
+        if old_cache.match(file_str):
+            os.remove(os.path.join(cache_dir, file_str))
+    # write then rename so a crash can't leave a cache that looks whole
+    partial = cache_file + '.part'
+    hdf_file = pd.HDFStore(partial, mode='w')
+    try:
+        hdf_file.put('features', df)
+    finally:
+        hdf_file.close()
+    os.replace(partial, cache_file)
+    return df
+
+
+def commute_by_zipcode(df, columns=None):
+    """
+    median commute in minutes and number of listings for each zipcode, small
+    enough to save as JSON for quick look ups
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        listing table with the columns in feature_column_names
+    columns: list of strings
+        average duration columns to summarize, defaults to all three
+
+    Returns
+    -------
+    dictionary
+        {zipcode string: {'count': integer, column: median minutes}}, columns
+        without a finite value for a zipcode are left out
+    """
+    if columns is None:
+        columns = ['average_drive_duration',
+                   'average_drive_duration_with_traffic',
+                   'average_transit_duration']
+    table = df[['zillow_zipcode'] + columns] \
+        .replace([np.inf, -np.inf], np.nan)
+    table['zillow_zipcode'] = pd.to_numeric(table['zillow_zipcode'],
+                                            errors='coerce')
+    grouped = table.dropna(subset=['zillow_zipcode']).groupby('zillow_zipcode')
+    medians = grouped[columns].median()
+    counts = grouped.size()
+    summary = {}
+    for zipcode, row in medians.iterrows():
+        entry = {'count': int(counts[zipcode])}
+        entry.update((col, float(row[col])) for col in columns
+                     if np.isfinite(row[col]))
+        summary['{:d}'.format(int(zipcode))] = entry
+    return summary
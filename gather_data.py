@@ -15,48 +15,159 @@ __license__ = "GPL"
 __version__ = "0.0"
 __status__ = "Development"
 
-# Set up the imports to run the scrape.
-from selenium import webdriver
-from selenium.webdriver.common.keys import Keys
-from BeautifulSoup import BeautifulSoup
+# Set up the imports to run the scrape.  Selenium is imported when a browser
+# is started so that importing this file doesn't cost anything.
+from bs4 import BeautifulSoup
 import shared_res
 import pandas as pd
 import numpy as np
 import os
 import time # gonna wanna pause to avoid captchas
 import datetime
+import metrics # counters and timers, off unless metrics.enable() is called
+import page_archive # raw pages kept for parsing again offline
+import page_fetcher # http or browser page loading
+import scrape_scheduler # who holds which zipcode in a task table
+
+# Zillow doesn't show more than 20 pages of results for a search.
+MAX_PAGES = 20
+# Python's own HTML parser, so the cards come out the same wherever this
+# runs, whatever other parsers are installed.
+PARSER = 'html.parser'
+ZILLOW_URL = 'https://www.zillow.com'
+
+
+def number_of_pages(count, per_page, max_pages=MAX_PAGES):
+    """
+    pages a search with count results has when a full page shows per_page
+    of them, at most max_pages
+    """
+    if count <= 0 or per_page <= 0:
+        return 1
+    return min(max_pages, -(-count // per_page))
 
 
 # Build the class that handles the website actions like searching for
 # zipcodes and changing pages.
 class zillow_zipcode_search:
-    def __init__(self):
-        # Load the firefox web driver.
-        self.driver         = webdriver.Firefox()
+    # With an archive (page_archive.PageArchive) every page loaded is kept,
+    # and a zipcode whose result count is the same as in a scrape less than
+    # max_age_days old is skipped after its first page.
+    # Pages are loaded by fetcher, see page_fetcher.py, Firefox through
+    # selenium by default, with a random pause of pause seconds between
+    # pages to avoid captchas.  Up to concurrency pages of a zipcode are
+    # loaded at once if the fetcher can be shared between threads.
+    # Searches go to base_url, another server can stand in for Zillow, e.g.
+    # benchmarks/fixtures.serve_pages.
+    def __init__(self, archive=None,
+                 max_age_days=page_archive.DEFAULT_MAX_AGE_DAYS,
+                 fetcher=None, pause=(2, 10), concurrency=1,
+                 base_url=ZILLOW_URL):
+        self.fetcher        = fetcher or page_fetcher.SeleniumFetcher()
+        self.base_url       = base_url
+        self.archive        = archive
+        self.max_age_days   = max_age_days
+        self.pause          = pause
+        self.concurrency    = concurrency
 
     # Move to the next page in the search.
     def next_page(self):
         self.page_number    = self.page_number + 1
         self.page_to_load   = self.first_page + str(self.page_number) + '_p/'
 
+    # Load the page at url with the fetcher.
+    def fetch_page(self, url):
+        with metrics.timer('zillow_page_fetch_seconds'):
+            html = self.fetcher.get(url)
+        metrics.counter('zillow_pages_total').inc()
+        return html
+
     # Get the source for the current page to pass to BeautifulSoup
     # Transfer the page source into BeautifulSoup.
     def get_current_page(self):
-        self.driver.get(self.page_to_load)
-        self.current_page = self.driver.page_source  # extract the source for
-        # BeautifulSoup
+        self.current_page = self.fetch_page(self.page_to_load)
         return (self.current_page)
 
+    # Pause to avoid captchas, then load page number.
+    def fetch_numbered_page(self, number):
+        time.sleep(np.random.uniform(*self.pause))
+        return self.fetch_page(self.first_page + str(number) + '_p/')
+
+    # Load the pages numbered numbers of the current search and make each
+    # the current page in turn.  Fetchers that can be shared between
+    # threads load concurrency pages at a time, each after its own pause;
+    # the pages are still handed out in order.
+    def load_pages(self, numbers):
+        numbers = list(numbers)
+        if self.concurrency > 1 and getattr(self.fetcher, 'thread_safe',
+                                            False):
+            from concurrent.futures import ThreadPoolExecutor
+            with ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+                loaded = pool.map(self.fetch_numbered_page, numbers)
+                for number, html in zip(numbers, loaded):
+                    yield self.set_current_page(number, html)
+        else:
+            for number in numbers:
+                yield self.set_current_page(
+                    number, self.fetch_numbered_page(number))
+
+    def set_current_page(self, number, html):
+        self.page_number    = number
+        self.page_to_load   = self.first_page + str(number) + '_p/'
+        self.current_page   = html
+        return html
+
+    # Walk the pages after the first one by their next links, for a first
+    # page that doesn't say how many results there are.  Returns the number
+    # of pages loaded.
+    def follow_next_pages(self):
+        pages = 0
+        # Zillow wont return more than 20 pages so use a for loop that
+        # automatically stops.  If you make a mistake and it doesn't stop
+        # earlier it won't get stuck in a while.
+        while self.do_next_page == 1 and self.page_number < MAX_PAGES:
+            self.next_page()
+            time.sleep(np.random.uniform(*self.pause))
+            self.get_current_page()
+            pages = pages + 1
+            self.archive_current_page()
+            self.test_current_page()
+            if self.no_results == 1:
+                break
+            self.instance_zillow_scrape.get_houses(self.current_page)
+        return pages
+
+    # Keep the current page in the archive, if there is one.
+    def archive_current_page(self):
+        if self.archive is not None:
+            self.archive.put(self.page_to_load, self.current_page,
+                             zipcode=self.current_zip,
+                             page=self.page_number, run=self.run)
+
+    # True if the archive has a recent scrape of this zipcode with as many
+    # results as the current (first) page reports, so there's nothing new.
+    def current_zipcode_unchanged(self):
+        if self.archive is None:
+            return False
+        count = page_archive.result_count(self.current_page)
+        if not self.archive.is_fresh(self.current_zip, count,
+                                     self.max_age_days):
+            return False
+        print('Still {} results, same as the last scrape, skipping.'
+              .format(count))
+        metrics.counter('zillow_zipcodes_skipped_total').inc()
+        return True
+
     # Run tests on the current page, you're looking for whether the page is a
     #  captcha page or whether there are results on the current page and a
     # few other things.
     def test_current_page(self):
-        soup = BeautifulSoup(self.current_page)
+        soup = BeautifulSoup(self.current_page, PARSER)
 
         # Test to see if there is a next page.  If there isn't make sure the
         # navigator knows that.  If there is no next page then the result
         # will be an empty list.
-        no_next_page = soup.findAll("li", {"class": "zsg-pagination-next"})
+        no_next_page = soup.find_all("li", {"class": "zsg-pagination-next"})
         if not no_next_page:
             self.do_next_page = 0
         # Zillow has been updated so that this class always exists,
@@ -72,7 +183,7 @@ class zillow_zipcode_search:
 
         # # Test to see if zillow says the zipcode is deprecated.  If so,
         # # stop searching.
-        # deprecated_zip = soup.findAll("div", {"class":"deprecated-zipcode"})
+        # deprecated_zip = soup.find_all("div", {"class":"deprecated-zipcode"})
         # if deprecated_zip:
         #     self.no_results = 1
         #     print('Zillow says this zip code is deprecated.')
@@ -81,7 +192,7 @@ class zillow_zipcode_search:
         # tell the iterate to stop trying to change pages.  With the update
         # above which checks for a next button this test is rarely true,
         # but it does rarely come up, so I've left it here.
-        no_results = soup.findAll("h3", {"class": "zsg-content_collapsed"})
+        no_results = soup.find_all("h3", {"class": "zsg-content_collapsed"})
         try:
             if no_results[0].text == 'No matching results...':
                 print("Probably the last page...")
@@ -123,7 +234,7 @@ class zillow_zipcode_search:
         os.remove('temp.csv')
 
     def close_browser(self):
-        self.driver.close()
+        self.fetcher.close()
 
     # This is for testing the inner functioning of the class.  Don't use it
     # in production.
@@ -139,34 +250,63 @@ class zillow_zipcode_search:
         print('Currently scraping zip code: ' + zipcode_in)
         self.page_number = 1
         self.current_zip = zipcode_in
-        self.first_page = "https://www.zillow.com/homes/" + zipcode_in + "_rb/"
+        self.first_page = self.base_url + "/homes/" + zipcode_in + "_rb/"
         self.page_to_load = self.first_page
+        self.run = time.time() # pages of this search share it in the archive
 
         # Create an instance of the scraper
         self.instance_zillow_scrape = zillow_parser()
-
-        # Zillow wont return more than 20 pages so use a for loop that
-        # automatically stops at 30.  If you make a mistake and it doesn't stop
-        #  earlier it won't get stuck in a while.
-        for i in range(30):
-            # Test the current page to catch last pages and captchas
-            self.get_current_page()
-            self.test_current_page()
-            if self.no_results == 1:
-                break
-            # Scrape the current page
+        start_time = time.time()
+
+        # The first page says how many results there are, so the number of
+        # pages to load is known after it.  A zipcode without results or
+        # that didn't change stops here.
+        self.get_current_page()
+        pages = 1
+        if self.current_zipcode_unchanged():
+            return
+        self.archive_current_page()
+        self.test_current_page()
+        count = page_archive.result_count(self.current_page)
+        if self.no_results == 1 or count == 0:
+            print('No results for this zip code.')
+            metrics.counter('zillow_zipcodes_empty_total').inc()
+        else:
             self.instance_zillow_scrape.get_houses(self.current_page)
-            # Pause to avoid captchas
-            time.sleep(np.random.uniform(2, 10))
-            # Goto the next page
-            if self.do_next_page == 1:
-                self.next_page()
+            per_page = len(self.instance_zillow_scrape.photo_cards)
+            if count is None or per_page == 0:
+                # No result count on the page, or no listings parsed from it
+                # to tell how many a page holds, follow the next links.
+                if count is not None:
+                    print('{} results but no listings on the first page.'
+                          .format(count))
+                    metrics.counter('zillow_empty_first_pages_total').inc()
+                pages = pages + self.follow_next_pages()
             else:
-                break
+                numbers = range(2, number_of_pages(count, per_page) + 1)
+                for html in self.load_pages(numbers):
+                    pages = pages + 1
+                    self.archive_current_page()
+                    self.instance_zillow_scrape.get_houses(html)
+            if count and \
+                    len(self.instance_zillow_scrape.zillow_data_master) == 0:
+                # Nothing to write, most likely the markup changed.  Fail
+                # so the zipcode isn't taken as done.
+                raise ValueError('Zillow reports {} results for {} but no '
+                                 'listings were parsed'.format(
+                                     count, zipcode_in))
+
+        # Pages per second includes the pauses, that's the real pace.
+        metrics.gauge('zillow_pages_per_second').set(
+            pages / (time.time() - start_time))
 
         # Dump the scraped data
-        self.dump_zipcode_dataframe(
-            self.instance_zillow_scrape.zillow_data_master)
+        with metrics.timer('zillow_dump_seconds'):
+            self.dump_zipcode_dataframe(
+                self.instance_zillow_scrape.zillow_data_master)
+        # Only now is the run good enough to skip the zipcode next time.
+        if self.archive is not None:
+            self.archive.complete_run(self.current_zip, self.run)
 
         # Close the web driver
         # self.close_browser()
@@ -186,11 +326,17 @@ class zillow_parser:
     # browser.  It returns an iterable list of what zillow calls "cards" that
     #  contain all the information you wish to extract like location and
     # price.  When done, the data is appended to the master dataframe.
-    def get_houses(self, current_page):
-        soup = BeautifulSoup(current_page)
-        self.photo_cards = soup.findAll("article",
-                                   {"class": "zsg-photo-card photo-card "
-                                             "zsg-aspect-ratio type-not-favorite"})
+    # date_scraped is when the page was loaded, now if it isn't given.
+    def get_houses(self, current_page, date_scraped=None):
+        self.date_scraped = date_scraped
+        with metrics.timer('zillow_parse_seconds'):
+            soup = BeautifulSoup(current_page, PARSER)
+            self.photo_cards = soup.find_all("article",
+                                       {"class": "zsg-photo-card photo-card "
+                                                 "zsg-aspect-ratio type-not-favorite"})
+        metrics.histogram('zillow_cards_per_page',
+                          buckets=(0, 5, 10, 15, 20, 25, 30, 40)).observe(
+                              len(self.photo_cards))
         # Build the pandas data frame to hold the extracted data
         self.zillow_data = pd.DataFrame(
             index = range(len(self.photo_cards)),
@@ -201,19 +347,19 @@ class zillow_parser:
     # Grab longitude and latitude
     def get_location(self, card_entry):
         # Grab longitude and latitude
-        temp = card_entry.findAll("meta", {"itemprop": "latitude"})
+        temp = card_entry.find_all("meta", {"itemprop": "latitude"})
         # print("Latitude : " + temp[0]['content'])
         lat = temp[0]['content']
-        temp = card_entry.findAll("meta", {"itemprop": "longitude"})
+        temp = card_entry.find_all("meta", {"itemprop": "longitude"})
         # print("Longitude : " + temp[0]['content'])
         longi = temp[0]['content']
         return(lat, longi)
 
     # Grab the price and the address, which are contained in the card caption
     def get_card_caption(self, card_entry):
-        card_caption = card_entry.findAll("div", {"class"
+        card_caption = card_entry.find_all("div", {"class"
                                                       : "zsg-photo-card-caption"})
-        price = card_entry.findAll("span",
+        price = card_entry.find_all("span",
                                         {"class": "zsg-photo-card-price"})
         # If the listing doesn't have a price then "price" will be empty.
         # Set up a try to avoid this case.
@@ -223,7 +369,7 @@ class zillow_parser:
         except IndexError:
             price = 0
 
-        address = card_entry.findAll("span", {"class" :
+        address = card_entry.find_all("span", {"class" :
                                                   "zsg-photo-card-address"})
         address = address[0].text
         return(price, address)
@@ -232,13 +378,13 @@ class zillow_parser:
     # card caption
     def get_address(self, card_entry):
         # Grab longitude and latitude
-        temp = card_entry.findAll("span", {"itemprop": "streetAddress"})
+        temp = card_entry.find_all("span", {"itemprop": "streetAddress"})
         addressStreet = temp[0].text
-        temp = card_entry.findAll("span", {"itemprop": "addressLocality"})
+        temp = card_entry.find_all("span", {"itemprop": "addressLocality"})
         addressCity = temp[0].text
-        temp = card_entry.findAll("span", {"itemprop": "addressRegion"})
+        temp = card_entry.find_all("span", {"itemprop": "addressRegion"})
         addressState = temp[0].text
-        temp = card_entry.findAll("span", {"itemprop": "postalCode"})
+        temp = card_entry.find_all("span", {"itemprop": "postalCode"})
         zipcode = temp[0].text
 
         return(zipcode, addressStreet, addressCity, addressState)
@@ -248,7 +394,8 @@ class zillow_parser:
     #  to redo this whole class with one function call.
     def get_home_type(self, card_entry):
         homeType = "0"
-        temp = card_entry.findAll("div", {"class": "minibubble template hide"})
+        temp = card_entry.find_all("div",
+                                   {"class": "minibubble template hide"})
         # Convert the output to a string that can be split.
         temp = str(temp[0]).split(',')
         # The location of the hometype entry changes sometimes, so you have
@@ -274,38 +421,161 @@ class zillow_parser:
             # Drop the information into the dataframe.  I want to keep all
             # the pushing of data into the dataframe in one location to make
             # updates easier.
-            self.zillow_data['zillow_id'][m] = k.get('data-zpid')
-            self.zillow_data['zillow_status'][m] = k.get('data-pgapt')
-            self.zillow_data['zillow_latitude'][m] = lat
-            self.zillow_data['zillow_longitude'][m] = longi
-            self.zillow_data['zillow_price'][m] = price
-            self.zillow_data['zillow_addressStreet'][m] = address
-            self.zillow_data['zillow_zipcode'][m] = zipcode
-            self.zillow_data['zillow_addressStreet'][m] = addressStreet
-            self.zillow_data['zillow_addressCity'][m] = addressCity
-            self.zillow_data['zillow_addressState'][m] = addressState
-            self.zillow_data['zillow_homeType'][m] = homeType
-            self.zillow_data['date_scraped'][m] = datetime.datetime.now().isoformat()
+            self.zillow_data.at[m, 'zillow_id'] = k.get('data-zpid')
+            self.zillow_data.at[m, 'zillow_status'] = k.get('data-pgapt')
+            self.zillow_data.at[m, 'zillow_latitude'] = lat
+            self.zillow_data.at[m, 'zillow_longitude'] = longi
+            self.zillow_data.at[m, 'zillow_price'] = price
+            self.zillow_data.at[m, 'zillow_addressStreet'] = address
+            self.zillow_data.at[m, 'zillow_zipcode'] = zipcode
+            self.zillow_data.at[m, 'zillow_addressStreet'] = addressStreet
+            self.zillow_data.at[m, 'zillow_addressCity'] = addressCity
+            self.zillow_data.at[m, 'zillow_addressState'] = addressState
+            self.zillow_data.at[m, 'zillow_homeType'] = homeType
+            self.zillow_data.at[m, 'date_scraped'] = self.date_scraped or \
+                datetime.datetime.now().isoformat()
             # Update the iterator
             m = m + 1
 
         # Write the data to the master dataframe.
-        self.zillow_data_master = self.zillow_data_master.append(
-                self.zillow_data, ignore_index=True)
-
-# SBuild the instances needed to perform a zipcode search
-some_zillow_zipcode_search = zillow_zipcode_search()
+        self.zillow_data_master = pd.concat(
+                [self.zillow_data_master, self.zillow_data], ignore_index=True)
+
+def _reparse_zipcode(task):
+    """parses the pages of the last archived scrape of one zipcode"""
+    directory, zipcode = task
+    archive = page_archive.PageArchive(directory)
+    parser = zillow_parser()
+    try:
+        for page, fetched, html in archive.run_pages(zipcode):
+            parser.get_houses(html, datetime.datetime.fromtimestamp(
+                fetched).isoformat())
+    finally:
+        archive.close()
+    return zipcode, parser.zillow_data_master
+
+
+def reparse_archive(directory, output_dir, zipcodes=None, processes=1):
+    """
+    runs zillow_parser again over the archived pages of the last scrape of
+    each zipcode and writes one CSV per zipcode, like
+    dump_zipcode_dataframe, without a browser or any pauses
+
+    Parameters
+    ----------
+    directory: string
+        the page_archive.PageArchive directory
+    output_dir: string
+        where the zipcode CSV files are written, files already there are
+        replaced
+    zipcodes: list of strings
+        the zipcodes to parse, every archived one if None
+    processes: integer
+        zipcodes parsed at once
+
+    Returns
+    -------
+    dictionary
+        number of listings found in each zipcode
+    """
+    if zipcodes is None:
+        archive = page_archive.PageArchive(directory)
+        zipcodes = archive.zipcodes()
+        archive.close()
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    tasks = [(directory, zipcode) for zipcode in zipcodes]
+    if processes > 1:
+        from multiprocessing import Pool
+        pool = Pool(processes)
+        results = pool.imap_unordered(_reparse_zipcode, tasks)
+    else:
+        pool = None
+        results = map(_reparse_zipcode, tasks)
+    counts = {}
+    try:
+        for zipcode, listings in results:
+            listings.drop_duplicates(subset='zillow_id', keep='first') \
+                .to_csv(os.path.join(output_dir, zipcode + '.csv'),
+                        index=False)
+            counts[zipcode] = len(listings)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return counts
 
-# # Search a single zipcode
-# some_zillow_zipcode_search.search_zipcode('94103')
-# some_zillow_zipcode_search.close_browser()
 
 # Run a search through all the zipcodes in a county.
-P = shared_res.san_francisco_county_zip
-jj = len(P)
-ii = 1
-for H in P:
-    print "Searching %i of %i" % (ii, jj)
-    some_zillow_zipcode_search.search_zipcode(H)
-    ii = ii + 1
-some_zillow_zipcode_search.close_browser()
+def scrape_county(zipcodes, archive=None, fetcher=None, concurrency=1):
+    """
+    scrapes every zipcode in zipcodes with one browser, e.g.
+    scrape_county(shared_res.san_francisco_county_zip), keeping the pages
+    in archive (a page_archive.PageArchive) if given; fetcher loads the
+    pages, see page_fetcher.py, up to concurrency at a time
+    """
+    # Build the instances needed to perform a zipcode search
+    some_zillow_zipcode_search = zillow_zipcode_search(
+        archive=archive, fetcher=fetcher, concurrency=concurrency)
+    jj = len(zipcodes)
+    ii = 1
+    for H in zipcodes:
+        print("Searching %i of %i" % (ii, jj))
+        some_zillow_zipcode_search.search_zipcode(H)
+        ii = ii + 1
+    some_zillow_zipcode_search.close_browser()
+
+
+# Work through the zipcodes of a task table until none are due.
+def scrape_scheduled(tasks, worker=None, shard=None, archive=None,
+                     fetcher=None, concurrency=1, pause=(2, 10),
+                     base_url=ZILLOW_URL):
+    """
+    scrapes the zipcodes tasks (a scrape_scheduler.ScrapeScheduler) hands
+    out, one at a time, until none are due; a zipcode that fails is marked
+    so and the next one is claimed.  Returns the number scraped.
+
+    worker names this process in the table and shard = (index, count)
+    splits the zipcodes between workers, see ScrapeScheduler.claim; pause
+    and base_url are those of zillow_zipcode_search and the other arguments
+    those of scrape_county.
+    """
+    worker = worker or scrape_scheduler.default_worker()
+    some_zillow_zipcode_search = zillow_zipcode_search(
+        archive=archive, fetcher=fetcher, concurrency=concurrency,
+        pause=pause, base_url=base_url)
+    done = 0
+    try:
+        while True:
+            zipcode = tasks.claim(worker, shard)
+            if zipcode is None:
+                break
+            print("Searching {:s}, {:d} of {:d} done".format(
+                zipcode, tasks.counts()['done'], len(tasks)))
+            # An interrupt leaves the zipcode running, it is claimed again
+            # once its lease ends.
+            try:
+                some_zillow_zipcode_search.search_zipcode(zipcode)
+            except Exception as error:
+                print('Scraping {:s} failed: {!r}'.format(zipcode, error))
+                tasks.fail(zipcode, repr(error), worker)
+            else:
+                # A lease that ran out may have gone to another worker, the
+                # zipcode is then theirs to finish.
+                if tasks.complete(zipcode, worker):
+                    done = done + 1
+    finally:
+        some_zillow_zipcode_search.close_browser()
+    return done
+
+
+if __name__ == '__main__':
+    # # Search a single zipcode
+    # some_zillow_zipcode_search = zillow_zipcode_search()
+    # some_zillow_zipcode_search.search_zipcode('94103')
+    # some_zillow_zipcode_search.close_browser()
+    # The zipcodes go into a task table so an interrupted scrape carries on
+    # where it stopped when this is run again.
+    tasks = scrape_scheduler.ScrapeScheduler('./dumped_data/tasks.sqlite')
+    tasks.add_counties(['san_francisco'])
+    scrape_scheduled(tasks)
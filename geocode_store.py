@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+Local store of address coordinates.
+
+Addresses are normalized so that '1543 Oriole Avenue, Sunnyvale' and
+'1543 ORIOLE AVE SUNNYVALE' share one entry, and results are kept in a
+SQLite file so nothing is geocoded twice.  Coordinates scraped from Zillow
+are loaded first; only addresses without them are sent to Google, in a rate
+limited batch job:
+
+```
+import geocode_store, google_api
+store = geocode_store.GeocodeStore('./dumped_data/geocodes.sqlite')
+t = google_api.ATTGoogleAPI(geocode_store=store)
+t.load_files(); t.process_data()
+store.add_from_frame(t.df)
+store.bulk_geocode(t.gmaps, t.full_addresses(), calls_per_second=10)
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import re  # for address normalization
+import time  # for rate limiting and time stamps
+import sqlite3  # the store itself
+import numpy as np
+import pandas as pd
+import metrics  # cache hits and geocode calls
+import resilience  # retries for the batch geocoder
+
+# USPS street suffix and direction abbreviations
+ABBREVIATIONS = {'STREET': 'ST', 'AVENUE': 'AVE', 'ROAD': 'RD',
+                 'DRIVE': 'DR', 'BOULEVARD': 'BLVD', 'LANE': 'LN',
+                 'COURT': 'CT', 'PLACE': 'PL', 'TERRACE': 'TER',
+                 'CIRCLE': 'CIR', 'HIGHWAY': 'HWY', 'PARKWAY': 'PKWY',
+                 'EXPRESSWAY': 'EXPY', 'SQUARE': 'SQ', 'WAY': 'WAY',
+                 'NORTH': 'N', 'SOUTH': 'S', 'EAST': 'E', 'WEST': 'W',
+                 'APARTMENT': 'UNIT', 'APT': 'UNIT', 'SUITE': 'UNIT',
+                 'STE': 'UNIT', '#': 'UNIT', 'CALIFORNIA': 'CA'}
+_PUNCTUATION = re.compile(r'[^A-Z0-9# ]+')
+_SPACES = re.compile(r'\s+')
+
+
+def normalize_address(address):
+    """
+    upper case, no punctuation, single spaces and abbreviated suffixes, e.g.
+    '1543 Oriole Avenue, Sunnyvale, CA 94087' -> '1543 ORIOLE AVE SUNNYVALE
+    CA 94087'
+    """
+    text = _PUNCTUATION.sub(' ', str(address).upper().replace('#', ' # '))
+    words = [ABBREVIATIONS.get(word, word)
+             for word in _SPACES.split(text.strip())]
+    return ' '.join(words)
+
+
+def full_address(street, city, state, zipcode):
+    """the address string get_times sends to Google, built from the
+    zillow_* columns (arrays or pandas Series)"""
+    return pd.Series(street).astype(str).values + ', ' + \
+        pd.Series(city).astype(str).values + ', ' + \
+        pd.Series(state).astype(str).values + ' ' + \
+        pd.Series(zipcode).astype(str).values
+
+
+class GeocodeStore:
+    """
+    Persistent normalized address -> (lat, lng) map in SQLite.
+
+    Every entry records where it came from: 'zillow' for scraped coordinates,
+    'google' for geocoded ones and 'failed' for addresses Google couldn't
+    find, so they aren't tried again unless asked.
+
+    Parameters
+    ----------
+    path: string
+        the SQLite file, ':memory:' for a throw away store
+    """
+    def __init__(self, path='./dumped_data/geocodes.sqlite'):
+        self.path = path
+        # the batch geocoder may be used from worker threads
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS geocodes ('
+                        'address TEXT PRIMARY KEY, lat REAL, lng REAL, '
+                        'source TEXT, formatted TEXT, updated REAL)')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM geocodes').fetchone()[0]
+
+    def put(self, address, lat, lng, source='google', formatted=None):
+        """stores the coordinates of one address, replacing older ones"""
+        self.put_many([address], [lat], [lng], source, [formatted])
+
+    def put_many(self, addresses, lats, lngs, source='google',
+                 formatted=None):
+        """stores the coordinates of many addresses in one transaction"""
+        if formatted is None:
+            formatted = [None] * len(addresses)
+        now = time.time()
+        rows = [(normalize_address(a), _float_or_none(lat),
+                 _float_or_none(lng), source, f, now)
+                for a, lat, lng, f in zip(addresses, lats, lngs, formatted)]
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO geocodes '
+                                'VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def get(self, address, with_status=False):
+        """(lat, lng) of address, or None if it isn't known or failed; see
+        get_many for with_status"""
+        return self.get_many([address], with_status=with_status)[0]
+
+    def get_many(self, addresses, chunk_size=500, normalized=False,
+                 with_status=False):
+        """
+        coordinates of each address, None for unknown or failed ones
+
+        Parameters
+        ----------
+        addresses: list of strings
+            addresses in any format
+        chunk_size: integer
+            addresses looked up per query
+        normalized: boolean
+            the addresses are normalize_address keys already, e.g. the
+            normalized_address column interning.intern_listings builds
+        with_status: boolean
+            tell failed addresses from unknown ones, see Returns
+
+        Returns
+        -------
+        list
+            (lat, lng) or None for each address; with_status
+            (lat, lng, source) for every known address, (None, None,
+            'failed') for the ones Google couldn't find, and None for the
+            unknown ones
+        """
+        if normalized:
+            keys = list(addresses)
+        else:
+            keys = [normalize_address(a) for a in addresses]
+        found = {}
+        unique = list(set(keys))
+        for start in range(0, len(unique), chunk_size):
+            chunk = unique[start:start + chunk_size]
+            query = 'SELECT address, lat, lng, source FROM geocodes WHERE ' \
+                    '{:s}address IN ({:s})'.format(
+                        '' if with_status else 'lat IS NOT NULL AND ',
+                        ','.join('?' * len(chunk)))
+            for key, lat, lng, source in self.db.execute(query, chunk):
+                found[key] = (lat, lng, source) if with_status else \
+                    (lat, lng)
+        metrics.counter('cache_requests_total', cache='geocode',
+                        result='hit').inc(sum(k in found for k in keys))
+        metrics.counter('cache_requests_total', cache='geocode',
+                        result='miss').inc(sum(k not in found for k in keys))
+        return [found.get(key) for key in keys]
+
+    def missing(self, addresses, retry_failed=False):
+        """
+        the unique addresses that have no entry yet (or only a failed one
+        if retry_failed), in their original format
+        """
+        known = set(row[0] for row in self.db.execute(
+            'SELECT address FROM geocodes' +
+            (" WHERE source != 'failed'" if retry_failed else '')))
+        todo = {}
+        for address in addresses:
+            key = normalize_address(address)
+            if key not in known and key not in todo:
+                todo[key] = address
+        return list(todo.values())
+
+    def add_from_frame(self, df):
+        """
+        stores the scraped zillow_latitude and zillow_longitude of every
+        listing under its full address, returns the number stored
+        """
+        lat = pd.to_numeric(df['zillow_latitude'], errors='coerce').values
+        lng = pd.to_numeric(df['zillow_longitude'], errors='coerce').values
+        good = np.isfinite(lat) & np.isfinite(lng)
+        addresses = full_address(df['zillow_addressStreet'],
+                                 df['zillow_addressCity'],
+                                 df['zillow_addressState'],
+                                 df['zillow_zipcode'])[good]
+        self.put_many(list(addresses), lat[good], lng[good], source='zillow')
+        return int(good.sum())
+
+    def bulk_geocode(self, client, addresses, calls_per_second=10.0,
+                     retry_failed=False, caller=None, batch_size=100):
+        """
+        geocodes the addresses that aren't in the store yet with Google
+
+        Calls are spaced to stay under calls_per_second and go through a
+        resilience.ResilientCaller, so quota errors slow the job down rather
+        than stopping it.  Results are committed every batch_size addresses,
+        so an interrupted job keeps what it found.
+
+        Parameters
+        ----------
+        client: googlemaps.Client-like
+            anything with a geocode(address=...) method
+        addresses: list of strings
+            addresses to make sure are in the store
+        calls_per_second: float
+            most calls to make per second
+        retry_failed: boolean
+            also try addresses that failed before
+        caller: resilience.ResilientCaller
+            retry settings, the default is used if None
+        batch_size: integer
+            addresses per commit
+
+        Returns
+        -------
+        dictionary
+            number of addresses 'found' and 'failed'
+        """
+        caller = caller or resilience.ResilientCaller()
+        todo = self.missing(addresses, retry_failed)
+        print('Geocoding {:d} addresses.'.format(len(todo)))
+        counts = {'found': 0, 'failed': 0}
+        interval = 1.0 / calls_per_second
+        next_call = time.time()
+        batch = []
+        for address in todo:
+            pause = next_call - time.time()
+            if pause > 0:
+                time.sleep(pause)
+            next_call = max(next_call, time.time()) + interval
+            metrics.add_cost('geocode')
+            try:
+                results = caller.call(client.geocode, address=address)
+            except resilience.GaveUp:
+                print('Giving up geocoding, quota exhausted.')
+                break
+            except Exception as error:
+                if resilience.classify(error) != 'not_found':
+                    raise
+                results = []
+            if results:
+                location = results[0]['geometry']['location']
+                batch.append((address, location['lat'], location['lng'],
+                              'google', results[0].get('formatted_address')))
+                counts['found'] += 1
+            else:
+                batch.append((address, None, None, 'failed', None))
+                counts['failed'] += 1
+            if len(batch) >= batch_size:
+                self._put_batch(batch)
+                batch = []
+        self._put_batch(batch)
+        return counts
+
+    def _put_batch(self, batch):
+        for source in ('google', 'failed'):
+            rows = [row for row in batch if row[3] == source]
+            if rows:
+                self.put_many([r[0] for r in rows], [r[1] for r in rows],
+                              [r[2] for r in rows], source,
+                              [r[4] for r in rows])
+
+
+def _float_or_none(value):
+    """value as a float, None for missing values"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if np.isfinite(value) else None
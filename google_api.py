@@ -12,24 +12,123 @@ import os  # to allow directory changes, etc
 import csv  # to allow loading the CSV file
 import time  # to allow sleeps while geocoding
 from collections import defaultdict  # easier dictionary to work with
-import googlemaps  # the google maps API
+from collections import deque  # calls waiting to be stored
 import pandas as pd  # to allow loading of a dataframe
 import numpy as np # use numpy
 import json  # to allow loading the API
 import shared_res # things common to all project parts
 import datetime # for checking processing success
+import metrics # counters and timers, off unless metrics.enable() is called
+import resilience # retries, backoff and quota handling for API calls
+import geocode_store # local cache of address coordinates
+import departure_schedule # weekly departure slots resolved to future times
+import re # to tell coordinates from addresses
+import sys # to intern repeated strings
+import interning # dictionary encoded columns and precomputed addresses
+
+# a 'lat,lng' location string
+COORDINATES = re.compile(r'^\s*-?[0-9.]+\s*,\s*-?[0-9.]+\s*$')
+
+# the calls planned by ATTGoogleAPI.plan_calls, leg and mode index these
+CALL_LEGS = ('morning','evening')
+CALL_MODES = ('driving','transit')
+CALL_DTYPE = np.dtype([('row',np.int32),('leg',np.int8),('mode',np.int8)])
+# googlemaps is imported where it is used so importing this file is cheap
+
+try:  # python 3 has no separate unicode type
+    unicode
+except NameError:
+    unicode = str
 
 # if you have pandas 23.4 or newer, you can ignore np.inf as well as np.nan
 if float('.'.join(pd.__version__.split('.')[1:])) >= 23.4 :
     pd.options.mode.use_inf_as_na = True
 
+def parse_prices(prices):
+    """
+    vectorized ATTGoogleAPI.price_filter: 700K -> 700000, 1.2M -> 1200000
+    and 2000000+ -> 2000000
+
+    Parameters
+    ----------
+    prices: pandas Series of strings
+        zillow_price as scraped
+
+    Returns
+    -------
+    numpy array of floats
+        prices in dollars, np.nan where the string isn't a price
+    """
+    text = prices.astype(str).str.strip()
+    suffix = text.str[-1]
+    values = pd.to_numeric(text.str.rstrip('KM+'),errors='coerce').values
+    scale = np.where(suffix == 'K',1000.0,
+                     np.where(suffix == 'M',1000000.0,1.0))
+    return np.round(values * scale)
+
+
+def transform_listings(df):
+    """
+    the process_data transform of a table of scraped listings, without
+    touching anything else, so it works on one batch of listings at a time
+    (see chunked.py) as well as on the whole table
+
+    Parameters
+    ----------
+    df: pandas DataFrame
+        listings as loaded from the scraped CSV files
+
+    Returns
+    -------
+    pandas DataFrame
+        the listings process_data keeps, transformed
+    """
+    # do some filtering of entries we don't want to see
+    filter1 = df['zillow_status'].isin(['ForSale','RecentlySold']) # only want sales for now
+    # it appears that all recently sold have a price of '0'
+    filter2 = ~df['zillow_price'].isin(['0']) # all prices that are NOT zero
+
+    # zillow_prices is all screwy with various numbering formats, fix this
+    prices = parse_prices(df['zillow_price'])
+
+    # make sure the address strings are valid
+    def wrap_str(x):
+        return isinstance(x,(str,unicode))
+    mask1 = df['zillow_addressStreet'].map(wrap_str)
+    mask2 = df['zillow_addressCity'].map(wrap_str)
+    mask3 = df['zillow_addressState'].map(wrap_str)
+
+    # keep only the desired data, in one copy that the columns below can
+    # be written to
+    keep = (filter1 & filter2 & mask1 & mask2 & mask3).values & \
+        np.isfinite(prices)
+    df = df[keep].copy()
+    df['zillow_price'] = prices[keep].astype(np.int64)
+
+    # turn the zillow_id into an integer
+    df['zillow_id'] = df['zillow_id'].astype(int)
+
+    # turn the zipcode into an integer
+    df['zillow_zipcode'] = df['zillow_zipcode'].astype(int)
+
+    # turn the date scraped in to a datetime
+    df['date_scraped'] = pd.to_datetime(df['date_scraped'])
+
+    # for all the coords, make a string for the google API
+    df['location'] = df['zillow_latitude'].astype(str) + ',' + \
+                     df['zillow_longitude'].astype(str)
+    return df
+
+
 class ATTGoogleAPI:
     """
     Class for simplified access to the Google API.
     Class assumes you depart at 8:00 AM for work and
-    depart at 5:30 PM for home both on Feb 26, 2019.
+    depart at 5:30 PM for home, on the next Tuesday, see
+    departure_schedule.DepartureSchedule.
     Google API requires a time given as an integer number of seconds from
-    January 1, 1970 UTC.
+    January 1, 1970 UTC, in the future.  The schedule works out the next
+    such time when each call is made.
 
     If you have Pandas 23.4 or newer, dataframe functions (like .mean()) will
     ignore np.inf as well as np.nan.  np.inf is used to signify a travel time
@@ -50,24 +149,52 @@ class ATTGoogleAPI:
     morning_time: integer
         the time when the route leaves the location for SLAC in the morning
         used when departure_time is 'morning', must be in the future
+        if None (the default) the next morning slot of schedule is used
 
     evening_time: integer
         the time when the route leaves SLAC for location in the evening
         used when departure_time is 'evening', must be in the future
+        if None (the default) the next evening slot of schedule is used
 
     dataframe: pandas.DataFrame
         used to specify your own data frame
         You probably shouldn't use this parameter.
 
+    client: googlemaps.Client-like
+        used instead of building a googlemaps.Client from credentials.json,
+        e.g. fake_gmaps.FakeClient for running offline
+
+    caller: resilience.ResilientCaller
+        retry, backoff and concurrency settings for the API calls
+
+    geocode_store: geocode_store.GeocodeStore
+        local cache of address coordinates used by address_to_coords and by
+        get_times for listings without scraped coordinates
+
+    pooled: boolean
+        talk to Google through async_gmaps.SyncClient, which keeps its
+        connections open between calls, instead of googlemaps.Client
+
+    schedule: departure_schedule.DepartureSchedule
+        the weekly morning and evening departure slots, Tuesday 8:00 and
+        17:30 in California by default
+
+    route_cache: route_cache.RouteCache
+        local store of directions results keyed on the departure slot,
+        checked by get_travel_time before calling Google
+
     Attributes
     ----------
     morning_time: integer
-        the time when the route leaves the location for SLAC in the morning
-        used when departure_time is 'morning', must be in the future
+        fixed time when the route leaves the location for SLAC in the
+        morning, None to follow schedule
 
     evening_time: integer
-        the time when the route leaves SLAC for location in the evening
-        used when departure_time is 'evening', must be in the future
+        fixed time when the route leaves SLAC for location in the evening,
+        None to follow schedule
+
+    schedule: departure_schedule.DepartureSchedule
+        the departure slots, see departure_time
 
     SLAC_address: string
         SLAC's address in human-form
@@ -95,11 +222,19 @@ class ATTGoogleAPI:
         a pandas DataFrame where all the data work is done
 
     """
-    def __init__(self,morning_time=1551196800,
-                      evening_time=1551234600,
-                      dataframe=None):
-        self.morning_time = morning_time        # depart for work at this time (8:00 AM PST)
-        self.evening_time = evening_time        # depart for home at this time (5:30 PM PST)
+    def __init__(self,morning_time=None,
+                      evening_time=None,
+                      dataframe=None,
+                      client=None,
+                      caller=None,
+                      geocode_store=None,
+                      pooled=False,
+                      schedule=None,
+                      route_cache=None):
+        self.morning_time = morning_time        # depart for work at this time, None follows the schedule
+        self.evening_time = evening_time        # depart for home at this time, None follows the schedule
+        self.schedule = schedule or departure_schedule.DepartureSchedule()
+        self.routes = route_cache
         self.SLAC_address = '2575 Sand Hill Rd, Menlo Park, CA 94025'
         self.SLAC_location = '37.4200115,-122.203196'
         self.default_address = '1543 Oriole Ave, Sunnyvale, CA 94087' # default
@@ -107,9 +242,19 @@ class ATTGoogleAPI:
         self.column_names = shared_res.pandas_column_names
         self.dtypes = shared_res.pandas_dtypes
         self.df = self.open_dataframe(dataframe)
+        self.caller = caller or resilience.ResilientCaller()
+        self.geocodes = geocode_store
 
+        if client is not None:
+            self.gmaps = client
+            return
         with open("credentials.json", "r") as keyfile: # assumes a local credentials file
             temp_key = json.load(keyfile)
+        if pooled: # one keep-alive connection pool shared by all workers
+            import async_gmaps
+            self.gmaps = async_gmaps.SyncClient(key=temp_key["gmap_key"])
+            return
+        import googlemaps  # the google maps API
         self.gmaps = googlemaps.Client(key=temp_key["gmap_key"])  # API access to google maps
 
 
@@ -172,14 +317,89 @@ class ATTGoogleAPI:
         Returns
         -------
         unnamed string that the Google API can interpret of the type '1.0,-2.0'
+        None if Google can't find the address, now or in an earlier look up
+        kept in the local store
         """
-        info_dict = self.gmaps.geocode(address=address)
+        if self.geocodes is not None: # look in the local store first
+            entry = self.geocodes.get(address,with_status=True)
+            if entry is not None:
+                if entry[2] == 'failed': # not worth paying for again
+                    return None
+                return {'lat': entry[0], 'lng': entry[1]}
+        metrics.add_cost('geocode')
+        with metrics.timer('api_latency_seconds',mode='geocode',leg='none'):
+            info_dict = self.gmaps.geocode(address=address)
         if len(info_dict) > 0:
-            return info_dict[0]['geometry']['location']
+            location = info_dict[0]['geometry']['location']
+            if self.geocodes is not None:
+                self.geocodes.put(address,location['lat'],location['lng'],
+                                  formatted=info_dict[0].get(
+                                      'formatted_address'))
+            return location
         else:
+            if self.geocodes is not None:
+                self.geocodes.put(address,None,None,source='failed')
             return None
 
 
+    def full_addresses(self,rows=None):
+        """
+        the address of every row of self.df, or of the rows at the positions
+        given, as sent to Google, e.g. '1543 Oriole Ave, Sunnyvale, CA 94087'
+        """
+        df = self.df if rows is None else self.df.iloc[rows]
+        if 'full_address' in df: # built once by process_data
+            return df['full_address'].astype(object).values
+        return geocode_store.full_address(df['zillow_addressStreet'],
+                                          df['zillow_addressCity'],
+                                          df['zillow_addressState'],
+                                          df['zillow_zipcode'])
+
+
+    def route_locations(self,rows,addresses):
+        """
+        what to send Google as the listing end of each route: the scraped
+        coordinates if the row has them, else coordinates from
+        self.geocodes, else the address itself
+
+        Routing on coordinates saves Google from geocoding the address on
+        every directions call, and from failing on addresses it doesn't
+        know yet.
+
+        Parameters
+        ----------
+        rows: array of integers
+            position in self.df of each listing
+
+        addresses: list of strings
+            full address of each listing
+
+        Returns
+        -------
+        list of strings
+            'lat,lng' or an address for each listing
+        """
+        lat = pd.to_numeric(self.df['zillow_latitude'].iloc[rows],
+                            errors='coerce').values
+        lng = pd.to_numeric(self.df['zillow_longitude'].iloc[rows],
+                            errors='coerce').values
+        good = np.isfinite(lat) & np.isfinite(lng)
+        locations = [self.convert_coords(a,b) if ok else address
+                     for a,b,ok,address in zip(lat,lng,good,addresses)]
+        if self.geocodes is not None and not good.all():
+            todo = np.flatnonzero(~good)
+            if 'normalized_address' in self.df: # keys built once
+                keys = self.df['normalized_address'].iloc[rows].values
+                coords = self.geocodes.get_many([keys[i] for i in todo],
+                                                normalized=True)
+            else:
+                coords = self.geocodes.get_many([addresses[i] for i in todo])
+            for i,found in zip(todo,coords):
+                if found is not None:
+                    locations[i] = self.convert_coords(*found)
+        return locations
+
+
     def convert_coords(self,lat=None,lng=None):
         """
         convert coordinates to a string accepted by the gmaps API:
@@ -217,22 +437,27 @@ class ATTGoogleAPI:
 
 
     def price_filter(self,price_str):
-        """fixes formatting issues with prices, makes the strings ints"""
-        if price_str[-1] is 'K':
+        """fixes formatting issues with prices, makes the strings ints
+        for whole columns use parse_prices instead"""
+        if price_str[-1] == 'K':
             return int(price_str[:-1] + '000')
-        elif price_str[-1] is '+':
+        elif price_str[-1] == '+':
             return int(price_str[:-1])
-        elif price_str[-1] is 'M':
+        elif price_str[-1] == 'M':
             return int(float(price_str[:-1]) * 1000000)
         else:
             return int(price_str)
 
 
-    def get_travel_time(self,location=None,departure_time='morning',mode='driving'):
+    def get_travel_time(self,location=None,departure_time='morning',mode='driving',
+                        leg='morning'):
         """
         get directions from location (GPS coordinates) to/from SLAC for driving
-        departure_time can be 'morning', 'evening' to use the defaults
-        or a time accepted by the API
+        departure_time can be 'morning', 'evening' to use the defaults,
+        a departure_schedule.Slot or a time accepted by the API
+
+        With a route_cache, a route found before for the same location,
+        leg, mode and slot is returned without calling Google.
 
         Parameters
         ----------
@@ -240,16 +465,23 @@ class ATTGoogleAPI:
             GPS coordinates or address string of the place to or from which
             travel to SLAC will occur.
 
-        departure_time: string
+        departure_time: string, departure_schedule.Slot or integer
             either 'morning' or 'evening'
             used to define departure_time from the defaults and also switch the
             origin and destination parameters in the Google API.
+            a Slot is resolved to its next time in the future, an integer
+            is used as it is
 
         mode: string
             either 'driving' or 'transit'
             used to choose travel by car (driving) or by public transit as
             defined in the Google API
 
+        leg: string
+            'morning' (location to SLAC) or 'evening' (SLAC to location),
+            the direction of travel when departure_time is a Slot or a time
+            rather than 'morning' or 'evening'
+
         Returns
         -------
         if Google API call is successful:
@@ -283,15 +515,17 @@ class ATTGoogleAPI:
         #         raise AttributeError('The origin given does not appear to be in the form latitude,longitude.')
 
         # ensure departure_time is valid
-        if departure_time == 'morning':
-            departure_time = self.morning_time
-            origin = location
-            destination = self.SLAC_address
-        elif departure_time == 'evening':
-            departure_time = self.evening_time
-            origin = self.SLAC_address
-            destination = location
-
+        slot = None # the logical departure slot, if there is one
+        if departure_time in ('morning','evening'):
+            leg = departure_time
+            if leg == 'morning':
+                departure_time = self.morning_time
+            else:
+                departure_time = self.evening_time
+            if departure_time is None: # the next one in the schedule
+                slot = self.schedule.slot(leg)
+        elif isinstance(departure_time,departure_schedule.Slot):
+            slot = departure_time
         else:
             if not isinstance(departure_time,int):
                 try:
@@ -299,11 +533,28 @@ class ATTGoogleAPI:
                 except ValueError:
                     print('departure_time must be an integer')
                     raise ValueError
+        if slot is not None:
+            departure_time = slot.next_epoch(lead=self.schedule.lead)
+            slot_key = slot.key
+        else:
+            slot_key = str(departure_time)
+        if leg == 'evening':
+            origin = self.SLAC_address
+            destination = location
+        else:
+            origin = location
+            destination = self.SLAC_address
 
         # check that a valid mode is requested
         if mode not in ['driving','transit']:
             raise ValueError('mode must be either \'driving\' or \'transit\'.')
 
+        # routes found before for the same slot need no call
+        if self.routes is not None:
+            cached = self.routes.get(location,leg,mode,slot_key)
+            if cached is not None:
+                return cached
+
         #finally call the API!
         # the api says it can't be called with 'transit' and a traffic_model
         # but it doesn't throw an error, so whatever
@@ -347,12 +598,15 @@ class ATTGoogleAPI:
         else:
             duration_in_traffic = None
 
-        return (start_address,
+        data = (start_address,
                 start_location,
                 end_address,
                 end_location,
                 duration,
                 duration_in_traffic)
+        if self.routes is not None:
+            self.routes.put(location,leg,mode,slot_key,data)
+        return data
 
     def google_dir_wrapper(self,origin,destination,departure_time,mode):
         """
@@ -377,18 +631,25 @@ class ATTGoogleAPI:
         -------
         the dictionary that the Google API returns
         """
+        leg = 'evening' if origin == self.SLAC_address else 'morning'
 
+        # quota and network trouble are retried by self.caller, running out
+        # of quota for good raises resilience.GaveUp
         try:
-            info_dict = self.gmaps.directions(origin=origin,
-                                              destination=destination,
-                                              departure_time=departure_time,
-                                              mode=mode,
-                                              traffic_model='best_guess')
-        except googlemaps.exceptions.Timeout:
-            print('Calls to the Google API are being rejected.')
-            print('Is it likely you are over your quota.')
-            raise googlemaps.exceptions.Timeout
-        except googlemaps.exceptions.ApiError:
+            info_dict = self.caller.call(self.timed_directions,
+                                         origin=origin,
+                                         destination=destination,
+                                         departure_time=departure_time,
+                                         mode=mode,
+                                         leg=leg)
+        except resilience.GaveUp:
+            raise
+        except Exception as error:
+            if resilience.classify(error) != 'not_found':
+                raise
+            place = destination if origin == self.SLAC_address else origin
+            if COORDINATES.match(place): # nothing to chop off coordinates
+                return {}
             print('Human readable address could not be found by the API.')
             print('Typically, this is an address so new Google does not ')
             print('yet know about it.  I will chop off the number and see')
@@ -397,16 +658,58 @@ class ATTGoogleAPI:
                 destination = ' '.join(destination.split(' ')[1:])
             else: # going to SLAC
                 origin = ' '.join(origin.split(' ')[1:])
+            metrics.counter('api_retries_total', mode=mode, leg=leg).inc()
             try:
+                info_dict = self.caller.call(self.timed_directions,
+                                             origin=origin,
+                                             destination=destination,
+                                             departure_time=departure_time,
+                                             mode=mode,
+                                             leg=leg)
+            except resilience.GaveUp:
+                raise
+            except Exception as error:
+                if resilience.classify(error) != 'not_found':
+                    raise
+                print('Nope, that did not help.  Returning empty dictionary.')
+                return {}
+
+        return info_dict
+
+
+    def timed_directions(self,origin,destination,departure_time,mode,leg):
+        """
+        one call to the Google API directions method, recorded in metrics:
+        latency and outcome per mode and leg, and the cost of the call
+
+        Parameters
+        ----------
+        origin, destination, departure_time, mode:
+            see google_dir_wrapper
+
+        leg: string
+            'morning' or 'evening', only used to label the metrics
+
+        returns
+        -------
+        the dictionary that the Google API returns
+        """
+        # departure_time with a traffic model is billed as advanced, but
+        # transit results never include traffic
+        metrics.add_cost('directions_advanced' if mode == 'driving'
+                         else 'directions')
+        outcome = 'error'
+        try:
+            with metrics.timer('api_latency_seconds',mode=mode,leg=leg):
                 info_dict = self.gmaps.directions(origin=origin,
                                                   destination=destination,
                                                   departure_time=departure_time,
                                                   mode=mode,
                                                   traffic_model='best_guess')
-            except googlemaps.exceptions.ApiError:
-                print('Nope, that did not help.  Returning empty dictionary.')
-                return {}
-
+            outcome = 'ok' if len(info_dict) > 0 else 'no_route'
+        finally:
+            metrics.counter('api_calls_total',mode=mode,leg=leg,
+                            outcome=outcome).inc()
         return info_dict
 
 
@@ -434,20 +737,21 @@ class ATTGoogleAPI:
             self.df = pd.read_hdf(dump_location + save_file, key='all_zips')
             good_load = self.check_df() # check to see if the data is possibly correct
             if good_load:
+                self.df = interning.intern_listings(self.df)
                 print('Data loaded successfully from {:s} in {:s}'.format(save_file,dump_location))
         if not good_load:   # iterate through the files in the desired directory
             print('Loading all CSV files in {:s}'.format(dump_location))
-            df = self.open_dataframe(None) # create a blank dataframe
+            dfs = [self.open_dataframe(None)] # start with a blank dataframe
             for file_str in os.listdir(dump_location):
                 #print 'Opening {:s}'.format(file_str)
                 dump_path = dump_location + file_str
-                dtf = self.open_dataframe(dump_path)
                 if file_str.split('.')[-1] == 'csv': # only open CSV files
-                    df = df.append(dtf,ignore_index=True) # append the new dataframe
-            self.df = df # update self.dataframe
+                    dfs.append(self.open_dataframe(dump_path))
+            # one concat at the end instead of copying on every append
+            self.df = pd.concat(dfs,ignore_index=True) # update self.dataframe
 
 
-    def process_data(self):
+    def process_data(self,processes=1):
         """
         Transforms the data in useful ways:
 
@@ -470,10 +774,14 @@ class ATTGoogleAPI:
         Makes sure that 'zillow_addressStreet', 'zillow_addressCity' and
         'zillow_addressState' are of type str or unicode.
 
+        With processes > 1 the work is split by zipcode over that many
+        processes, see parallel.transform.
+
 
         Parameters
         ----------
-        none
+        processes: integer
+            number of processes to transform the data with
 
         Returns
         -------
@@ -481,43 +789,29 @@ class ATTGoogleAPI:
 
         """
         if len(self.df) < 1:
-            print 'No data yet loaded.  Run load_files first.'
+            print('No data yet loaded.  Run load_files first.')
             return
         elif self.check_df():
-            print 'Data already appears processed, skipping this step.'
+            print('Data already appears processed, skipping this step.')
             return
 
-        # do some filtering of entries we don't want to see
-        filter1 = self.df['zillow_status'].isin(['ForSale','RecentlySold']) # only want sales for now
-        # it appears that all recently sold have a price of '0'
-        filter2 = ~self.df['zillow_price'].isin(['0']) # all prices that are NOT zero
-        self.df = self.df[filter1 & filter2] # keep only the desired data
-
-        # turn the zillow_id into an integer
-        self.df['zillow_id'] = self.df['zillow_id'].astype(int)
-
-        # turn the zipcode into an integer
-        self.df['zillow_zipcode'] = self.df['zillow_zipcode'].astype(int)
-
-        # turn the date scraped in to a datetime
-        self.df['date_scraped'] = pd.to_datetime(self.df['date_scraped'])
-
-        # zillow_prices is all screwy with various numbering formats, fix this
-        self.df['zillow_price'] = self.df['zillow_price'].apply(self.price_filter)
-
-        # for all the coords, make a string for the google API
-        self.df['location'] = self.df.apply(lambda row:
-                              self.convert_coords(row['zillow_latitude'],
-                              row['zillow_longitude']),axis=1)
+        start_time = time.time()
+        rows_in = len(self.df)
+        if processes > 1:
+            import parallel # imports this module, so not at the top
+            self.df = parallel.transform(self.df,processes=processes,
+                                         with_features=False)
+        else:
+            self.df = transform_listings(self.df)
+            # parallel.transform counts its own rows
+            metrics.counter('process_data_rows_total').inc(rows_in)
+        # encode the repeated strings, build the addresses once
+        self.df = interning.intern_listings(self.df)
 
-        # make sure the address strings are valid
-        def wrap_str(x):
-            return isinstance(x,(str,unicode))
-        mask1 = self.df['zillow_addressStreet'].apply(wrap_str)
-        mask2 = self.df['zillow_addressCity'].apply(wrap_str)
-        mask3 = self.df['zillow_addressState'].apply(wrap_str)
-        mask = mask1 & mask2 & mask3
-        self.df = self.df[mask]
+        elapsed = time.time() - start_time
+        metrics.histogram('process_data_seconds').observe(elapsed)
+        if elapsed > 0:
+            metrics.gauge('process_data_rows_per_second').set(rows_in/elapsed)
 
 
     def add_data_to_df(self,index,column,data):
@@ -552,7 +846,56 @@ class ATTGoogleAPI:
             self.df.at[index,column] = [self.df.loc[index,column],data]
 
 
-    def get_times(self,number=10):
+    def plan_calls(self,number=None,retry_failed=False):
+        """
+        the calls get_times would make, worked out from the duration columns
+        in one pass without calling Google
+
+        A duration of np.nan has not been tried yet.  np.inf means Google
+        found no route; those are only planned again with retry_failed.
+        Calls are ordered by row, then morning drive, evening drive, morning
+        transit, evening transit, which is the order get_times makes them in.
+
+        Parameters
+        ----------
+        number: integer
+            most calls to plan, None for all of them
+
+        retry_failed: boolean
+            also plan calls that failed before
+
+        Returns
+        -------
+        numpy structured array of CALL_DTYPE
+            row: position of the listing in self.df
+            leg: index into CALL_LEGS ('morning', 'evening')
+            mode: index into CALL_MODES ('driving', 'transit')
+        """
+        def pending(column):
+            values = np.asarray(self.df[column].values,dtype=float)
+            if retry_failed:
+                return ~np.isfinite(values)
+            return np.isnan(values)
+
+        todo = np.column_stack([
+            pending('morning_drive_duration') |
+            pending('morning_drive_duration_with_traffic'),
+            pending('evening_drive_duration') |
+            pending('evening_drive_duration_with_traffic'),
+            pending('morning_transit_duration'),
+            pending('evening_transit_duration')])
+        rows,switch = np.nonzero(todo) # row major, so in get_times order
+        if number is not None:
+            rows,switch = rows[:number],switch[:number]
+        plan = np.empty(len(rows),dtype=CALL_DTYPE)
+        plan['row'] = rows
+        plan['leg'] = switch % 2
+        plan['mode'] = switch // 2
+        return plan
+
+
+    def get_times(self,number=10,workers=1,use_coordinates=True,
+                        retry_failed=False):
         """
         Updates rows in the data frame by calling the Google Maps API
         4 times:
@@ -565,82 +908,156 @@ class ATTGoogleAPI:
         yet.
 
         If the Google API cannot find a route between the location and SLAC
-        the code will fill that duration in with -1.  This means you can't just
-        perform self.df['column_name'].mean(), you have to filter for positive
-        values first using self.df['column_name'] > 0 (np.nan will be False).
+        the code will fill that duration in with np.inf.
+
+        With workers > 1 the calls are made from that many threads.  How many
+        are actually in flight at once is decided by self.caller.limiter,
+        which backs off when Google says we are over the quota.  If the quota
+        runs out for good the calls stop early and what was found so far is
+        kept.
 
         Parameters
         ----------
         number: integer
             maximum number of calls to the Google API
 
+        workers: integer
+            number of threads making calls
+
+        use_coordinates: boolean
+            route on coordinates where they are known, see route_locations,
+            instead of on the street address
+
+        retry_failed: boolean
+            also try again the routes that failed before (np.inf)
+
         Returns
         -------
         calls: integer
             number of times the Google API was called
 
         """
+        print('Attempting {:d} calls to the Google API.'.format(number))
+        plan = self.plan_calls(number=number,retry_failed=retry_failed)
+        addresses = list(self.full_addresses(plan['row']))
+        if use_coordinates and len(plan):
+            addresses = self.route_locations(plan['row'],addresses)
+        indices = self.df.index[plan['row']]
+        tasks = [(index,address,CALL_LEGS[leg],CALL_MODES[mode]) for
+                 index,address,leg,mode in
+                 zip(indices,addresses,plan['leg'],plan['mode'])]
+
+        def fetch(task):
+            index,address,dep_time,mode = task
+            return self.get_travel_time(location=address,
+                                        departure_time=dep_time,
+                                        mode=mode)
 
         calls = 0 # number of calls to the Google API
-        row_index = None
-        times = ['morning','evening']
-        modes = ['driving','transit']
-        print('Attempting {:d} calls to the Google API.'.format(number))
-        for index,row in self.df.iterrows():
-            ds_to_get = [(np.isnan(row['morning_drive_duration']) or
-                          np.isnan(row['morning_drive_duration_with_traffic'])),
-                         (np.isnan(row['evening_drive_duration']) or
-                          np.isnan(row['evening_drive_duration_with_traffic'])),
-                          np.isnan(row['morning_transit_duration']),
-                          np.isnan(row['evening_transit_duration'])]
-
-            for switch,each in enumerate(ds_to_get):
-                if each and calls < number:
-                    dep_time = times[switch % 2]
-                    mode = modes[0 if switch < 2 else 1]
-
-                    print('Call #{:d} on index {:d}, mode: {:s}, time: {:s}'
-                        .format(calls,index,mode,dep_time))
-                    address = row['zillow_addressStreet'] + ', ' + \
-                              row['zillow_addressCity'] + ', ' + \
-                              row['zillow_addressState'] + ' ' + \
-                              str(row['zillow_zipcode'])
-                    data = self.get_travel_time(location=address,
-                                                departure_time=dep_time,
-                                                mode=mode)
-                    calls += 1
-                    if data == None: # this look up failed
-                        if mode == 'driving':
-                            column = dep_time + '_drive_duration'
-                            self.add_data_to_df(index,column,np.inf)
-                            column = dep_time + '_drive_duration_with_traffic'
-                            self.add_data_to_df(index,column,np.inf)
-                        if mode == 'transit':
-                            column = dep_time + '_transit_duration'
-                            self.add_data_to_df(index,column,np.inf)
-                        continue # end this part of the loop
-
-                    tdata = dep_time + ':' + mode + ':' + data[0]
-                    self.add_data_to_df(index,'google_start_address',tdata)
-                    tdata = dep_time + ':' + mode + ':' + data[1]
-                    self.add_data_to_df(index,'google_start_location',tdata)
-                    tdata = dep_time + ':' + mode + ':' + data[2]
-                    self.add_data_to_df(index,'google_end_address',tdata)
-                    tdata = dep_time + ':' + mode + ':' + data[3]
-                    self.add_data_to_df(index,'google_end_location',tdata)
-                    if mode == modes[0]: #driving
-                        column = dep_time + '_drive_duration'
-                        self.add_data_to_df(index,column,data[4])
-                        column = dep_time + '_drive_duration_with_traffic'
-                        self.add_data_to_df(index,column,data[5])
-                    if mode == modes[1]: #transit
-                        column = dep_time + '_transit_duration'
-                        self.add_data_to_df(index,column,data[4])
-                        # there is no _with_traffic for transit
+        def store(task,data):
+            nonlocal calls
+            index,address,dep_time,mode = task
+            print('Call #{:d} on index {:d}, mode: {:s}, time: {:s}'
+                .format(calls,index,mode,dep_time))
+            calls += 1
+            self.store_travel_time(index,dep_time,mode,data)
+
+        pool = None
+        window = deque() # (task,future) submitted and not stored, in order
+        try:
+            if workers > 1:
+                from concurrent.futures import ThreadPoolExecutor
+                pool = ThreadPoolExecutor(max_workers=workers)
+                # Only a few calls are queued ahead of the ones in flight,
+                # so stopping early doesn't leave a backlog to run.
+                for task in tasks:
+                    if len(window) >= 2 * workers:
+                        task_done,future = window.popleft()
+                        store(task_done,future.result())
+                    window.append((task,pool.submit(fetch,task)))
+                while window:
+                    task_done,future = window.popleft()
+                    store(task_done,future.result())
+            else:
+                for task in tasks:
+                    store(task,fetch(task))
+        except resilience.GaveUp as err:
+            if err.kind != 'quota':
+                raise
+            print('Calls to the Google API are being rejected.')
+            print('It is likely you are over your quota, stopping early.')
+            if pool is not None:
+                # Queued calls are dropped and the ones in flight give up
+                # before their next attempt; what did finish is kept.
+                self.caller.cancel()
+                pool.shutdown(wait=True,cancel_futures=True)
+                for task_done,future in window:
+                    if not future.cancelled() and \
+                            future.exception() is None:
+                        store(task_done,future.result())
+        finally:
+            if pool is not None:
+                self.caller.cancel()
+                pool.shutdown(wait=True,cancel_futures=True)
+                self.caller.resume()
         print('Finished calling the Google API.')
         return calls
 
 
+    def store_travel_time(self,index,dep_time,mode,data):
+        """
+        writes the result of get_travel_time into the row given by index
+
+        Parameters
+        ----------
+        index: pandas index
+            the index of the dataframe row to add data to
+
+        dep_time: string
+            'morning' or 'evening'
+
+        mode: string
+            'driving' or 'transit'
+
+        data: tuple or None
+            what get_travel_time returned, None for a failed look up
+
+        Returns
+        -------
+        nothing, df is modified in place
+        """
+        if data == None: # this look up failed
+            metrics.counter('route_failures_total',mode=mode,
+                            leg=dep_time).inc()
+            if mode == 'driving':
+                column = dep_time + '_drive_duration'
+                self.add_data_to_df(index,column,np.inf)
+                column = dep_time + '_drive_duration_with_traffic'
+                self.add_data_to_df(index,column,np.inf)
+            if mode == 'transit':
+                column = dep_time + '_transit_duration'
+                self.add_data_to_df(index,column,np.inf)
+            return
+
+        tdata = sys.intern(dep_time + ':' + mode + ':' + data[0])
+        self.add_data_to_df(index,'google_start_address',tdata)
+        tdata = sys.intern(dep_time + ':' + mode + ':' + data[1])
+        self.add_data_to_df(index,'google_start_location',tdata)
+        tdata = sys.intern(dep_time + ':' + mode + ':' + data[2])
+        self.add_data_to_df(index,'google_end_address',tdata)
+        tdata = sys.intern(dep_time + ':' + mode + ':' + data[3])
+        self.add_data_to_df(index,'google_end_location',tdata)
+        if mode == 'driving':
+            column = dep_time + '_drive_duration'
+            self.add_data_to_df(index,column,data[4])
+            column = dep_time + '_drive_duration_with_traffic'
+            self.add_data_to_df(index,column,data[5])
+        if mode == 'transit':
+            column = dep_time + '_transit_duration'
+            self.add_data_to_df(index,column,data[4])
+            # there is no _with_traffic for transit
+
+
     def save_dataframe_hdf(self,dump_location=None,save_file='saved_data.hdf5'):
         """
         save the dataframe to an HDF5 file
@@ -665,11 +1082,12 @@ class ATTGoogleAPI:
             os.remove(dump_location + save_file)
         # create the saved file
         hdf_file = pd.HDFStore(dump_location + save_file)
-        hdf_file.put('all_zips',self.df)
+        hdf_file.put('all_zips',interning.plain_columns(self.df))
         hdf_file.close()
 
 
-    def find_some_times(self,dump_location=None,save_file='saved_data.hdf5',number=10):
+    def find_some_times(self,dump_location=None,save_file='saved_data.hdf5',number=10,
+                        workers=1):
         """
         typical use pattern for finding the travel duration on the penninsula
         WARNING: will overwrite any data you have in memory but not saved
@@ -685,11 +1103,14 @@ class ATTGoogleAPI:
         number: integer
             maximum number of times to call the Google API
 
+        workers: integer
+            number of threads making calls, see get_times
+
         Returns
         -------
         nothing
         """
         self.load_files(dump_location=dump_location,save_file=save_file)
         self.process_data()
-        self.get_times(number=number) # makes number calls to the google API
+        self.get_times(number=number,workers=workers) # makes number calls to the google API
         self.save_dataframe_hdf(save_file=save_file)
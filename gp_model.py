@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+"""Gaussian Process travel time model that is fitted once and predicts in
+bounded memory.
+
+sklearn's GaussianProcessRegressor refits its hyperparameters on every run,
+and predict builds the whole (n_test, n_train) kernel matrix at once.  Here
+the fitted model, that is the kernel hyperparameters, the Cholesky factor of
+the training kernel and the weights alpha, is saved to an .npz file named
+after a hash of the training data, so the next run with the same training
+points loads it instead of fitting.  Prediction evaluates the kernel in
+chunks of chunk_size test points, optionally in float32, on a pool of
+processes:
+
+```
+import gp_model
+model = gp_model.fit_cached(x, y, cache_dir='./dumped_data/')
+y_pred = model.predict(X, chunk_size=4096, processes=8, dtype=np.float32)
+```
+
+The kernel is the one data_analysis always used, a constant plus an
+anisotropic RBF plus white noise.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os  # for the cache path and the number of cores
+import time  # for the fit and prediction timings
+import hashlib  # to key the cache on the training data
+import numpy as np
+import metrics  # cache hit and miss counts
+
+DEFAULT_CHUNK_SIZE = 4096  # test points per kernel block
+DEFAULT_ALPHA = 1e-3  # added to the diagonal of the training kernel
+DEFAULT_RESTARTS = 1  # optimizer restarts when fitting
+
+_worker = {}  # the model and test points in each prediction worker
+
+
+def training_hash(x, y, alpha=DEFAULT_ALPHA,
+                  n_restarts_optimizer=DEFAULT_RESTARTS):
+    """
+    a short string that changes whenever the training data or the fit
+    settings change
+
+    Parameters
+    ----------
+    x: array
+        (n_train, n_features) training points
+    y: array
+        n_train training targets
+    alpha: float
+        value added to the diagonal of the training kernel
+    n_restarts_optimizer: integer
+        optimizer restarts when fitting
+
+    Returns
+    -------
+    string
+        hex digest of the data and settings
+    """
+    digest = hashlib.sha1()
+    for array in (x, y):
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(str(array.shape).encode('utf-8'))
+        digest.update(array.tobytes())
+    digest.update('{!r}:{:d}'.format(float(alpha),
+                                     n_restarts_optimizer).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class GPModel:
+    """
+    A fitted Gaussian Process with the kernel
+    constant + RBF(length_scale) + White(noise_level)
+
+    Parameters
+    ----------
+    x_train: array
+        (n_train, n_features) training points
+    alpha: array
+        n_train weights, K^-1 (y - y_mean) / y_std
+    L: array
+        lower Cholesky factor of the training kernel plus alpha on the
+        diagonal
+    constant: float
+        constant kernel value
+    length_scale: array
+        RBF length scale of each feature
+    noise_level: float
+        white noise variance
+    y_mean: float
+        mean the targets were shifted by before fitting
+    y_std: float
+        scale the targets were divided by before fitting
+    """
+    def __init__(self, x_train, alpha, L, constant, length_scale,
+                 noise_level, y_mean=0.0, y_std=1.0):
+        self.x_train = np.asarray(x_train, dtype=np.float64)
+        self.alpha = np.asarray(alpha, dtype=np.float64)
+        self.L = np.asarray(L, dtype=np.float64)
+        self.constant = float(constant)
+        self.length_scale = np.asarray(length_scale, dtype=np.float64)
+        self.noise_level = float(noise_level)
+        self.y_mean = float(y_mean)
+        self.y_std = float(y_std)
+
+    @classmethod
+    def from_sklearn(cls, gpr):
+        """the GPModel of a fitted GaussianProcessRegressor with the kernel
+        built by fit"""
+        kernel = gpr.kernel_
+        return cls(gpr.X_train_, gpr.alpha_, gpr.L_,
+                   kernel.k1.k1.constant_value,
+                   np.broadcast_to(kernel.k1.k2.length_scale,
+                                   gpr.X_train_.shape[1:]),
+                   kernel.k2.noise_level,
+                   np.ravel(gpr._y_train_mean)[0],
+                   np.ravel(gpr._y_train_std)[0])
+
+    def save(self, path):
+        """writes the model to an .npz file"""
+        np.savez(path, x_train=self.x_train, alpha=self.alpha, L=self.L,
+                 constant=self.constant, length_scale=self.length_scale,
+                 noise_level=self.noise_level, y_mean=self.y_mean,
+                 y_std=self.y_std)
+
+    @classmethod
+    def load(cls, path):
+        """reads a model written by save"""
+        with np.load(path) as saved:
+            return cls(**dict((name, saved[name]) for name in saved.files))
+
+    def cross_kernel(self, X, dtype=np.float64):
+        """
+        the (len(X), n_train) kernel between X and the training points,
+        without the white noise which is zero off the diagonal
+        """
+        # centered in float64 first, raw coordinates lose too many digits
+        # in float32
+        center = self.x_train.mean(axis=0)
+        X = ((np.asarray(X, dtype=np.float64) - center) /
+             self.length_scale).astype(dtype)
+        train = ((self.x_train - center) / self.length_scale).astype(dtype)
+        # squared distances as |a|^2 + |b|^2 - 2 a.b, one matrix product
+        dist = (X * X).sum(axis=1)[:, None] + (train * train).sum(axis=1) - \
+            2 * np.dot(X, train.T)
+        np.maximum(dist, 0, out=dist)
+        dist *= -0.5
+        np.exp(dist, out=dist)
+        dist += self.constant
+        return dist
+
+    def predict_chunk(self, X, return_std=False, dtype=np.float64):
+        """
+        predictions for a block of test points small enough to hold its
+        kernel matrix, see predict
+        """
+        K = self.cross_kernel(X, dtype)
+        mean = np.dot(K, self.alpha.astype(dtype)).astype(np.float64) * \
+            self.y_std + self.y_mean
+        if not return_std:
+            return mean
+        from scipy.linalg import solve_triangular
+        v = solve_triangular(self.L.astype(dtype), K.T, lower=True,
+                             check_finite=False)
+        var = self.constant + 1.0 + self.noise_level - \
+            np.einsum('ij,ij->j', v, v).astype(np.float64)
+        np.maximum(var, 0, out=var)
+        return mean, np.sqrt(var) * self.y_std
+
+    def predict(self, X, chunk_size=DEFAULT_CHUNK_SIZE, processes=1,
+                dtype=np.float64, return_std=False):
+        """
+        predicted targets of X, chunk_size points at a time
+
+        Parameters
+        ----------
+        X: array
+            (n_points, n_features) test points, a memory-mapped array is
+            only read a chunk at a time
+        chunk_size: integer
+            test points per kernel block, memory is about
+            chunk_size * n_train * itemsize per process
+        processes: integer
+            worker processes, the number of cores if None
+        dtype: numpy dtype
+            float32 halves the memory and time of the kernel blocks, at
+            some cost in precision
+        return_std: boolean
+            also return the standard deviation of each prediction
+
+        Returns
+        -------
+        numpy array
+            prediction of each point, and their standard deviations if
+            return_std
+        """
+        start_time = time.time()
+        n_points = len(X)
+        processes = processes or os.cpu_count() or 1
+        tasks = [(start, min(start + chunk_size, n_points))
+                 for start in range(0, n_points, chunk_size)]
+        mean = np.empty(n_points)
+        std = np.empty(n_points) if return_std else None
+        if processes == 1 or len(tasks) < 2:
+            _init_worker(self, X, return_std, dtype)
+            results = map(_predict_task, tasks)
+            pool = None
+        else:
+            import multiprocessing
+            # forked workers inherit X and the model rather than unpickle them
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('fork')
+            else:
+                context = multiprocessing.get_context()
+            pool = context.Pool(processes, initializer=_init_worker,
+                                initargs=(self, X, return_std, dtype))
+            results = pool.imap_unordered(_predict_task, tasks)
+        try:
+            for (start, stop), result in results:
+                if return_std:
+                    mean[start:stop], std[start:stop] = result
+                else:
+                    mean[start:stop] = result
+        finally:
+            _worker.clear()
+            if pool is not None:
+                pool.close()
+                pool.join()
+        elapsed = time.time() - start_time
+        metrics.histogram('gp_predict_seconds').observe(elapsed)
+        if elapsed > 0:
+            metrics.gauge('gp_predict_points_per_second').set(
+                n_points / elapsed)
+        if return_std:
+            return mean, std
+        return mean
+
+
+def _init_worker(model, X, return_std, dtype):
+    _worker.update(model=model, X=X, return_std=return_std, dtype=dtype)
+
+
+def _predict_task(bounds):
+    """worker: predicts the test points X[start:stop]"""
+    start, stop = bounds
+    return bounds, _worker['model'].predict_chunk(
+        _worker['X'][start:stop], return_std=_worker['return_std'],
+        dtype=_worker['dtype'])
+
+
+def fit(x, y, alpha=DEFAULT_ALPHA, n_restarts_optimizer=DEFAULT_RESTARTS,
+        random_state=None):
+    """
+    fits the GP travel time model with sklearn
+
+    Parameters
+    ----------
+    x: array
+        (n_train, n_features) training points
+    y: array
+        n_train training targets
+    alpha: float
+        value added to the diagonal of the training kernel
+    n_restarts_optimizer: integer
+        optimizer restarts
+    random_state: integer
+        seed for the optimizer restarts
+
+    Returns
+    -------
+    GPModel
+        the fitted model
+    """
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import RBF, ConstantKernel as C
+    from sklearn.gaussian_process.kernels import WhiteKernel
+    start_time = time.time()
+    kernel = C(np.mean(y)) + RBF((0.02, 0.02), (1e-5, 1e+2)) \
+        + WhiteKernel(1.0, noise_level_bounds=(1e-10, 1e+0))
+    gpr = GaussianProcessRegressor(kernel=kernel,
+                                   alpha=alpha,
+                                   n_restarts_optimizer=n_restarts_optimizer,
+                                   random_state=random_state)
+    gpr.fit(x, y)
+    metrics.histogram('gp_fit_seconds').observe(time.time() - start_time)
+    return GPModel.from_sklearn(gpr)
+
+
+def fit_cached(x, y, cache_dir='.', alpha=DEFAULT_ALPHA,
+               n_restarts_optimizer=DEFAULT_RESTARTS, random_state=None):
+    """
+    the model fit returns for x and y, loaded from cache_dir if it was
+    fitted on the same data before
+
+    Parameters
+    ----------
+    x: array
+        (n_train, n_features) training points
+    y: array
+        n_train training targets
+    cache_dir: string
+        directory of the gp_<hash>.npz model files
+    alpha: float
+        value added to the diagonal of the training kernel
+    n_restarts_optimizer: integer
+        optimizer restarts
+    random_state: integer
+        seed for the optimizer restarts
+
+    Returns
+    -------
+    GPModel
+        the fitted model
+    """
+    key = training_hash(x, y, alpha, n_restarts_optimizer)
+    cache_file = os.path.join(cache_dir, 'gp_' + key + '.npz')
+    if os.path.exists(cache_file):
+        metrics.counter('cache_requests_total', cache='gp_model',
+                        result='hit').inc()
+        return GPModel.load(cache_file)
+    metrics.counter('cache_requests_total', cache='gp_model',
+                    result='miss').inc()
+    model = fit(x, y, alpha, n_restarts_optimizer, random_state)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    # write then rename so an interrupted save is never loaded
+    partial = cache_file + '.part.npz'
+    model.save(partial)
+    os.replace(partial, cache_file)
+    return model
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+"""
+Dictionary encoding of the listing columns that repeat a few strings.
+
+zillow_addressCity, zillow_addressState, zillow_homeType and zillow_status
+hold a few hundred distinct strings over every listing.  As Python strings
+each row costs a pointer and, once read back from a file, its own string
+object.  intern_listings turns them into pandas categoricals: one table of
+the distinct strings and a small integer code per row.  Comparisons, isin
+and groupby work on the codes.
+
+The full address get_times sends to Google, and its normalized form the
+geocode store and the route cache key on, are built once per listing here.
+They aren't concatenated again from four columns on every call:
+
+```
+import interning
+df = interning.intern_listings(df)
+df['zillow_homeType'].cat.codes     # int8 codes
+df['full_address'].iloc[0]          # '1543 Oriole Ave, Sunnyvale, CA 94087'
+df['normalized_address'].iloc[0]    # '1543 ORIOLE AVE SUNNYVALE CA 94087'
+```
+
+The google_* address columns can't be encoded while get_times is still
+filling them in, so store_travel_time interns their strings instead.
+Matching strings then share one object.  HDF5 files in the fixed format
+can't hold categoricals, so plain_columns undoes the encoding before a save.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import numpy as np
+import pandas as pd
+import geocode_store  # full_address and normalize_address
+
+# columns of a few distinct strings each
+INTERNED_COLUMNS = ['zillow_addressCity', 'zillow_addressState',
+                    'zillow_homeType', 'zillow_status']
+# the address columns intern_listings adds
+ADDRESS_COLUMNS = ['full_address', 'normalized_address']
+
+
+class StringTable:
+    """
+    Distinct strings numbered in the order they were first seen, for
+    dictionary encoding columns outside pandas, e.g. in an export.
+
+    Parameters
+    ----------
+    strings: list of strings
+        the table to start from, codes 0 to len(strings) - 1
+    """
+    def __init__(self, strings=()):
+        self.strings = []
+        self.codes = {}
+        for string in strings:
+            self.code(string)
+
+    def __len__(self):
+        return len(self.strings)
+
+    def code(self, string):
+        """the code of string, added to the table if it is new"""
+        code = self.codes.get(string)
+        if code is None:
+            code = len(self.strings)
+            self.strings.append(string)
+            self.codes[string] = code
+        return code
+
+    def encode(self, values):
+        """
+        codes of values (an array, Series or categorical) as an int32
+        array, -1 for missing values; only the distinct values are looked up
+        """
+        codes, uniques = pd.factorize(pd.Series(values), sort=False)
+        lookup = np.array([self.code(str(value)) for value in uniques] +
+                          [-1], dtype=np.int32)
+        return lookup[codes]  # code -1 picks the -1 at the end
+
+    def decode(self, codes):
+        """the strings of codes as an object array, None for -1"""
+        table = np.array(self.strings + [None], dtype=object)
+        return table[np.asarray(codes)]
+
+
+def intern_columns(df, columns=INTERNED_COLUMNS):
+    """
+    df with each of columns that only holds strings as a categorical,
+    columns that are missing, already encoded or hold something else, e.g.
+    lists, are left alone; df is changed in place and returned
+    """
+    for name in columns:
+        if name not in df or isinstance(df[name].dtype, pd.CategoricalDtype):
+            continue
+        try:
+            df[name] = df[name].astype('category')
+        except TypeError:  # unhashable values, e.g. lists
+            continue
+    return df
+
+
+def address_columns(df):
+    """
+    the full address of every listing and its normalized form, as
+    categoricals; each distinct address is normalized once
+
+    Returns
+    -------
+    full: pandas Categorical
+        e.g. '1543 Oriole Ave, Sunnyvale, CA 94087'
+    normalized: pandas Categorical
+        geocode_store.normalize_address of full
+    """
+    full = pd.Categorical(geocode_store.full_address(
+        df['zillow_addressStreet'], df['zillow_addressCity'],
+        df['zillow_addressState'], df['zillow_zipcode']))
+    keys = np.array([geocode_store.normalize_address(address)
+                     for address in full.categories], dtype=object)
+    # variants of one address share a key, so this is a new table
+    return full, pd.Categorical(keys[full.codes])
+
+
+def intern_listings(df):
+    """
+    df with INTERNED_COLUMNS dictionary encoded and the full_address and
+    normalized_address columns added; df is changed in place and returned
+    """
+    intern_columns(df, INTERNED_COLUMNS + ADDRESS_COLUMNS)
+    if 'full_address' not in df:
+        df['full_address'], df['normalized_address'] = address_columns(df)
+    return df
+
+
+def plain_columns(df):
+    """a copy of df with every categorical column turned back into
+    strings, for file formats that can't store categoricals"""
+    categorical = [name for name in df.columns
+                   if isinstance(df[name].dtype, pd.CategoricalDtype)]
+    if not categorical:
+        return df
+    df = df.copy()
+    for name in categorical:
+        df[name] = df[name].astype(object)
+    return df
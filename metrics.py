@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+"""
+Counters, gauges, histograms and timers for seeing what a run is doing.
+
+Metrics are off by default and every call then returns a shared do-nothing
+object, so instrumented code costs one function call when nobody is looking.
+Turn them on, run, and export:
+
+```
+import metrics, google_api
+metrics.enable()
+t = google_api.ATTGoogleAPI()
+t.find_some_times(number=100)
+metrics.export_prometheus('metrics.prom')   # or metrics.export_jsonl(...)
+print(metrics.value('api_cost_dollars_total'))
+```
+
+API cost is counted at the per-call prices in DEFAULT_PRICING, pass your
+own prices to enable if they differ.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import time  # for timers and export time stamps
+import json  # for the JSON lines export
+import threading  # metrics can be updated from worker threads
+
+# dollars per call, Google Maps Platform prices as of 2019
+# directions with departure_time and a traffic model is billed as advanced
+DEFAULT_PRICING = {'directions': 0.005,
+                   'directions_advanced': 0.010,
+                   'distance_matrix': 0.005,
+                   'geocode': 0.005}
+
+# histogram buckets in seconds, good for API calls and page loads
+DEFAULT_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+                   30.0)
+
+_enabled = False
+_pricing = dict(DEFAULT_PRICING)
+_registry = {}  # (name, sorted label items) -> metric
+_lock = threading.Lock()
+
+
+class _Null:
+    """stands in for every metric type while metrics are disabled"""
+    def inc(self, amount=1):
+        pass
+
+    def set(self, value):
+        pass
+
+    def observe(self, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _Null()
+
+
+class Counter:
+    """a number that only goes up"""
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        with _lock:
+            self.value += amount
+
+
+class Gauge:
+    """a number that is set to the latest value"""
+    kind = 'gauge'
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    """counts of observations in cumulative buckets, plus their sum"""
+    kind = 'histogram'
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        with _lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+
+class _Timer:
+    """context manager that observes its elapsed seconds in a histogram"""
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.time() - self.start
+        self.histogram.observe(self.elapsed)
+        return False
+
+
+def enable(pricing=None):
+    """
+    turns metrics on
+
+    Parameters
+    ----------
+    pricing: dictionary
+        dollars per call for each API method, updates DEFAULT_PRICING
+    """
+    global _enabled
+    _enabled = True
+    if pricing:
+        _pricing.update(pricing)
+
+
+def disable():
+    """turns metrics off, already recorded values are kept"""
+    global _enabled
+    _enabled = False
+
+
+def enabled():
+    """True if metrics are being recorded"""
+    return _enabled
+
+
+def reset():
+    """forgets every recorded metric and the custom pricing"""
+    with _lock:
+        _registry.clear()
+    _pricing.clear()
+    _pricing.update(DEFAULT_PRICING)
+
+
+def _get(cls, name, labels, *args):
+    key = (name, tuple(sorted(labels.items())))
+    metric = _registry.get(key)
+    if metric is None:
+        with _lock:
+            metric = _registry.setdefault(key, cls(*args))
+    return metric
+
+
+def counter(name, **labels):
+    """the counter called name with these labels, created on first use"""
+    if not _enabled:
+        return _NULL
+    return _get(Counter, name, labels)
+
+
+def gauge(name, **labels):
+    """the gauge called name with these labels, created on first use"""
+    if not _enabled:
+        return _NULL
+    return _get(Gauge, name, labels)
+
+
+def histogram(name, buckets=DEFAULT_BUCKETS, **labels):
+    """the histogram called name with these labels, created on first use"""
+    if not _enabled:
+        return _NULL
+    return _get(Histogram, name, labels, buckets)
+
+
+def timer(name, **labels):
+    """
+    context manager timing its block into the histogram called name, e.g.
+
+    with metrics.timer('api_latency_seconds', mode='driving'):
+        ...
+    """
+    if not _enabled:
+        return _NULL
+    return _Timer(_get(Histogram, name, labels, DEFAULT_BUCKETS))
+
+
+def add_cost(method, calls=1):
+    """
+    counts calls to a paid API method and the dollars they cost
+
+    Parameters
+    ----------
+    method: string
+        a key of the pricing table, e.g. 'directions_advanced'
+    calls: integer
+        number of calls made
+    """
+    if not _enabled:
+        return
+    _get(Counter, 'api_billed_calls_total', {'method': method}).inc(calls)
+    _get(Counter, 'api_cost_dollars_total', {}).inc(
+        calls * _pricing.get(method, 0.0))
+
+
+def value(name, **labels):
+    """
+    current value of a counter or gauge, the count of a histogram, or None
+    if nothing was recorded under name and labels
+    """
+    metric = _registry.get((name, tuple(sorted(labels.items()))))
+    if metric is None:
+        return None
+    if isinstance(metric, Histogram):
+        return metric.count
+    return metric.value
+
+
+def _label_str(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('{:s}="{:s}"'.format(k, str(v))
+                          for k, v in items) + '}'
+
+
+def prometheus_text():
+    """all metrics in the Prometheus text exposition format"""
+    lines = []
+    typed = set()
+    for (name, labels), metric in sorted(_registry.items(),
+                                         key=lambda item: item[0]):
+        if name not in typed:
+            lines.append('# TYPE {:s} {:s}'.format(name, metric.kind))
+            typed.add(name)
+        if isinstance(metric, Histogram):
+            for bound, count in zip(metric.buckets, metric.counts):
+                lines.append('{:s}_bucket{:s} {:d}'.format(
+                    name, _label_str(labels, [('le', repr(bound))]), count))
+            lines.append('{:s}_bucket{:s} {:d}'.format(
+                name, _label_str(labels, [('le', '+Inf')]), metric.count))
+            lines.append('{:s}_sum{:s} {!r}'.format(name, _label_str(labels),
+                                                    metric.sum))
+            lines.append('{:s}_count{:s} {:d}'.format(
+                name, _label_str(labels), metric.count))
+        else:
+            lines.append('{:s}{:s} {!r}'.format(name, _label_str(labels),
+                                                metric.value))
+    return '\n'.join(lines) + '\n'
+
+
+def export_prometheus(path):
+    """writes prometheus_text to path, e.g. for the node exporter's textfile
+    collector"""
+    with open(path, 'w') as out:
+        out.write(prometheus_text())
+
+
+def export_jsonl(path):
+    """appends one JSON line per metric to path, stamped with the time"""
+    now = time.time()
+    with open(path, 'a') as out:
+        for (name, labels), metric in sorted(_registry.items(),
+                                             key=lambda item: item[0]):
+            record = {'time': now, 'name': name, 'type': metric.kind,
+                      'labels': dict(labels)}
+            if isinstance(metric, Histogram):
+                record.update(buckets=list(metric.buckets),
+                              counts=list(metric.counts), sum=metric.sum,
+                              count=metric.count)
+            else:
+                record['value'] = metric.value
+            out.write(json.dumps(record, sort_keys=True) + '\n')
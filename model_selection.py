@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+"""Spatially blocked cross-validation of travel time surrogate models.
+
+A random train/test split of listings flatters any model that interpolates
+coordinates, since every test listing has training neighbors a few houses
+away.  Here whole zipcodes, or geohash cells, are held out together, k
+folds of them, and each candidate model in MODELS is fitted on the rest and
+scored on the held-out areas.  The (model, fold) runs go to a process pool,
+the fold assignment is cached on disk, and the report has the absolute
+error percentiles and the fit and predict times of every model, so the
+cheapest model that meets an accuracy bar can be picked:
+
+```
+import model_selection
+report = model_selection.evaluate(X, y, zipcodes, k=5, processes=4,
+                                  cache_dir='./dumped_data/')
+print(report)
+print(model_selection.cheapest(report, max_mae=300))
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os  # for the cache path and the number of cores
+import time  # for the fit and predict timings
+import hashlib  # to key the fold cache
+import functools  # for the model variants
+import numpy as np
+import pandas as pd
+import metrics  # cache hit and miss counts
+import gp_model  # cached GP fit and chunked prediction
+
+DEFAULT_FOLDS = 5
+DEFAULT_GEOHASH_PRECISION = 5  # characters, cells of about 5 km
+# absolute error percentiles in the report
+PERCENTILES = [50, 90, 95, 99]
+
+_worker = {}  # the data and folds in each evaluation worker
+
+
+def geohash_cells(lat, lng, precision=DEFAULT_GEOHASH_PRECISION):
+    """
+    geohash cell of each point as an integer, the bits of the geohash
+    string of that many characters
+
+    Parameters
+    ----------
+    lat: array
+        latitudes
+    lng: array
+        longitudes
+    precision: integer
+        geohash characters, 5 bits each
+
+    Returns
+    -------
+    numpy array of int64
+        cell code of each point, equal codes for points in the same cell
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lng = np.asarray(lng, dtype=np.float64)
+    lat_lo = np.full(lat.shape, -90.0)
+    lat_hi = np.full(lat.shape, 90.0)
+    lng_lo = np.full(lng.shape, -180.0)
+    lng_hi = np.full(lng.shape, 180.0)
+    code = np.zeros(lat.shape, dtype=np.int64)
+    # bits alternate between longitude and latitude, longitude first
+    for bit in range(precision * 5):
+        if bit % 2 == 0:
+            value, lo, hi = lng, lng_lo, lng_hi
+        else:
+            value, lo, hi = lat, lat_lo, lat_hi
+        mid = (lo + hi) / 2
+        upper = value >= mid
+        lo[upper] = mid[upper]
+        hi[~upper] = mid[~upper]
+        code = (code << 1) | upper
+    return code
+
+
+def assign_folds(groups, k=DEFAULT_FOLDS, seed=0):
+    """
+    fold of each row, keeping every group in one fold and the folds about
+    the same size
+
+    Parameters
+    ----------
+    groups: array
+        group of each row, e.g. zipcodes or geohash_cells
+    k: integer
+        number of folds
+    seed: integer
+        seed for shuffling the groups before they are dealt out
+
+    Returns
+    -------
+    numpy array of int8
+        fold of each row, 0 to k - 1
+    """
+    codes, uniques = pd.factorize(pd.Series(groups), use_na_sentinel=False)
+    sizes = np.bincount(codes, minlength=len(uniques))
+    k = max(1, min(k, len(uniques)))
+    shuffled = np.random.RandomState(seed).permutation(len(uniques))
+    # biggest groups first, each into the smallest fold
+    fold_of_group = np.empty(len(uniques), dtype=np.int8)
+    loads = np.zeros(k, dtype=np.int64)
+    for group in shuffled[np.argsort(-sizes[shuffled], kind='stable')]:
+        fold = int(np.argmin(loads))
+        fold_of_group[group] = fold
+        loads[fold] += sizes[group]
+    return fold_of_group[codes]
+
+
+def cached_folds(groups, k=DEFAULT_FOLDS, seed=0, cache_dir=None):
+    """
+    assign_folds, loaded from cache_dir if the same groups were assigned
+    before
+
+    Parameters
+    ----------
+    groups: array
+        group of each row
+    k: integer
+        number of folds
+    seed: integer
+        seed for assign_folds
+    cache_dir: string
+        directory of the folds_<hash>.npy files, no caching if None
+
+    Returns
+    -------
+    numpy array of int8
+        fold of each row
+    """
+    if not cache_dir:
+        return assign_folds(groups, k, seed)
+    codes = pd.factorize(pd.Series(groups), use_na_sentinel=False)[0]
+    digest = hashlib.sha1(np.ascontiguousarray(codes).tobytes())
+    digest.update('{:d}:{:d}'.format(k, seed).encode('utf-8'))
+    cache_file = os.path.join(cache_dir,
+                              'folds_' + digest.hexdigest()[:16] + '.npy')
+    if os.path.exists(cache_file):
+        metrics.counter('cache_requests_total', cache='folds',
+                        result='hit').inc()
+        return np.load(cache_file)
+    metrics.counter('cache_requests_total', cache='folds',
+                    result='miss').inc()
+    folds = assign_folds(groups, k, seed)
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    np.save(cache_file, folds)
+    return folds
+
+
+################################################################################
+# candidate models, each fit(x, y, seed) returns a predict(X) function
+################################################################################
+
+def fit_mean(x, y, seed=0):
+    """the mean travel time everywhere, the bar every model must beat"""
+    mean = float(np.mean(y))
+    return lambda X: np.full(len(X), mean)
+
+
+def fit_knn(x, y, seed=0, n_neighbors=10):
+    """distance weighted average of the nearest training listings"""
+    from sklearn.neighbors import KNeighborsRegressor
+    knn = KNeighborsRegressor(n_neighbors=min(n_neighbors, len(x)),
+                              weights='distance').fit(x, y)
+    return knn.predict
+
+
+def fit_gp(x, y, seed=0, n_train=1024, kernel='rbf'):
+    """
+    GP on a random n_train of the training listings, with the gp_model
+    kernel ('rbf') or a constant plus Matern plus white noise ('matern')
+    """
+    rng = np.random.RandomState(seed)
+    if len(x) > n_train:
+        points = np.sort(rng.choice(len(x), n_train, replace=False))
+        x, y = x[points], y[points]
+    if kernel == 'rbf':
+        model = gp_model.fit(x, y, n_restarts_optimizer=0, random_state=seed)
+        return model.predict
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import Matern, ConstantKernel as C
+    from sklearn.gaussian_process.kernels import WhiteKernel
+    gpr = GaussianProcessRegressor(
+        kernel=C(np.mean(y)) + Matern((0.02, 0.02), (1e-5, 1e+2), nu=1.5)
+        + WhiteKernel(1.0, noise_level_bounds=(1e-10, 1e+0)),
+        alpha=1e-3, random_state=seed).fit(x, y)
+
+    def predict(X):
+        # in chunks, like gp_model, so the kernel matrix stays small
+        return np.concatenate(
+            [gpr.predict(X[start:start + gp_model.DEFAULT_CHUNK_SIZE])
+             for start in range(0, len(X), gp_model.DEFAULT_CHUNK_SIZE)]
+            or [np.zeros(0)])
+    return predict
+
+
+# name -> fit function of every model evaluate compares by default
+MODELS = {'mean': fit_mean,
+          'knn_10': fit_knn,
+          'knn_50': functools.partial(fit_knn, n_neighbors=50),
+          'gp_rbf_512': functools.partial(fit_gp, n_train=512),
+          'gp_rbf_1024': fit_gp,
+          'gp_matern_1024': functools.partial(fit_gp, kernel='matern')}
+
+
+def _init_worker(X, y, folds, models, seed):
+    _worker.update(X=X, y=y, folds=folds, models=models, seed=seed)
+    # the models import sklearn when they are fitted; import it here so the
+    # first fit in each worker isn't charged seconds of import time
+    try:
+        import sklearn.neighbors
+        import sklearn.gaussian_process
+    except ImportError:  # only the models that need it will fail
+        pass
+
+
+def _run_fold(task):
+    """worker: fits one model without one fold and scores it on that fold"""
+    name, fold = task
+    X, y, folds = _worker['X'], _worker['y'], _worker['folds']
+    test = folds == fold
+    start = time.time()
+    predict = _worker['models'][name](X[~test], y[~test],
+                                      seed=_worker['seed'])
+    fit_seconds = time.time() - start
+    start = time.time()
+    y_pred = predict(X[test])
+    predict_seconds = time.time() - start
+    return name, fold, y[test] - y_pred, fit_seconds, predict_seconds
+
+
+def evaluate(X, y, groups, models=None, k=DEFAULT_FOLDS, processes=1,
+             cache_dir=None, seed=0):
+    """
+    blocked k-fold cross-validation of each model
+
+    Parameters
+    ----------
+    X: array
+        (n_points, n_features) inputs, e.g. longitude and latitude
+    y: array
+        travel time of each point
+    groups: array
+        spatial block of each point, zipcodes or geohash_cells; points in
+        one block are never split between training and testing
+    models: dictionary
+        name -> fit function like those in MODELS, defaults to MODELS
+    k: integer
+        number of folds
+    processes: integer
+        worker processes, the number of cores if None
+    cache_dir: string
+        where to cache the fold assignment, see cached_folds
+    seed: integer
+        seed for the folds and the models' sampling
+
+    Returns
+    -------
+    pandas DataFrame
+        one row per model, by MAE: mean absolute error, the PERCENTILES of
+        the absolute error, the mean signed relative error, the total fit
+        and predict seconds and the predictions per second
+    """
+    models = models or MODELS
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    groups = np.asarray(groups)
+    # points without a travel time or location can't be scored
+    usable = np.isfinite(y) & np.isfinite(X).all(axis=1)
+    X, y, groups = X[usable], y[usable], groups[usable]
+    folds = cached_folds(groups, k, seed, cache_dir)
+    tasks = [(name, fold) for name in models for fold in np.unique(folds)]
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        _init_worker(X, y, folds, models, seed)
+        try:
+            results = list(map(_run_fold, tasks))
+        finally:
+            _worker.clear()
+    else:
+        import multiprocessing
+        # forked workers inherit the data rather than unpickle it
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+        else:
+            context = multiprocessing.get_context()
+        pool = context.Pool(processes, initializer=_init_worker,
+                            initargs=(X, y, folds, models, seed))
+        try:
+            results = pool.map(_run_fold, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    rows = []
+    for name in models:
+        runs = [result for result in results if result[0] == name]
+        errors = np.concatenate([run[2] for run in runs])
+        truth = np.concatenate([y[folds == run[1]] for run in runs])
+        abs_errors = np.abs(errors)
+        row = {'model': name, 'folds': len(runs), 'points': len(errors),
+               'mae': abs_errors.mean(),
+               'mean_relative_error': np.mean(errors / truth),
+               'fit_seconds': sum(run[3] for run in runs),
+               'predict_seconds': sum(run[4] for run in runs)}
+        for q, value in zip(PERCENTILES,
+                            np.percentile(abs_errors, PERCENTILES)):
+            row['p{:d}_abs_error'.format(q)] = value
+        row['predict_per_second'] = len(errors) / max(row['predict_seconds'],
+                                                      1e-9)
+        rows.append(row)
+        metrics.gauge('model_selection_mae', model=name).set(row['mae'])
+    return pd.DataFrame(rows).set_index('model').sort_values('mae')
+
+
+def cheapest(report, max_mae):
+    """
+    name of the model in an evaluate report with the lowest fit plus
+    predict time whose MAE is at most max_mae, None if no model is that
+    accurate
+    """
+    good = report[report['mae'] <= max_mae]
+    if len(good) == 0:
+        return None
+    return (good['fit_seconds'] + good['predict_seconds']).idxmin()
@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+"""
+Archive of the raw Zillow result pages.
+
+Every page zillow_zipcode_search loads is kept, gzip compressed, in a
+directory of blobs named by the SHA-1 of the page, so a page that didn't
+change is stored once however often it is fetched.  A SQLite index records
+the URL, the fetch time, the zipcode, the page number, the scrape run it
+belonged to and the number of results Zillow reported.  A run counts as
+complete once its listings were written, see complete_run; only complete
+runs are used below.  With the archive:
+
+- the parser can be run again over the pages of the last run of every
+  zipcode without a browser or any sleeps, see gather_data.reparse_archive
+- a zipcode whose result count hasn't changed since a recent run can be
+  skipped after loading its first page, see is_fresh
+
+```
+import page_archive, gather_data
+archive = page_archive.PageArchive('./dumped_data/pages')
+search = gather_data.zillow_zipcode_search(archive=archive)
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os  # for the blob paths
+import re  # to find the result count
+import gzip  # pages are stored compressed
+import time  # for fetch times
+import sqlite3  # the index
+import hashlib  # to name the blobs
+import metrics  # pages stored and reused
+
+# '1,234 results' or '1,234 homes' near the top of a result page
+_RESULT_COUNT = re.compile(
+    r'class="[^"]*result-count[^"]*"[^>]*>\s*([0-9,]+)')
+DEFAULT_MAX_AGE_DAYS = 7
+
+
+def result_count(html):
+    """number of results Zillow reports on a search page, None if the page
+    doesn't say"""
+    found = _RESULT_COUNT.search(html)
+    if found is None:
+        return None
+    return int(found.group(1).replace(',', ''))
+
+
+class PageArchive:
+    """
+    Content addressed store of result pages with an index by URL and fetch
+    time.
+
+    Parameters
+    ----------
+    directory: string
+        where the blobs and index.sqlite are kept, created if needed
+    """
+    def __init__(self, directory='./dumped_data/pages'):
+        self.directory = directory
+        if not os.path.isdir(os.path.join(directory, 'objects')):
+            os.makedirs(os.path.join(directory, 'objects'))
+        self.db = sqlite3.connect(os.path.join(directory, 'index.sqlite'))
+        self.db.execute('CREATE TABLE IF NOT EXISTS pages ('
+                        'url TEXT, fetched REAL, sha TEXT, zipcode TEXT, '
+                        'page INTEGER, run REAL, result_count INTEGER)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS pages_zipcode '
+                        'ON pages (zipcode, run, page)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS pages_url '
+                        'ON pages (url, fetched)')
+        new = self.db.execute("SELECT name FROM sqlite_master WHERE "
+                              "type = 'table' AND name = 'runs'").fetchone() \
+            is None
+        self.db.execute('CREATE TABLE IF NOT EXISTS runs ('
+                        'zipcode TEXT, run REAL, completed REAL, '
+                        'PRIMARY KEY (zipcode, run))')
+        if new:
+            # archives from before runs were recorded only kept the runs
+            # they finished, or so they were treated
+            self.db.execute('INSERT OR IGNORE INTO runs '
+                            'SELECT zipcode, run, MAX(fetched) FROM pages '
+                            'WHERE zipcode IS NOT NULL GROUP BY zipcode, run')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM pages').fetchone()[0]
+
+    def _path(self, sha):
+        return os.path.join(self.directory, 'objects', sha[:2],
+                            sha[2:] + '.html.gz')
+
+    def put(self, url, html, zipcode=None, page=None, run=None,
+            fetched=None):
+        """
+        archives one fetched page
+
+        Parameters
+        ----------
+        url: string
+            the URL the page was loaded from
+        html: string
+            the page source
+        zipcode: string
+            zipcode the page is a result page of
+        page: integer
+            result page number
+        run: float
+            start time of the scrape of the zipcode the page belongs to,
+            all pages of one search share it
+        fetched: float
+            when the page was loaded, now if None
+
+        Returns
+        -------
+        string
+            the SHA-1 of the page, its name in the archive
+        """
+        fetched = time.time() if fetched is None else fetched
+        data = html.encode('utf-8')
+        sha = hashlib.sha1(data).hexdigest()
+        path = self._path(sha)
+        if not os.path.exists(path):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            # write then rename so a blob is either whole or missing
+            partial = path + '.part'
+            with gzip.open(partial, 'wb') as blob:
+                blob.write(data)
+            os.replace(partial, path)
+            metrics.counter('page_archive_blobs_total', result='new').inc()
+        else:
+            metrics.counter('page_archive_blobs_total', result='same').inc()
+        with self.db:
+            self.db.execute('INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)',
+                            (url, fetched, sha, zipcode, page,
+                             fetched if run is None else run,
+                             result_count(html)))
+        return sha
+
+    def get(self, sha):
+        """the page named sha"""
+        with gzip.open(self._path(sha), 'rb') as blob:
+            return blob.read().decode('utf-8')
+
+    def latest(self, url):
+        """(fetch time, page) of the last fetch of url, None if it was never
+        fetched"""
+        row = self.db.execute('SELECT fetched, sha FROM pages WHERE url = ? '
+                              'ORDER BY fetched DESC LIMIT 1',
+                              (url,)).fetchone()
+        if row is None:
+            return None
+        return row[0], self.get(row[1])
+
+    def zipcodes(self):
+        """every zipcode with archived pages"""
+        return [row[0] for row in self.db.execute(
+            'SELECT DISTINCT zipcode FROM pages WHERE zipcode IS NOT NULL '
+            'ORDER BY zipcode')]
+
+    def complete_run(self, zipcode, run, completed=None):
+        """marks the scrape run of zipcode complete, once its listings were
+        written; completed is when, now if None"""
+        completed = time.time() if completed is None else completed
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?)',
+                            (zipcode, run, completed))
+
+    def last_run(self, zipcode):
+        """
+        (run, fetch time of its first page, result count) of the latest
+        complete scrape of zipcode, None if it was never scraped to the end
+        """
+        return self.db.execute(
+            'SELECT pages.run, MIN(fetched), MAX(result_count) FROM pages '
+            'JOIN runs ON runs.zipcode = pages.zipcode '
+            'AND runs.run = pages.run '
+            'WHERE pages.zipcode = ? AND runs.completed IS NOT NULL '
+            'GROUP BY pages.run ORDER BY pages.run DESC LIMIT 1',
+            (zipcode,)).fetchone()
+
+    def run_pages(self, zipcode, run=None):
+        """
+        (page number, fetch time, page) of every page of a scrape of
+        zipcode, the latest complete scrape if run is None, in page order
+        """
+        if run is None:
+            last = self.last_run(zipcode)
+            if last is None:
+                return
+            run = last[0]
+        rows = self.db.execute('SELECT page, fetched, sha FROM pages '
+                               'WHERE zipcode = ? AND run = ? '
+                               'ORDER BY page, fetched', (zipcode, run))
+        for page, fetched, sha in rows.fetchall():
+            yield page, fetched, self.get(sha)
+
+    def is_fresh(self, zipcode, count, max_age_days=DEFAULT_MAX_AGE_DAYS,
+                 now=None):
+        """
+        True if a complete scrape of zipcode started less than max_age_days
+        ago and Zillow reported count results then too, so scraping it again
+        would find the same listings
+        """
+        last = self.last_run(zipcode)
+        if last is None or count is None or last[2] is None:
+            return False
+        now = time.time() if now is None else now
+        return last[2] == count and now - last[1] < max_age_days * 86400
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+"""
+Ways for zillow_zipcode_search to load a result page.
+
+SeleniumFetcher is how pages were always loaded, a whole Firefox rendering
+every page to read its source.  HTTPFetcher asks for the page with one
+pooled httpx client instead: the connection, cookies and compressed
+transfer are reused from page to page, and it takes a few MB rather than a
+browser.  FallbackFetcher uses HTTPFetcher and only starts the browser for a
+page that didn't come back as a result page, e.g. one that needs
+JavaScript to render or a captcha:
+
+```
+import gather_data, page_fetcher
+search = gather_data.zillow_zipcode_search(
+    fetcher=page_fetcher.FallbackFetcher())
+```
+
+httpx is only needed for HTTPFetcher, selenium only for SeleniumFetcher,
+and each is imported when the first page is loaded.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import re  # to recognize result pages
+import threading  # one browser for several threads
+import metrics  # pages per backend
+
+# what a desktop Firefox sends, so the server answers like it does to one
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.14; rv:68.0) '
+                  'Gecko/20100101 Firefox/68.0',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,'
+              '*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate',
+}
+DEFAULT_TIMEOUT = 30.0  # seconds
+
+# markup only a rendered result page has: listing cards, the result count or
+# the no results notice
+_RESULT_PAGE = re.compile(r'zsg-photo-card|result-count|'
+                          r'zsg-content_collapsed')
+_CAPTCHA = re.compile(r'captcha', re.IGNORECASE)
+
+
+def is_result_page(html):
+    """True if html is a result page the parser can read, False for a
+    captcha or a page that still has to be rendered"""
+    return bool(_RESULT_PAGE.search(html)) and not _CAPTCHA.search(html)
+
+
+class NotAResultPage(Exception):
+    """the page loaded isn't a result page, see is_result_page"""
+
+
+class HTTPFetcher:
+    """
+    Loads pages with a pooled httpx client.
+
+    Parameters
+    ----------
+    headers: dictionary
+        sent with every request, DEFAULT_HEADERS if None
+    timeout: float
+        seconds to wait for a page
+    http2: boolean
+        use HTTP/2 where the server has it (needs the h2 package)
+    """
+    thread_safe = True  # the httpx client can be shared between threads
+
+    def __init__(self, headers=None, timeout=DEFAULT_TIMEOUT, http2=False):
+        self.headers = DEFAULT_HEADERS if headers is None else headers
+        self.timeout = timeout
+        self.http2 = http2
+        self.client = None
+
+    def get(self, url):
+        """
+        the source of the page at url
+
+        Raises
+        ------
+        NotAResultPage
+            if the server answered with something else than a result page
+        httpx.HTTPError
+            if the request failed
+        """
+        if self.client is None:
+            import httpx
+            # one client, so the connection and the cookies carry over
+            self.client = httpx.Client(headers=self.headers,
+                                       timeout=self.timeout,
+                                       http2=self.http2,
+                                       follow_redirects=True)
+        response = self.client.get(url)
+        response.raise_for_status()
+        html = response.text
+        if not is_result_page(html):
+            raise NotAResultPage(url)
+        return html
+
+    def close(self):
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+
+class SeleniumFetcher:
+    """
+    Loads pages by rendering them in Firefox, started on the first page.
+    """
+    thread_safe = False  # the browser shows one page at a time
+
+    def __init__(self):
+        self.driver = None
+
+    def get(self, url):
+        """the source of the page at url after the browser rendered it"""
+        if self.driver is None:
+            # Load the firefox web driver.
+            from selenium import webdriver
+            self.driver = webdriver.Firefox()
+        self.driver.get(url)
+        return self.driver.page_source
+
+    def close(self):
+        if self.driver is not None:
+            self.driver.close()
+            self.driver = None
+
+
+class FallbackFetcher:
+    """
+    Loads pages with primary and loads a page again with fallback when
+    primary fails or gets something that isn't a result page.
+
+    Parameters
+    ----------
+    primary: fetcher
+        HTTPFetcher() if None
+    fallback: fetcher
+        SeleniumFetcher() if None, the browser only starts if it is needed
+    """
+    def __init__(self, primary=None, fallback=None):
+        self.primary = primary or HTTPFetcher()
+        self.fallback = fallback or SeleniumFetcher()
+        # pages that fall back wait for each other if fallback can't be
+        # shared, so it can be used from threads whenever primary can
+        self.thread_safe = getattr(self.primary, 'thread_safe', False)
+        self.fallback_lock = threading.Lock()
+
+    def get(self, url):
+        """the source of the page at url"""
+        try:
+            html = self.primary.get(url)
+            metrics.counter('zillow_fetches_total', backend='primary').inc()
+            return html
+        except Exception as error:
+            print('Could not load {:s} without a browser ({:s}), '
+                  'rendering it instead.'.format(url, type(error).__name__))
+        metrics.counter('zillow_fetches_total', backend='fallback').inc()
+        if getattr(self.fallback, 'thread_safe', False):
+            return self.fallback.get(url)
+        with self.fallback_lock:
+            return self.fallback.get(url)
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
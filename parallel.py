@@ -0,0 +1,237 @@
+#!/usr/bin/env python
+"""Multiprocess version of the process_data transform and features.
+
+The listing table is split into partitions of whole zipcodes, balanced by
+row count, and google_api.transform_listings and features.add_features run
+on each partition in a process pool.  Where processes are forked the
+workers read the input table they inherit, copy on write; elsewhere the
+input columns are copied once into shared memory as fixed width numpy
+arrays.  The workers write their results into shared output arrays at the
+rows they own, so no DataFrame is pickled in either direction; a task is
+just the bounds of a partition.  The output is reassembled in the original
+row order:
+
+```
+import parallel
+t.df = parallel.transform(t.df, processes=8)  # instead of t.process_data()
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os  # for the number of cores
+import time  # for the rate metrics
+import numpy as np
+import pandas as pd
+import features  # derived columns
+import google_api  # transform_listings
+import metrics  # rows per second
+
+# columns read by the transform and whether they are strings in the input
+INPUT_COLUMNS = [('zillow_id', True), ('zillow_addressStreet', True),
+                 ('zillow_addressCity', True), ('zillow_addressState', True),
+                 ('zillow_zipcode', True), ('zillow_price', True),
+                 ('zillow_longitude', True), ('zillow_latitude', True),
+                 ('zillow_status', True), ('zillow_homeType', True),
+                 ('date_scraped', True),
+                 ('morning_drive_duration', False),
+                 ('morning_drive_duration_with_traffic', False),
+                 ('evening_drive_duration', False),
+                 ('evening_drive_duration_with_traffic', False),
+                 ('morning_transit_duration', False),
+                 ('evening_transit_duration', False)]
+
+# numeric columns written by the workers and their dtypes
+OUTPUT_COLUMNS = [('zillow_id', np.int64), ('zillow_zipcode', np.int64),
+                  ('zillow_price', np.int64),
+                  ('date_scraped', 'datetime64[ns]'),
+                  ('price (M$)', np.float64),
+                  ('average_drive_duration', np.float64),
+                  ('average_drive_duration_with_traffic', np.float64),
+                  ('average_transit_duration', np.float64),
+                  ('east_bay', np.bool_), ('monthly_payment', np.float64)]
+
+# partitions per process, more evens out the load
+PARTITIONS_PER_PROCESS = 4
+
+_shared = {}  # name -> (SharedMemory, array) in each worker
+_source = None  # the input table, inherited by forked workers
+_with_features = True  # whether the workers add the features
+
+
+def _share(array, blocks):
+    """a copy of array in a new shared memory block, appended to blocks"""
+    from multiprocessing import shared_memory
+    block = shared_memory.SharedMemory(create=True,
+                                       size=max(1, array.nbytes))
+    blocks.append(block)
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+    shared[...] = array
+    return (block.name, array.shape, array.dtype.str)
+
+
+def _attach(specs, with_features=True):
+    """pool initializer: maps the shared arrays described by specs"""
+    from multiprocessing import shared_memory
+    global _with_features
+    _with_features = with_features
+    for name, (block_name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        _shared[name] = (block, np.ndarray(shape, dtype=np.dtype(dtype),
+                                           buffer=block.buf))
+
+
+def _array(name):
+    return _shared[name][1]
+
+
+def _share_inputs(df, specs, blocks):
+    """copies the INPUT_COLUMNS of df to shared arrays, for spawned workers"""
+    for name, is_str in INPUT_COLUMNS:
+        if is_str:
+            null = df[name].isna().values
+            specs['null:' + name] = _share(null, blocks)
+            values = np.where(null, '', df[name].values).astype(str)
+        else:
+            values = pd.to_numeric(df[name],
+                                   errors='coerce').values.astype(float)
+        specs['in:' + name] = _share(values, blocks)
+
+
+def partition(zipcodes, n_parts):
+    """
+    splits the rows into n_parts groups of whole zipcodes with about the
+    same number of rows each
+
+    Parameters
+    ----------
+    zipcodes: array
+        zipcode of each row
+    n_parts: integer
+        number of partitions wanted
+
+    Returns
+    -------
+    order: numpy array of integers
+        row indices grouped by partition, in the original order within one
+    bounds: numpy array of integers
+        partition k is order[bounds[k]:bounds[k + 1]]
+    """
+    codes, uniques = pd.factorize(pd.Series(zipcodes), use_na_sentinel=False)
+    sizes = np.bincount(codes, minlength=len(uniques))
+    n_parts = max(1, min(n_parts, len(uniques)))
+    # biggest zipcodes first, each into the emptiest partition
+    part_of_zip = np.empty(len(uniques), dtype=np.int64)
+    loads = np.zeros(n_parts, dtype=np.int64)
+    for zip_code in np.argsort(-sizes, kind='stable'):
+        part = int(np.argmin(loads))
+        part_of_zip[zip_code] = part
+        loads[part] += sizes[zip_code]
+    part_of_row = part_of_zip[codes]
+    order = np.argsort(part_of_row, kind='stable')
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(part_of_row,
+                                                        minlength=n_parts))])
+    return order, bounds
+
+
+def _transform_partition(bounds):
+    """worker: transforms the rows of one partition into the shared output"""
+    start, stop = bounds
+    rows = _array('order')[start:stop]
+    if _source is not None:
+        df = _source[[name for name, _ in INPUT_COLUMNS]].iloc[rows]
+        df = df.set_axis(rows)
+    else:
+        columns = {}
+        for name, is_str in INPUT_COLUMNS:
+            values = pd.Series(_array('in:' + name)[rows], index=rows)
+            if is_str:
+                values[_array('null:' + name)[rows]] = np.nan
+            columns[name] = values
+        df = pd.DataFrame(columns)
+    out = google_api.transform_listings(df)
+    if len(out) and _with_features:
+        out = features.add_features(out)
+    kept = out.index.values
+    _array('kept')[kept] = True
+    for name, _ in OUTPUT_COLUMNS:
+        if _with_features or name not in features.feature_column_names:
+            _array('out:' + name)[kept] = out[name].values
+    return len(rows)
+
+
+def transform(df, processes=None, with_features=True):
+    """
+    google_api.transform_listings, and features.add_features if
+    with_features, of df on a pool of processes
+
+    Parameters
+    ----------
+    df: pandas DataFrame
+        listings as loaded from the scraped CSV files
+    processes: integer
+        worker processes, the number of cores if None
+    with_features: boolean
+        also add the features.feature_column_names columns
+
+    Returns
+    -------
+    pandas DataFrame
+        the same rows and values as the single process transform, in the
+        same order
+    """
+    import multiprocessing
+    global _source
+    processes = processes or os.cpu_count() or 1
+    start_time = time.time()
+    n_rows = len(df)
+    blocks = []
+    specs = {}
+    try:
+        order, bounds = partition(df['zillow_zipcode'].values,
+                                  processes * PARTITIONS_PER_PROCESS)
+        specs['order'] = _share(order, blocks)
+        if 'fork' in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context('fork')
+            _source = df
+        else:
+            context = multiprocessing.get_context()
+            _share_inputs(df, specs, blocks)
+        specs['kept'] = _share(np.zeros(n_rows, dtype=bool), blocks)
+        for name, dtype in OUTPUT_COLUMNS:
+            specs['out:' + name] = _share(np.zeros(n_rows, dtype=dtype),
+                                          blocks)
+        tasks = [(int(bounds[k]), int(bounds[k + 1]))
+                 for k in range(len(bounds) - 1) if bounds[k + 1] > bounds[k]]
+        pool = context.Pool(processes, initializer=_attach,
+                            initargs=(specs, with_features))
+        try:
+            pool.map(_transform_partition, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        # read the results back in this process
+        _attach(specs)
+        kept = _array('kept').copy()
+        out = df[kept].copy()
+        for name, _ in OUTPUT_COLUMNS:
+            if with_features or name not in features.feature_column_names:
+                out[name] = _array('out:' + name)[kept]
+        out['location'] = out['zillow_latitude'].astype(str) + ',' + \
+            out['zillow_longitude'].astype(str)
+    finally:
+        _source = None
+        for name in list(_shared):
+            _shared.pop(name)[0].close()
+        for block in blocks:
+            block.close()
+            block.unlink()
+    elapsed = time.time() - start_time
+    metrics.counter('process_data_rows_total').inc(n_rows)
+    if elapsed > 0:
+        metrics.gauge('process_data_rows_per_second',
+                      mode='parallel').set(n_rows / elapsed)
+    return out
+
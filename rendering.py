@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+"""Headless plotting of large scatters.
+
+Instead of drawing every point, points are binned into 2-D count grids and
+the grids are drawn as images straight to files with the Agg backend.  Grids
+are accumulated chunk by chunk, so memory depends on the number of bins and
+not on the number of points, and nothing here opens a window or touches
+pyplot's global state.
+
+Typical use:
+
+```
+import rendering
+rendering.render_price_commute(t, 'price_commute.png')
+rendering.render_by_zipcode(t, 'by_zipcode.png')
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import numpy as np
+
+# the columns plotted against each other by default
+PRICE_COLUMN = 'price (M$)'
+COMMUTE_COLUMN = 'average_drive_duration_with_traffic'
+
+
+def _new_figure(figsize=(8, 6)):
+    """a figure attached to an Agg canvas, no pyplot and no window"""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    fig.set_facecolor('white')
+    return fig
+
+
+def _finite_extent(x, y):
+    """[[xmin, xmax], [ymin, ymax]] over the finite values of x and y"""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    good = np.isfinite(x) & np.isfinite(y)
+    if not good.any():
+        return [[0.0, 1.0], [0.0, 1.0]]
+    return [[x[good].min(), x[good].max()], [y[good].min(), y[good].max()]]
+
+
+def iter_chunks(x, y, chunk_size=1000000, mask=None):
+    """yields (x, y) slices of chunk_size points, only where mask is True"""
+    for start in range(0, len(x), chunk_size):
+        stop = start + chunk_size
+        if mask is None:
+            yield x[start:stop], y[start:stop]
+        else:
+            keep = mask[start:stop]
+            yield x[start:stop][keep], y[start:stop][keep]
+
+
+def density_grid(chunks, extent, bins=256):
+    """
+    counts of points per bin, accumulated over chunks of points
+
+    Parameters
+    ----------
+    chunks: iterable
+        (x, y) pairs of arrays, e.g. from iter_chunks or from reading a file
+        a piece at a time
+    extent: list
+        [[xmin, xmax], [ymin, ymax]] covered by the grid, points outside it
+        are dropped
+    bins: integer or (integer, integer)
+        number of bins along x and y
+
+    Returns
+    -------
+    numpy array
+        (x bins, y bins) counts
+    """
+    bins = (bins, bins) if np.isscalar(bins) else tuple(bins)
+    counts = np.zeros(bins, dtype=np.int64)
+    for x, y in chunks:
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        good = np.isfinite(x) & np.isfinite(y)
+        chunk_counts, _, _ = np.histogram2d(x[good], y[good], bins=bins,
+                                            range=extent)
+        counts += chunk_counts.astype(np.int64)
+    return counts
+
+
+def shade(counts, color):
+    """
+    log-scaled RGBA image of a count grid in one color, transparent where
+    there are no points
+
+    Parameters
+    ----------
+    counts: numpy array
+        (x bins, y bins) counts from density_grid
+    color: tuple
+        RGB color, each between 0 and 1
+
+    Returns
+    -------
+    numpy array
+        (y bins, x bins, 4) image with the origin at the lower left
+    """
+    level = np.log1p(counts.T.astype(float))
+    if level.max() > 0:
+        level /= level.max()
+    image = np.zeros(level.shape + (4,))
+    image[..., :3] = color
+    # even a single point should be visible
+    image[..., 3] = np.where(level > 0, 0.2 + 0.8 * level, 0.0)
+    return image
+
+
+def render_density(x, y, path, bins=256, extent=None, xlabel='', ylabel='',
+                   title='', chunk_size=1000000):
+    """
+    draws a log-scaled density image of (x, y) to path
+
+    Parameters
+    ----------
+    x: array
+        horizontal values
+    y: array
+        vertical values
+    path: string
+        file to write, the format comes from the extension
+    bins: integer
+        number of bins along each axis
+    extent: list
+        [[xmin, xmax], [ymin, ymax]], defaults to the range of the data
+    xlabel, ylabel, title: string
+        axis labels and title
+    chunk_size: integer
+        number of points binned at once
+
+    Returns
+    -------
+    numpy array
+        the count grid that was drawn
+    """
+    if extent is None:
+        extent = _finite_extent(x, y)
+    counts = density_grid(iter_chunks(x, y, chunk_size), extent, bins)
+    _draw_layers([(counts, (0.1, 0.1, 0.6), None)], extent, path, xlabel,
+                 ylabel, title)
+    return counts
+
+
+def _draw_layers(layers, extent, path, xlabel, ylabel, title):
+    """draws shaded count grids on top of each other and saves to path"""
+    fig = _new_figure()
+    ax = fig.add_subplot(111)
+    for counts, color, label in layers:
+        ax.imshow(shade(counts, color), origin='lower', aspect='auto',
+                  interpolation='nearest',
+                  extent=[extent[0][0], extent[0][1],
+                          extent[1][0], extent[1][1]])
+        if label:  # imshow has no legend entry, add an empty one
+            ax.plot([], [], 's', color=color, label=label)
+    if any(label for _, _, label in layers):
+        ax.legend(loc='upper right')
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    fig.savefig(path)
+
+
+def render_price_commute(t, path, bins=256, extent=None, chunk_size=1000000):
+    """
+    price versus commute density, east bay and peninsula in their own colors,
+    the headless version of BACK_data_analysis.price_dist_plot
+
+    Parameters
+    ----------
+    t: pandas.DataFrame
+        listing table with the features.add_features columns
+    path: string
+        file to write
+    bins: integer
+        number of bins along each axis
+    extent: list
+        [[xmin, xmax], [ymin, ymax]], defaults to the range of the data
+    chunk_size: integer
+        number of points binned at once
+
+    Returns
+    -------
+    nothing
+    """
+    render_price_commute_arrays(t[PRICE_COLUMN].values,
+                                t[COMMUTE_COLUMN].values,
+                                t['east_bay'].values.astype(bool), path,
+                                bins, extent, chunk_size)
+
+
+def render_price_commute_arrays(x, y, east_bay, path, bins=256, extent=None,
+                                chunk_size=1000000):
+    """
+    render_price_commute from arrays, e.g. the memory-mapped columns of
+    analysis_store.AnalysisData
+
+    Parameters
+    ----------
+    x: array
+        price in M$
+    y: array
+        commute in minutes
+    east_bay: boolean array
+        True for east bay listings
+    path, bins, extent, chunk_size:
+        as for render_price_commute
+    """
+    if extent is None:
+        extent = _finite_extent(x, y)
+    layers = [(density_grid(iter_chunks(x, y, chunk_size, east_bay),
+                            extent, bins), (0.0, 0.0, 1.0), 'east bay'),
+              (density_grid(iter_chunks(x, y, chunk_size, ~east_bay),
+                            extent, bins), (1.0, 0.0, 0.0), 'peninsula')]
+    _draw_layers(layers, extent, path, 'price (M$)',
+                 'commute time to SLAC (min)',
+                 'Single family homes, <$5M and <180 mins')
+
+
+def zipcode_summary(t, x_column=PRICE_COLUMN, y_column=COMMUTE_COLUMN):
+    """
+    per zipcode count, quartiles of x_column and y_column in one groupby
+
+    Parameters
+    ----------
+    t: pandas.DataFrame
+        listing table
+    x_column: string
+        first column to summarize
+    y_column: string
+        second column to summarize
+
+    Returns
+    -------
+    pandas.DataFrame
+        indexed by zillow_zipcode with columns count, and x_column and
+        y_column each suffixed with _25, _50 and _75
+    """
+    import pandas as pd
+    grouped = t[['zillow_zipcode', x_column, y_column]] \
+        .replace([np.inf, -np.inf], np.nan).groupby('zillow_zipcode')
+    quartiles = grouped.quantile([0.25, 0.5, 0.75]).unstack()
+    quartiles.columns = ['{:s}_{:d}'.format(col, int(q * 100))
+                         for col, q in quartiles.columns]
+    return pd.concat([grouped.size().rename('count'), quartiles], axis=1)
+
+
+def render_by_zipcode(t, path, x_column=PRICE_COLUMN, y_column=COMMUTE_COLUMN,
+                      summary=None):
+    """
+    median price and commute of each zipcode with interquartile bars and
+    marker area proportional to the number of listings, the headless
+    version of BACK_data_analysis.plot_by_zipcode
+
+    Parameters
+    ----------
+    t: pandas.DataFrame
+        listing table
+    path: string
+        file to write
+    x_column: string
+        column on the horizontal axis
+    y_column: string
+        column on the vertical axis
+    summary: pandas.DataFrame
+        a zipcode_summary to draw instead of summarizing t, e.g.
+        aggregate_cube.AggregateCube.zipcode_summary
+
+    Returns
+    -------
+    pandas.DataFrame
+        the zipcode_summary that was drawn
+    """
+    if summary is None:
+        summary = zipcode_summary(t, x_column, y_column)
+    x = summary[x_column + '_50'].values
+    y = summary[y_column + '_50'].values
+    fig = _new_figure()
+    ax = fig.add_subplot(111)
+    ax.errorbar(x, y,
+                xerr=[x - summary[x_column + '_25'].values,
+                      summary[x_column + '_75'].values - x],
+                yerr=[y - summary[y_column + '_25'].values,
+                      summary[y_column + '_75'].values - y],
+                fmt='none', ecolor='0.7', zorder=1)
+    counts = summary['count'].values.astype(float)
+    ax.scatter(x, y, s=200 * counts / counts.max(), c=np.arange(len(x)),
+               cmap='tab20', edgecolors='k', zorder=2)
+    for zipcode, xi, yi in zip(summary.index, x, y):
+        ax.annotate(str(zipcode), (xi, yi), fontsize=6)
+    ax.set_xlabel(x_column)
+    ax.set_ylabel(y_column)
+    ax.set_title('Single family homes by zipcode, median and quartiles')
+    fig.savefig(path)
+    return summary
+
+
+def render_prediction_check(actual, predicted, path, limit=10000, bins=200):
+    """
+    density of predicted against actual travel times, replaces plotting a
+    random subset of the points
+
+    Parameters
+    ----------
+    actual: array
+        travel times from Google Maps in seconds
+    predicted: array
+        travel times from the model in seconds
+    path: string
+        file to write
+    limit: float
+        both axes run from 0 to limit
+    bins: integer
+        number of bins along each axis
+
+    Returns
+    -------
+    nothing
+    """
+    render_density(actual, predicted, path, bins=bins,
+                   extent=[[0, limit], [0, limit]],
+                   xlabel='Google Maps Travel Time [s]',
+                   ylabel='GP Predicted Travel Time [s]')
@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+"""
+Retries, backoff, a circuit breaker and adaptive concurrency for calls to
+the Google API.
+
+Errors are sorted into kinds by classify:
+    'quota'     over the query limit, slow down and wait for the quota
+    'transient' network trouble or a server error, retry after a backoff
+    'not_found' Google can't make sense of the address, retrying won't help
+    'fatal'     anything else, e.g. a bad API key
+
+ResilientCaller.call retries quota and transient errors with exponential
+backoff and full jitter.  Quota errors also trip a CircuitBreaker that makes
+every worker wait out a cool down instead of hammering the API, and shrink
+the AIMDLimiter that decides how many calls may be in flight at once.  Each
+success grows the limit again, so throughput settles just under the quota.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import time  # for sleeping between attempts
+import random  # for jitter
+import threading  # the limiter and breaker are shared by worker threads
+import metrics  # retry and breaker counts
+
+# ApiError statuses that mean we are over the quota
+QUOTA_STATUSES = ('OVER_QUERY_LIMIT', 'OVER_DAILY_LIMIT',
+                  'RESOURCE_EXHAUSTED', 'RATE_LIMIT_EXCEEDED')
+# ApiError statuses that mean the address is the problem
+NOT_FOUND_STATUSES = ('NOT_FOUND', 'ZERO_RESULTS', 'INVALID_REQUEST')
+# ApiError statuses that are worth another try
+TRANSIENT_STATUSES = ('UNKNOWN_ERROR',)
+# longest seconds a sleeping caller takes to notice ResilientCaller.cancel
+POLL = 1.0
+
+
+class GaveUp(Exception):
+    """
+    raised by ResilientCaller.call when it stops retrying
+
+    Attributes
+    ----------
+    kind: string
+        the classify kind of the last error
+    error: Exception
+        the last error
+    """
+    def __init__(self, kind, error):
+        Exception.__init__(self, '{:s} error, giving up: {!r}'.format(kind,
+                                                                     error))
+        self.kind = kind
+        self.error = error
+
+
+def classify(error):
+    """
+    sorts an exception raised by a googlemaps.Client-like client into one of
+    'quota', 'transient', 'not_found' or 'fatal'
+    """
+    status = getattr(error, 'status', None)
+    name = type(error).__name__
+    if name == 'Timeout':
+        # googlemaps raises Timeout when its own retries over the query
+        # limit run out
+        return 'quota'
+    if name in ('TransportError', 'ConnectionError', 'ReadTimeout'):
+        return 'transient'
+    if name == 'HTTPError':
+        status_code = getattr(error, 'status_code', None)
+        if status_code == 429:
+            return 'quota'
+        if status_code is None or status_code >= 500:
+            return 'transient'
+        return 'fatal'
+    if status in QUOTA_STATUSES or name == '_OverQueryLimit':
+        return 'quota'
+    if status in NOT_FOUND_STATUSES:
+        return 'not_found'
+    if status in TRANSIENT_STATUSES:
+        return 'transient'
+    return 'fatal'
+
+
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter: attempt n waits a random time
+    between 0 and min(cap, base * 2**n) seconds.
+
+    Parameters
+    ----------
+    max_attempts: integer
+        calls made for transient errors before giving up
+    base: float
+        seconds of the first backoff
+    cap: float
+        longest backoff in seconds
+    quota_patience: float
+        seconds to keep waiting out quota errors before giving up
+    """
+    def __init__(self, max_attempts=5, base=0.5, cap=60.0,
+                 quota_patience=3600.0):
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.quota_patience = quota_patience
+
+    def delay(self, attempt):
+        """seconds to wait after failed attempt number attempt (from 0)"""
+        return random.uniform(0, min(self.cap, self.base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """
+    Stops all callers for a cool down after repeated quota errors.
+
+    The breaker opens after failure_threshold quota errors in a row.  While
+    open, wait() sleeps until the cool down is over; then one probe call is
+    let through (half open) and the other callers keep waiting for its
+    outcome.  If it fails the breaker opens again with twice the cool down,
+    up to max_cooldown; if it succeeds the breaker closes.
+
+    Parameters
+    ----------
+    failure_threshold: integer
+        consecutive quota errors that open the breaker
+    cooldown: float
+        seconds of the first cool down
+    max_cooldown: float
+        longest cool down in seconds
+    sleep, clock: functions
+        time.sleep and time.time, replaceable for tests
+    """
+    def __init__(self, failure_threshold=5, cooldown=30.0,
+                 max_cooldown=900.0, sleep=time.sleep, clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.sleep = sleep
+        self.clock = clock
+        self.failures = 0
+        self.open_until = 0.0
+        self.state = 'closed'
+        self.probing = None  # thread making the half open probe call
+        self.lock = threading.Lock()
+        self.probed = threading.Condition(self.lock)
+
+    def wait(self, cancelled=None):
+        """
+        blocks while the breaker is open or another caller's probe is in
+        flight, returns seconds waited
+
+        cancelled is a threading.Event that ends the wait early when set,
+        checked every POLL seconds; the caller doesn't become the probe then
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                if cancelled is not None and cancelled.is_set():
+                    return waited
+                if self.probing is not None:
+                    metrics.counter('breaker_waits_total').inc()
+                    start = time.time()
+                    self.probed.wait(POLL)
+                    waited += time.time() - start
+                    continue
+                remaining = self.open_until - self.clock()
+                if remaining <= 0:
+                    if self.state == 'open':
+                        # this caller is the probe
+                        self.state = 'half_open'
+                        self.probing = threading.get_ident()
+                    return waited
+            metrics.counter('breaker_waits_total').inc()
+            pause = remaining if cancelled is None else min(remaining, POLL)
+            self.sleep(pause)
+            waited += pause
+
+    def end_probe(self):
+        """lets the waiting callers on after a probe that neither succeeded
+        nor hit the quota, e.g. a network error; the next caller probes"""
+        with self.lock:
+            if self.probing == threading.get_ident():
+                self.probing = None
+                self.probed.notify_all()
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.cooldown = self.base_cooldown
+            self.state = 'closed'
+            self.probing = None
+            self.probed.notify_all()
+
+    def record_failure(self):
+        """counts a quota error, returns True if the breaker opened; while
+        half open only the probe's error counts, calls that were already in
+        flight don't reopen the breaker"""
+        with self.lock:
+            probe_failed = self.state == 'half_open' and \
+                self.probing == threading.get_ident()
+            if self.state == 'half_open' and not probe_failed:
+                return False
+            self.failures += 1
+            if probe_failed or self.failures >= self.failure_threshold:
+                if probe_failed:
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self.state = 'open'
+                self.open_until = self.clock() + self.cooldown
+                self.failures = 0
+                self.probing = None
+                self.probed.notify_all()
+                metrics.counter('breaker_opened_total').inc()
+                print('Over the Google API quota, pausing {:.0f} s.'
+                      .format(self.cooldown))
+                return True
+            return False
+
+
+class AIMDLimiter:
+    """
+    Additive increase, multiplicative decrease limit on calls in flight.
+
+    Every success adds increase / limit to the limit, so the limit grows by
+    about increase per round of calls.  Every quota error multiplies it by
+    decrease.  acquire blocks while the number of calls in flight is at the
+    limit.
+
+    Parameters
+    ----------
+    initial: float
+        starting limit
+    minimum: float
+        smallest limit
+    maximum: float
+        largest limit
+    increase: float
+        growth per round of successful calls
+    decrease: float
+        factor applied on a quota error
+    """
+    def __init__(self, initial=2.0, minimum=1.0, maximum=32.0, increase=1.0,
+                 decrease=0.5):
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.increase = increase
+        self.decrease = decrease
+        self.in_flight = 0
+        self.successes = 0
+        self.errors = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify()
+
+    def on_success(self):
+        with self.condition:
+            self.successes += 1
+            self.limit = min(self.maximum,
+                             self.limit + self.increase / self.limit)
+            self.condition.notify_all()
+        metrics.gauge('api_concurrency_limit').set(self.limit)
+
+    def on_quota(self):
+        with self.condition:
+            self.errors += 1
+            self.limit = max(self.minimum, self.limit * self.decrease)
+        metrics.gauge('api_concurrency_limit').set(self.limit)
+
+    def error_rate(self):
+        """fraction of calls that hit the quota so far"""
+        total = self.successes + self.errors
+        return self.errors / float(total) if total else 0.0
+
+
+class ResilientCaller:
+    """
+    Makes calls through a RetryPolicy, CircuitBreaker and AIMDLimiter.
+
+    Parameters
+    ----------
+    policy: RetryPolicy
+    breaker: CircuitBreaker
+    limiter: AIMDLimiter
+    sleep, clock: functions
+        time.sleep and time.time, replaceable for tests
+    """
+    def __init__(self, policy=None, breaker=None, limiter=None,
+                 sleep=time.sleep, clock=time.time):
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker(sleep=sleep, clock=clock)
+        self.limiter = limiter or AIMDLimiter()
+        self.sleep = sleep
+        self.clock = clock
+        self.cancelled = threading.Event()
+
+    def cancel(self):
+        """makes calls in progress, and new ones, give up before their next
+        attempt, e.g. once the quota ran out for one of several threads"""
+        self.cancelled.set()
+
+    def resume(self):
+        """undoes cancel"""
+        self.cancelled.clear()
+
+    def _pause(self, seconds):
+        """sleeps for seconds, in steps of POLL so cancel cuts it short"""
+        end = self.clock() + seconds
+        while not self.cancelled.is_set():
+            remaining = end - self.clock()
+            if remaining <= 0:
+                return
+            self.sleep(min(remaining, POLL))
+
+    def call(self, func, *args, **kwargs):
+        """
+        func(*args, **kwargs), retried on quota and transient errors
+
+        not_found and fatal errors are raised as they are, so the caller can
+        decide what to do about the address.  GaveUp is raised when retries
+        or the quota patience run out, and with kind 'cancelled' before any
+        attempt made after cancel.
+        """
+        attempt = 0
+        first_quota = None
+        last_error = None
+        try:
+            while True:
+                self.breaker.wait(self.cancelled)
+                if self.cancelled.is_set():
+                    raise GaveUp('cancelled', last_error)
+                self.limiter.acquire()
+                try:
+                    result = func(*args, **kwargs)
+                except Exception as error:
+                    last_error = error
+                    kind = classify(error)
+                    if kind != 'quota':
+                        self.breaker.end_probe()
+                    if kind in ('not_found', 'fatal'):
+                        raise
+                    if kind == 'quota':
+                        self.limiter.on_quota()
+                        self.breaker.record_failure()
+                        if first_quota is None:
+                            first_quota = self.clock()
+                        if self.clock() - first_quota > \
+                                self.policy.quota_patience:
+                            raise GaveUp(kind, error)
+                    elif attempt + 1 >= self.policy.max_attempts:
+                        raise GaveUp(kind, error)
+                    metrics.counter('api_backoff_total', kind=kind).inc()
+                    delay = self.policy.delay(attempt)
+                    attempt += 1
+                else:
+                    self.limiter.on_success()
+                    self.breaker.record_success()
+                    return result
+                finally:
+                    self.limiter.release()
+                self._pause(delay)
+        finally:
+            # a probe that ends any other way, e.g. cancelled, lets the
+            # waiting callers on
+            self.breaker.end_probe()
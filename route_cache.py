@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Local store of directions results keyed on the departure slot.
+
+get_travel_time results are kept in a SQLite file under the place routed,
+the leg, the mode and the departure_schedule slot key, e.g. 'Tuesday 08:00
+America/Los_Angeles', rather than the epoch second the call was made for.
+The same listing scraped again next week, or the same coordinates listed
+twice, is then answered from the store instead of another paid call:
+
+```
+import route_cache, google_api
+t = google_api.ATTGoogleAPI(route_cache=route_cache.RouteCache(
+    './dumped_data/routes.sqlite'))
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import time  # for time stamps
+import sqlite3  # the store itself
+import threading  # get_times may call from several threads
+import metrics  # cache hits and misses
+import google_api  # COORDINATES
+import geocode_store  # normalize_address
+
+
+def place_key(place):
+    """coordinates as they are, addresses normalized"""
+    if google_api.COORDINATES.match(place):
+        return place
+    return geocode_store.normalize_address(place)
+
+
+class RouteCache:
+    """
+    Persistent (place, leg, mode, slot) -> get_travel_time result map in
+    SQLite.  Only routes Google found are kept, failed look ups are tried
+    again next time.
+
+    Parameters
+    ----------
+    path: string
+        the SQLite file, ':memory:' for a throw away store
+    """
+    def __init__(self, path='./dumped_data/routes.sqlite'):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('CREATE TABLE IF NOT EXISTS routes ('
+                        'place TEXT, leg TEXT, mode TEXT, slot TEXT, '
+                        'start_address TEXT, start_location TEXT, '
+                        'end_address TEXT, end_location TEXT, '
+                        'duration REAL, duration_in_traffic REAL, '
+                        'updated REAL, '
+                        'PRIMARY KEY (place, leg, mode, slot))')
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.db.execute('SELECT COUNT(*) FROM routes') \
+                .fetchone()[0]
+
+    def get(self, place, leg, mode, slot):
+        """
+        the stored get_travel_time tuple for place, leg, mode and slot key,
+        None if there is none
+        """
+        with self.lock:
+            row = self.db.execute(
+                'SELECT start_address, start_location, end_address, '
+                'end_location, duration, duration_in_traffic FROM routes '
+                'WHERE place = ? AND leg = ? AND mode = ? AND slot = ?',
+                (place_key(place), leg, mode, slot)).fetchone()
+        metrics.counter('cache_requests_total', cache='routes',
+                        result='miss' if row is None else 'hit').inc()
+        if row is None:
+            return None
+        in_traffic = row[5]
+        if in_traffic is not None and in_traffic != float('inf'):
+            in_traffic = int(in_traffic)
+        return row[:4] + (int(row[4]), in_traffic)
+
+    def put(self, place, leg, mode, slot, data):
+        """stores what get_travel_time returned, replacing an older entry"""
+        if data is None:
+            return
+        with self.lock, self.db:
+            self.db.execute('INSERT OR REPLACE INTO routes VALUES '
+                            '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (place_key(place), leg, mode, slot) +
+                            tuple(data) + (time.time(),))
@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+"""
+Persistent task table for scraping many counties.
+
+Every zipcode of the shared_res county lists is a row of a SQLite table
+with its status, the number of attempts and when it was last scraped.
+Workers claim one zipcode at a time with a lease, so:
+
+- a scrape that was interrupted carries on with the zipcodes it hadn't done,
+  the zipcode it was in the middle of is claimed again once its lease runs
+  out
+- several processes, or machines sharing the file, can work on the same
+  table, each on the zipcodes it claims, optionally split into shards
+- zipcodes are scraped again once their last scrape is older than
+  refresh_days, the oldest first
+
+```
+import scrape_scheduler, gather_data
+tasks = scrape_scheduler.ScrapeScheduler('./dumped_data/tasks.sqlite')
+tasks.add_counties(['san_mateo', 'santa_clara'])
+gather_data.scrape_scheduled(tasks, shard=(0, 2))  # and (1, 2) elsewhere
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os  # for the default worker name
+import time  # for leases and scrape times
+import socket  # for the default worker name
+import sqlite3  # the task table
+import metrics  # tasks claimed and finished
+
+DEFAULT_LEASE = 30 * 60  # seconds a worker may take for one zipcode
+DEFAULT_REFRESH_DAYS = 7  # scrape a zipcode again after this long
+DEFAULT_MAX_ATTEMPTS = 3  # give up on a zipcode after this many failures
+STATUSES = ('pending', 'running', 'done', 'failed')
+
+
+def county_zipcodes(county):
+    """the zipcodes of county in shared_res, e.g. 'san_mateo'"""
+    import shared_res
+    return [zipcode for zipcode in getattr(shared_res,
+                                           county + '_county_zip')
+            if zipcode]
+
+
+def default_worker():
+    """'host:pid', unique among the workers sharing a table"""
+    return '{:s}:{:d}'.format(socket.gethostname(), os.getpid())
+
+
+class ScrapeScheduler:
+    """
+    Zipcodes to scrape, in a SQLite file shared by the workers.
+
+    Parameters
+    ----------
+    path: string
+        the SQLite file, created if needed
+    lease: integer
+        seconds a claimed zipcode stays with its worker
+    refresh_days: float
+        a zipcode done longer ago than this is due again, never if None
+    max_attempts: integer
+        failures, or leases run out, after which a zipcode isn't tried
+        again until reset
+    """
+    def __init__(self, path='./dumped_data/tasks.sqlite',
+                 lease=DEFAULT_LEASE, refresh_days=DEFAULT_REFRESH_DAYS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.path = path
+        self.lease = lease
+        self.refresh_days = refresh_days
+        self.max_attempts = max_attempts
+        # autocommit, transactions are begun by hand so a claim can take
+        # the write lock before it reads
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute('CREATE TABLE IF NOT EXISTS tasks ('
+                        'zipcode TEXT PRIMARY KEY, county TEXT, '
+                        "status TEXT DEFAULT 'pending', "
+                        'attempts INTEGER DEFAULT 0, last_scraped REAL, '
+                        'worker TEXT, lease_expires REAL, error TEXT)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS tasks_status '
+                        'ON tasks (status, last_scraped)')
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM tasks').fetchone()[0]
+
+    def add(self, zipcodes, county=None):
+        """adds zipcodes as pending tasks, ones already there are kept as
+        they are; returns how many were new"""
+        before = len(self)
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.executemany('INSERT OR IGNORE INTO tasks '
+                                '(zipcode, county) VALUES (?, ?)',
+                                [(str(zipcode), county)
+                                 for zipcode in zipcodes])
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        return len(self) - before
+
+    def add_counties(self, counties):
+        """adds the zipcodes of each county in shared_res, e.g.
+        ['san_mateo', 'santa_clara']"""
+        return sum(self.add(county_zipcodes(county), county)
+                   for county in counties)
+
+    def claim(self, worker=None, shard=None, now=None):
+        """
+        takes the next zipcode due for a scrape
+
+        Zipcodes never scraped come first, then the ones scraped longest
+        ago: pending ones, failed ones and running ones whose lease ran out
+        with attempts left, and done ones older than refresh_days.
+
+        Parameters
+        ----------
+        worker: string
+            who claims it, default_worker() if None
+        shard: (integer, integer)
+            (index, count) to only claim zipcodes whose number is index
+            modulo count, None for any
+        now: float
+            seconds since 1970, the current time if None
+
+        Returns
+        -------
+        string
+            the zipcode, None if nothing is due
+        """
+        worker = default_worker() if worker is None else worker
+        now = time.time() if now is None else now
+        due = ["status = 'pending'",
+               "(status = 'failed' AND attempts < :max_attempts)",
+               "(status = 'running' AND lease_expires < :now "
+               "AND attempts < :max_attempts)"]
+        if self.refresh_days is not None:
+            due.append("(status = 'done' AND last_scraped < :stale)")
+        query = 'SELECT zipcode FROM tasks WHERE (' + ' OR '.join(due) + ')'
+        if shard is not None:
+            query += ' AND CAST(zipcode AS INTEGER) % :count = :index'
+        query += ' ORDER BY last_scraped IS NOT NULL, last_scraped, ' \
+                 'zipcode LIMIT 1'
+        params = {'max_attempts': self.max_attempts, 'now': now,
+                  'stale': now - (self.refresh_days or 0) * 86400}
+        if shard is not None:
+            params['index'], params['count'] = shard
+        # the write lock is taken first so two workers can't both read the
+        # same zipcode as due
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            row = self.db.execute(query, params).fetchone()
+            if row is not None:
+                self.db.execute("UPDATE tasks SET status = 'running', "
+                                'worker = ?, lease_expires = ?, '
+                                'attempts = attempts + 1 WHERE zipcode = ?',
+                                (worker, now + self.lease, row[0]))
+            self.db.execute('COMMIT')
+        except Exception:
+            self.db.execute('ROLLBACK')
+            raise
+        if row is None:
+            return None
+        metrics.counter('scrape_tasks_total', outcome='claimed').inc()
+        return row[0]
+
+    def complete(self, zipcode, worker=None, now=None):
+        """marks zipcode scraped, if worker (default_worker() if None) still
+        holds it; returns True if it did"""
+        worker = default_worker() if worker is None else worker
+        now = time.time() if now is None else now
+        updated = self.db.execute(
+            "UPDATE tasks SET status = 'done', attempts = 0, "
+            'last_scraped = ?, worker = NULL, lease_expires = NULL, '
+            "error = NULL WHERE zipcode = ? AND status = 'running' "
+            'AND worker = ?', (now, zipcode, worker)).rowcount
+        metrics.counter('scrape_tasks_total',
+                        outcome='done' if updated else 'lost').inc()
+        return bool(updated)
+
+    def fail(self, zipcode, error=None, worker=None):
+        """marks the scrape of zipcode failed, if worker (default_worker()
+        if None) still holds it; it is tried again until it has failed
+        max_attempts times in a row.  Returns True if it was marked."""
+        worker = default_worker() if worker is None else worker
+        updated = self.db.execute(
+            "UPDATE tasks SET status = 'failed', worker = NULL, "
+            'lease_expires = NULL, error = ? WHERE zipcode = ? '
+            "AND status = 'running' AND worker = ?",
+            (None if error is None else str(error), zipcode,
+             worker)).rowcount
+        metrics.counter('scrape_tasks_total',
+                        outcome='failed' if updated else 'lost').inc()
+        return bool(updated)
+
+    def reset(self, status='failed'):
+        """makes every task with status pending again, attempts cleared;
+        returns how many there were"""
+        return self.db.execute("UPDATE tasks SET status = 'pending', "
+                               'attempts = 0, worker = NULL, '
+                               'lease_expires = NULL WHERE status = ?',
+                               (status,)).rowcount
+
+    def counts(self):
+        """number of tasks in each status"""
+        counts = dict((status, 0) for status in STATUSES)
+        counts.update(self.db.execute('SELECT status, COUNT(*) FROM tasks '
+                                      'GROUP BY status').fetchall())
+        return counts
@@ -32,6 +32,19 @@ pandas_column_names = ['zillow_id',
                        'morning_transit_duration',
                        'evening_transit_duration']
 
+# data types of the columns when read back from the scraped CSV files
+# everything scraped stays a string until ATTGoogleAPI.process_data converts
+# it, the google_* columns can hold lists, and the durations are seconds
+pandas_dtypes = dict([(name, str) for name in pandas_column_names
+                      if name.startswith('zillow_')] +
+                     [('date_scraped', str),
+                      ('location', str)] +
+                     [(name, object) for name in pandas_column_names
+                      if name.startswith('google_')] +
+                     [(name, float) for name in pandas_column_names
+                      if name.endswith('_duration') or
+                      name.endswith('_with_traffic')])
+
 
 # Grabbed from http://www.city-data.com/county/Santa_Clara_County-CA.html
 santa_clara_county_zip ='\
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""
+Mergeable quantile sketches of the commute and price columns.
+
+A median commute per zipcode otherwise needs a scan of the whole duration
+column, with the np.inf of failed routes mixed in with the travel times.
+Here every column is summarized as it is ingested by a QuantileSketch, a KLL
+sketch: a few hundred values kept per zipcode, region and column however
+many listings there are, which answer any quantile within about 1% of the
+rank.  Failed routes (np.inf) and listings without a travel time yet
+(np.nan) are counted next to the sketch instead of in it.  Sketches of
+different batches, shards or runs merge into the sketch of all of them:
+
+```
+import sketches, chunked
+s = sketches.SketchSet()
+chunked.process_dump('./dumped_data/', './dumped_data/analysis_all',
+                     sketches=s)
+s.save('./dumped_data/sketches.npz')
+s = sketches.SketchSet.load('./dumped_data/sketches.npz')
+s.merge(sketches.SketchSet.load('./other_machine/sketches.npz'))
+s.quantiles('zipcode', '94025', 'morning_drive_duration_with_traffic',
+            [0.5, 0.9])
+s.summary('zipcode', 'morning_drive_duration_with_traffic')
+```
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import os  # for the atomic save
+import numpy as np
+import pandas as pd
+import features  # regions of the listings
+import analysis_store  # region names
+
+DEFAULT_K = 200  # size of the largest compactor, rank error about 1.7/k
+# columns sketched by default, durations in seconds and prices in dollars
+COLUMNS = ['morning_drive_duration', 'morning_drive_duration_with_traffic',
+           'evening_drive_duration', 'evening_drive_duration_with_traffic',
+           'morning_transit_duration', 'evening_transit_duration',
+           'zillow_price']
+# ways the listings are grouped, 'all' is one group of every listing
+GROUPS = ('all', 'zipcode', 'region')
+_SHRINK = 2.0 / 3.0  # each compactor below the top is this much smaller
+
+
+class QuantileSketch:
+    """
+    KLL sketch of a stream of values, with the failures and missing values
+    counted beside it.
+
+    Values are kept in compactors, one per level, an item on level h
+    standing for 2 ** h values.  When a level is full it is sorted and
+    every other item, starting at a random one of the first two, moves up
+    a level, so memory stays around 3 * k items.
+
+    Parameters
+    ----------
+    k: integer
+        capacity of the top compactor, larger is more accurate
+    seed: integer
+        seed of the compaction coin flips
+
+    Attributes
+    ----------
+    n: integer
+        number of finite values sketched
+    failures: integer
+        number of np.inf (failed look ups) seen
+    missing: integer
+        number of np.nan (not looked up yet) seen
+    """
+    def __init__(self, k=DEFAULT_K, seed=0):
+        self.k = int(k)
+        self.rng = np.random.RandomState(seed)
+        self.levels = [np.zeros(0)]
+        self.n = 0
+        self.failures = 0
+        self.missing = 0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def __len__(self):
+        return self.n
+
+    def capacity(self, level):
+        """number of items level may hold before it is compacted"""
+        depth = len(self.levels) - 1 - level
+        return max(2, int(np.ceil(self.k * _SHRINK ** depth)))
+
+    def size(self):
+        """items kept"""
+        return sum(len(items) for items in self.levels)
+
+    def update(self, values):
+        """adds an array of values, np.inf counted as failures and np.nan as
+        missing"""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        nan = np.isnan(values)
+        finite = np.isfinite(values)
+        self.missing += int(nan.sum())
+        self.failures += int((~nan & ~finite).sum())
+        values = values[finite]
+        if len(values) == 0:
+            return
+        self.n += len(values)
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def _compress(self):
+        """compacts the lowest full level until none is full"""
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) <= self.capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.zeros(0))
+            items = np.sort(items)
+            # an odd item out stays behind
+            keep = items[:len(items) % 2]
+            paired = items[len(items) % 2:]
+            up = paired[self.rng.randint(2)::2]
+            self.levels[level] = keep
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1],
+                                                     up])
+            # capacities shrink as levels are added, start over from the
+            # bottom
+            level = 0
+
+    def merge(self, other):
+        """adds everything other sketched to this sketch"""
+        if other.k != self.k:
+            raise ValueError('cannot merge sketches with k {:d} and {:d}'
+                             .format(self.k, other.k))
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.zeros(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.failures += other.failures
+        self.missing += other.missing
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def quantiles(self, q):
+        """
+        approximate quantiles q (0 to 1) of the finite values, np.nan for
+        each if there are none; 0 and 1 are the exact minimum and maximum
+        """
+        q = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if self.n == 0:
+            return np.full(len(q), np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items_), 2.0 ** level)
+                                  for level, items_ in
+                                  enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        items = items[order]
+        cumulative = np.cumsum(weights[order])
+        rank = q * cumulative[-1]
+        found = items[np.minimum(np.searchsorted(cumulative, rank,
+                                                 side='left'),
+                                 len(items) - 1)]
+        found = np.where(q <= 0, self.min, found)
+        return np.where(q >= 1, self.max, found)
+
+
+def _region_names(df):
+    lat = pd.to_numeric(df['zillow_latitude'], errors='coerce').values
+    lng = pd.to_numeric(df['zillow_longitude'], errors='coerce').values
+    regions = np.asarray(analysis_store.REGIONS, dtype=object)
+    return regions[features.east_bay_mask(lat, lng).astype(np.int8)]
+
+
+def _zipcode_names(df):
+    zipcodes = pd.to_numeric(df['zillow_zipcode'], errors='coerce')
+    return zipcodes.map(lambda z: '{:d}'.format(int(z)),
+                        na_action='ignore').fillna('unknown').values
+
+
+class SketchSet:
+    """
+    A QuantileSketch per (group, key, column): per zipcode, per region and
+    of all the listings, for every column in columns.
+
+    Parameters
+    ----------
+    columns: list of strings
+        numeric listing columns to sketch, COLUMNS if None
+    k: integer
+        see QuantileSketch
+    seed: integer
+        seed of the first sketch, each new one gets the next
+    """
+    def __init__(self, columns=None, k=DEFAULT_K, seed=0):
+        self.columns = list(COLUMNS if columns is None else columns)
+        self.k = k
+        self.seed = seed
+        self.sketches = {}
+
+    def __len__(self):
+        return len(self.sketches)
+
+    def sketch(self, group, key, column):
+        """the sketch of column for key of group, created empty if new"""
+        name = (group, str(key), column)
+        if name not in self.sketches:
+            self.sketches[name] = QuantileSketch(
+                self.k, self.seed + len(self.sketches))
+        return self.sketches[name]
+
+    def ingest(self, df):
+        """adds the listings in df to every sketch they belong to, each
+        listing should be ingested once"""
+        keys = {'all': np.full(len(df), 'all', dtype=object),
+                'zipcode': _zipcode_names(df),
+                'region': _region_names(df)}
+        for column in self.columns:
+            if column not in df:
+                continue
+            values = pd.to_numeric(df[column], errors='coerce').values \
+                .astype(np.float64)
+            for group in GROUPS:
+                rows = pd.Series(keys[group]).groupby(keys[group]).indices
+                for key, positions in rows.items():
+                    self.sketch(group, key, column).update(values[positions])
+
+    def merge(self, other):
+        """adds every sketch of other, e.g. of another shard or run"""
+        for (group, key, column), sketch in other.sketches.items():
+            self.sketch(group, key, column).merge(sketch)
+        for column in other.columns:
+            if column not in self.columns:
+                self.columns.append(column)
+        return self
+
+    def quantiles(self, group, key, column, q=(0.25, 0.5, 0.75)):
+        """approximate quantiles q of column for key of group, np.nan if
+        nothing was sketched there"""
+        sketch = self.sketches.get((group, str(key), column))
+        if sketch is None:
+            return np.full(len(np.atleast_1d(q)), np.nan)
+        return sketch.quantiles(q)
+
+    def summary(self, group, column, q=(0.25, 0.5, 0.75)):
+        """
+        count, failures, missing and quantiles q of column for every key of
+        group, as a DataFrame indexed by key
+        """
+        rows = []
+        for (group_, key, column_), sketch in sorted(self.sketches.items()):
+            if group_ != group or column_ != column:
+                continue
+            rows.append([key, sketch.n, sketch.failures, sketch.missing] +
+                        list(sketch.quantiles(q)))
+        names = [group, 'count', 'failures', 'missing'] + \
+            ['q{:g}'.format(100 * p) for p in np.atleast_1d(q)]
+        return pd.DataFrame(rows, columns=names).set_index(group)
+
+    def save(self, path):
+        """writes every sketch to an .npz file, replaced whole"""
+        names, counts, extremes, level_sizes, items = [], [], [], [], []
+        for name, sketch in sorted(self.sketches.items()):
+            names.append('|'.join(name))
+            counts.append([sketch.n, sketch.failures, sketch.missing,
+                           len(sketch.levels)])
+            extremes.append([sketch.min, sketch.max])
+            level_sizes.extend(len(level) for level in sketch.levels)
+            items.extend(sketch.levels)
+        partial = path + '.part'
+        with open(partial, 'wb') as out:
+            np.savez_compressed(
+                out, names=np.array(names, dtype=str),
+                counts=np.array(counts, dtype=np.int64).reshape(-1, 4),
+                extremes=np.array(extremes, dtype=np.float64).reshape(-1, 2),
+                level_sizes=np.array(level_sizes, dtype=np.int64),
+                items=np.concatenate(items) if items else np.zeros(0),
+                columns=np.array(self.columns, dtype=str),
+                k=self.k, seed=self.seed)
+        os.replace(partial, path)
+
+    @classmethod
+    def load(cls, path):
+        """reads sketches written by save"""
+        with np.load(path) as saved:
+            sketch_set = cls(list(saved['columns']), int(saved['k']),
+                             int(saved['seed']))
+            sizes = iter(saved['level_sizes'])
+            items = saved['items']
+            start = 0
+            for i, name in enumerate(saved['names']):
+                n, failures, missing, n_levels = saved['counts'][i]
+                sketch = QuantileSketch(sketch_set.k, sketch_set.seed + i)
+                sketch.levels = []
+                for _ in range(n_levels):
+                    size = next(sizes)
+                    sketch.levels.append(items[start:start + size].copy())
+                    start += size
+                sketch.n, sketch.failures, sketch.missing = \
+                    int(n), int(failures), int(missing)
+                sketch.min, sketch.max = saved['extremes'][i]
+                sketch_set.sketches[tuple(str(name).split('|'))] = sketch
+        return sketch_set
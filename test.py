@@ -5,7 +5,7 @@
 # Set up the imports to run the scrape.
 from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
-from BeautifulSoup import BeautifulSoup
+from bs4 import BeautifulSoup
 import shared_res
 import pandas as pd
 import numpy as np
@@ -19,7 +19,7 @@ driver          = webdriver.Firefox()
 driver.get(page_to_load)
 current_page    = driver.page_source
 # soup            = BeautifulSoup(current_page, features="html5lib")
-soup            = BeautifulSoup(current_page)
+soup            = BeautifulSoup(current_page, 'html.parser')
 
 
 # deprecated_zip  = soup.findAll("div", {"class":"deprecated-zipcode"})
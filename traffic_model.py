@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+"""Time of day traffic profiles for the commute to and from SLAC.
+
+ATTGoogleAPI asks Google for one morning and one evening departure time.
+Asking for every listing at every time of day would cost a call per
+listing per time.  Instead a sparse set of listings in each region is
+routed at departure times spread over the day (plan_samples,
+collect_samples), and the ratio of duration_in_traffic to the free flow
+duration is fitted per region and leg as a function of the time of day
+(TrafficProfiles.fit).  A listing's commute at any departure time is then
+its known free flow duration times its region's ratio at that time, for
+every listing at once, and the best departure time in a window is the
+minimum of each region's profile:
+
+```
+import google_api, traffic_model
+t = google_api.ATTGoogleAPI()
+samples = traffic_model.collect_samples(
+    t, traffic_model.plan_samples(t.df, per_region=100))
+profiles = traffic_model.TrafficProfiles.fit(samples)
+profiles.save('./dumped_data/traffic_profiles.npz')
+when, seconds = profiles.best_departure(
+    t.df['morning_drive_duration'].values,
+    traffic_model.listing_regions(t.df), 'morning', '07:00', '09:30')
+```
+
+Times of day are seconds since local midnight, on the weekday and in the
+timezone of the api's departure_schedule slots, and samples are made for
+the next such day.
+"""
+
+__license__ = "GPL"
+__version__ = "0.0"
+__status__ = "Development"
+
+import time  # for the query timing
+import numpy as np
+import pandas as pd
+import features  # region of each listing
+import metrics  # samples collected
+import resilience  # GaveUp when the quota runs out
+import analysis_store  # region names
+
+DEFAULT_BIN_MINUTES = 15  # width of a profile bin
+# departure times sampled, every half hour from 5:00 to 21:30
+DEFAULT_SLOTS = list(range(5 * 3600, 22 * 3600, 1800))
+LEGS = ('morning', 'evening')  # to SLAC and from SLAC
+DAY = 86400  # seconds
+
+
+def parse_time_of_day(text):
+    """seconds since midnight of an 'HH:MM' string, or of a number"""
+    if isinstance(text, str):
+        hours, minutes = text.split(':')
+        return int(hours) * 3600 + int(minutes) * 60
+    return int(text)
+
+
+def format_time_of_day(seconds):
+    """'HH:MM' of seconds since midnight"""
+    seconds = int(seconds) % DAY
+    return '{:02d}:{:02d}'.format(seconds // 3600, (seconds % 3600) // 60)
+
+
+def listing_regions(df):
+    """index into analysis_store.REGIONS of the region of every listing"""
+    lat = pd.to_numeric(df['zillow_latitude'], errors='coerce').values
+    lng = pd.to_numeric(df['zillow_longitude'], errors='coerce').values
+    return features.east_bay_mask(lat, lng).astype(np.int8)
+
+
+def plan_samples(df, per_region=50, slots=None, legs=LEGS, seed=0):
+    """
+    which listings to route at which departure times: per_region random
+    listings with coordinates from each region, each leg, dealt out over
+    the slots so every slot of every region gets about the same number
+
+    Parameters
+    ----------
+    df: pandas DataFrame
+        processed listings
+    per_region: integer
+        listings sampled per region and leg, one call each
+    slots: list of integers
+        departure times sampled, seconds since midnight, defaults to
+        DEFAULT_SLOTS
+    legs: list of strings
+        'morning' and/or 'evening'
+    seed: integer
+        seed for picking the listings
+
+    Returns
+    -------
+    pandas DataFrame
+        row (position in df), region, leg and slot of each call to make
+    """
+    slots = DEFAULT_SLOTS if slots is None else slots
+    rng = np.random.RandomState(seed)
+    regions = listing_regions(df)
+    lat = pd.to_numeric(df['zillow_latitude'], errors='coerce').values
+    lng = pd.to_numeric(df['zillow_longitude'], errors='coerce').values
+    located = np.isfinite(lat) & np.isfinite(lng)
+    plans = []
+    for leg in legs:
+        for region in range(len(analysis_store.REGIONS)):
+            candidates = np.flatnonzero(located & (regions == region))
+            if len(candidates) == 0:
+                continue
+            rows = rng.choice(candidates, per_region,
+                              replace=len(candidates) < per_region)
+            # the slots in a random order, repeated, so each slot gets
+            # per_region / len(slots) listings
+            order = rng.permutation(len(slots))
+            picked = np.asarray(slots)[order[np.arange(per_region) %
+                                             len(slots)]]
+            plans.append(pd.DataFrame({'row': rows, 'region': region,
+                                       'leg': leg, 'slot': picked}))
+    if not plans:
+        return pd.DataFrame(columns=['row', 'region', 'leg', 'slot'])
+    return pd.concat(plans, ignore_index=True)
+
+
+def collect_samples(api, plan):
+    """
+    routes every planned listing at its slot with driving directions
+
+    Parameters
+    ----------
+    api: google_api.ATTGoogleAPI
+        with the listings plan was made from in api.df
+    plan: pandas DataFrame
+        from plan_samples, the slots are times of day of api.schedule
+
+    Returns
+    -------
+    pandas DataFrame
+        the plan with the duration and duration_in_traffic Google gave,
+        np.nan where no route was found
+    """
+    locations = api.route_locations(
+        plan['row'].values, list(api.full_addresses(plan['row'].values)))
+    durations = np.full(len(plan), np.nan)
+    in_traffic = np.full(len(plan), np.nan)
+    try:
+        for i, (location, leg, slot) in enumerate(
+                zip(locations, plan['leg'], plan['slot'])):
+            data = api.get_travel_time(
+                location=location, departure_time=api.schedule.slot(leg, slot),
+                mode='driving', leg=leg)
+            metrics.counter('traffic_samples_total',
+                            outcome='ok' if data else 'no_route').inc()
+            if data is not None:
+                durations[i] = data[4]
+                in_traffic[i] = data[5]
+    except resilience.GaveUp as err:
+        if err.kind != 'quota':
+            raise
+        print('Calls to the Google API are being rejected, keeping the '
+              'samples collected so far.')
+    samples = plan.copy()
+    samples['duration'] = durations
+    samples['duration_in_traffic'] = in_traffic
+    return samples
+
+
+class TrafficProfiles:
+    """
+    Ratio of the commute in traffic to the free flow commute, per region
+    and leg, in bins over the day.
+
+    Parameters
+    ----------
+    ratios: array
+        (len(analysis_store.REGIONS), len(LEGS), bins per day) ratios
+    bin_minutes: integer
+        width of a bin
+    samples: array
+        the number of samples behind each ratio, 0 for filled in bins
+    """
+    def __init__(self, ratios, bin_minutes=DEFAULT_BIN_MINUTES,
+                 samples=None):
+        self.ratios = np.asarray(ratios, dtype=np.float64)
+        self.bin_minutes = int(bin_minutes)
+        if samples is None:
+            samples = np.zeros(self.ratios.shape, dtype=np.int64)
+        self.samples = np.asarray(samples)
+
+    @classmethod
+    def fit(cls, samples, bin_minutes=DEFAULT_BIN_MINUTES):
+        """
+        the median ratio of each bin with samples, interpolated around the
+        clock over the bins without; a region and leg without any samples
+        gets the profile of all the regions on that leg
+
+        Parameters
+        ----------
+        samples: pandas DataFrame
+            from collect_samples
+        bin_minutes: integer
+            width of a bin
+
+        Returns
+        -------
+        TrafficProfiles
+        """
+        n_bins = DAY // (bin_minutes * 60)
+        n_regions = len(analysis_store.REGIONS)
+        ratios = np.ones((n_regions, len(LEGS), n_bins))
+        counts = np.zeros((n_regions, len(LEGS), n_bins), dtype=np.int64)
+        ratio = (samples['duration_in_traffic'] /
+                 samples['duration']).values.astype(float)
+        good = np.isfinite(ratio) & (ratio > 0)
+        bins = (samples['slot'].values.astype(np.int64) % DAY) // \
+            (bin_minutes * 60)
+        legs = samples['leg'].map(dict((leg, i) for i, leg in
+                                       enumerate(LEGS))).values
+        regions = samples['region'].values.astype(np.int64)
+        for leg in range(len(LEGS)):
+            on_leg = good & (legs == leg)
+            pooled = cls._profile(bins[on_leg], ratio[on_leg], n_bins)
+            for region in range(n_regions):
+                mask = on_leg & (regions == region)
+                counts[region, leg] = np.bincount(bins[mask],
+                                                  minlength=n_bins)
+                profile = cls._profile(bins[mask], ratio[mask], n_bins)
+                if profile is None:
+                    profile = pooled
+                if profile is not None:  # else no traffic, a ratio of 1
+                    ratios[region, leg] = profile
+        return cls(ratios, bin_minutes, counts)
+
+    @staticmethod
+    def _profile(bins, ratio, n_bins):
+        """median ratio per bin, interpolated over the day, None if there
+        are no samples at all"""
+        if len(ratio) == 0:
+            return None
+        medians = pd.Series(ratio).groupby(bins).median()
+        known = medians.index.values
+        # periodic interpolation: the day wraps around midnight
+        return np.interp(np.arange(n_bins), known, medians.values,
+                         period=n_bins)
+
+    def save(self, path):
+        """writes the profiles to an .npz file"""
+        np.savez(path, ratios=self.ratios, bin_minutes=self.bin_minutes,
+                 samples=self.samples)
+
+    @classmethod
+    def load(cls, path):
+        """reads profiles written by save"""
+        with np.load(path) as saved:
+            return cls(saved['ratios'], int(saved['bin_minutes']),
+                       saved['samples'])
+
+    def ratio(self, regions, leg, departure):
+        """
+        traffic ratio of each region at each departure time, seconds since
+        midnight, linearly interpolated between bin centers; regions and
+        departure broadcast against each other
+        """
+        width = self.bin_minutes * 60.0
+        n_bins = self.ratios.shape[2]
+        position = (np.asarray(departure, dtype=np.float64) % DAY) / width \
+            - 0.5
+        low = np.floor(position).astype(np.int64)
+        frac = position - low
+        profile = self.ratios[:, LEGS.index(leg)]
+        regions = np.asarray(regions, dtype=np.int64)
+        return profile[regions, low % n_bins] * (1 - frac) + \
+            profile[regions, (low + 1) % n_bins] * frac
+
+    def predict(self, durations, regions, leg, departure):
+        """
+        duration_in_traffic of each listing at each departure time
+
+        Parameters
+        ----------
+        durations: array
+            free flow duration of each listing, e.g. the
+            morning_drive_duration column
+        regions: array
+            region of each listing, see listing_regions
+        leg: string
+            'morning' or 'evening'
+        departure: integer, string or array
+            seconds since midnight or 'HH:MM', one for all listings or one
+            per listing
+
+        Returns
+        -------
+        numpy array
+            predicted seconds in traffic
+        """
+        if isinstance(departure, str):
+            departure = parse_time_of_day(departure)
+        return np.asarray(durations, dtype=np.float64) * \
+            self.ratio(regions, leg, departure)
+
+    def best_departure(self, durations, regions, leg, earliest, latest,
+                       step=300):
+        """
+        departure time between earliest and latest with the shortest
+        predicted commute for every listing
+
+        The ratio only depends on the region, so the search is over the
+        profile of each region and not over the listings.
+
+        Parameters
+        ----------
+        durations: array
+            free flow duration of each listing
+        regions: array
+            region of each listing, see listing_regions
+        leg: string
+            'morning' or 'evening'
+        earliest, latest: integer or string
+            the window, seconds since midnight or 'HH:MM'
+        step: integer
+            seconds between the departure times tried
+
+        Returns
+        -------
+        departure: numpy array
+            best departure time of each listing, seconds since midnight
+        seconds: numpy array
+            predicted commute in traffic at that time
+        """
+        start_time = time.time()
+        times = np.arange(parse_time_of_day(earliest),
+                          parse_time_of_day(latest) + 1, step)
+        n_regions = self.ratios.shape[0]
+        grid = self.ratio(np.arange(n_regions)[:, None], leg, times[None, :])
+        best = np.argmin(grid, axis=1)
+        regions = np.asarray(regions, dtype=np.int64)
+        departure = times[best][regions]
+        seconds = np.asarray(durations, dtype=np.float64) * \
+            grid[np.arange(n_regions), best][regions]
+        metrics.histogram('traffic_query_seconds').observe(
+            time.time() - start_time)
+        return departure, seconds